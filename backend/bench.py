@@ -0,0 +1,109 @@
+"""
+Minimal benchmark harness and headless fakes for the benchmark suite.
+
+Each benchmark is timed over several rounds and the best per-call time is
+compared against a stored baseline. Timing is only enforced with
+MAPLE_BENCH=1, so an ordinary test run never depends on machine speed;
+then a benchmark fails when it is slower than
+baseline * (1 + MAPLE_BENCH_TOLERANCE). MAPLE_BENCH_SAVE=1 writes the
+current results as the baseline; nothing else writes the file.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import types
+from typing import Callable, Optional
+
+from midi_output import FakeMidiOut
+
+BASELINE_FILE = os.environ.get("MAPLE_BENCH_BASELINE", os.path.join(os.path.dirname(__file__), "bench_baseline.json"))
+TOLERANCE = float(os.environ.get("MAPLE_BENCH_TOLERANCE", "0.5"))
+# Wall-clock assertions are opt-in; shared CI machines are too noisy for them
+TIMING = os.environ.get("MAPLE_BENCH") == "1"
+SAVE = os.environ.get("MAPLE_BENCH_SAVE") == "1"
+
+
+def install_fake_rtmidi():
+    """Makes `import rtmidi` resolve to FakeMidiOut so engines can be built without MIDI hardware."""
+    if "rtmidi" not in sys.modules:
+        sys.modules["rtmidi"] = types.SimpleNamespace(MidiOut=FakeMidiOut)
+
+
+class FakeWebSocket:
+    """
+    In-process stand-in for a FastAPI WebSocket; optional per-send delay
+    models a slow client, and `record` keeps what was sent for assertions.
+    """
+
+    def __init__(self, delay: float = 0.0, record: bool = False):
+        self.delay = delay
+        self.sent = 0
+        self.bytes = 0
+        self.closed = False
+        self.received: Optional[list] = [] if record else None
+
+    async def accept(self):
+        pass
+
+    async def _send(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent += 1
+        self.bytes += len(data)
+        if self.received is not None:
+            self.received.append(data)
+
+    async def send_text(self, data: str):
+        await self._send(data)
+
+    async def send_bytes(self, data: bytes):
+        await self._send(data)
+
+    def messages(self) -> list:
+        """Recorded JSON messages, decoded; binary frames are skipped."""
+        return [json.loads(m) for m in self.received if isinstance(m, str)]
+
+    async def close(self):
+        self.closed = True
+
+
+def measure(fn: Callable[[], object], rounds: int = 5, iterations: int = 1) -> dict:
+    """Runs fn `iterations` times per round and returns per-call timings in seconds."""
+    fn()  # Warm-up
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        times.append((time.perf_counter() - start) / iterations)
+    return {"min": min(times), "median": statistics.median(times), "rounds": rounds, "iterations": iterations}
+
+
+def load_baseline(path: str = BASELINE_FILE) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def check(name: str, result: dict, path: str = BASELINE_FILE, tolerance: Optional[float] = None) -> Optional[str]:
+    """Returns a failure message if `result` regressed past the baseline; records it with MAPLE_BENCH_SAVE=1."""
+    tolerance = TOLERANCE if tolerance is None else tolerance
+    baseline = load_baseline(path)
+    if SAVE:
+        baseline[name] = result
+        with open(path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return None
+    previous = baseline.get(name)
+    if not TIMING or previous is None:
+        return None
+    limit = previous["min"] * (1 + tolerance)
+    if result["min"] > limit:
+        return (f"{name}: {result['min'] * 1e6:.1f} µs/call vs baseline {previous['min'] * 1e6:.1f} µs "
+                f"(limit {limit * 1e6:.1f} µs)")
+    return None
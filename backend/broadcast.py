@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional, Union
+
+from fastapi import WebSocket
+
+from metrics import BROADCAST_LATENCY, DROPS, QUEUE_DEPTH
+from pulse_stream import PulseStream, clamp_fps
+
+logger = logging.getLogger("maple.broadcast")
+
+# Visual-only messages that may be discarded when a client falls behind
+DROPPABLE_TYPES = frozenset({"pulse", "stem_pulse"})
+
+Payload = Union[str, bytes]
+
+
+def serialize(message: dict) -> str:
+    # Same wire format as WebSocket.send_json, but done once per broadcast
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ClientConnection:
+    """
+    One WebSocket with a bounded outgoing queue drained by its own writer task.
+
+    overflow="drop_oldest" discards the oldest droppable message to make room;
+    if nothing in the queue is droppable the client is considered dead.
+    overflow="disconnect" drops the client as soon as its queue is full.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int = 256, overflow: str = "drop_oldest",
+                 send_timeout: float = 2.0):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.queue: deque = deque()
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+        # Set when the client has opted into binary pulse frames
+        self.pulse_stream: Optional[PulseStream] = None
+        self._ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+
+    def enqueue(self, payload: Payload, droppable: bool = False) -> bool:
+        """Queues a payload without waiting. Returns False if the client should be dropped."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if self.overflow != "drop_oldest":
+                return False
+            if not self._drop_oldest():
+                if droppable:
+                    self.dropped += 1
+                    DROPS.inc("client_queue")
+                    return True
+                return False
+        QUEUE_DEPTH.observe(len(self.queue))
+        self.queue.append((payload, droppable, time.perf_counter()))
+        self._ready.set()
+        return True
+
+    def _drop_oldest(self) -> bool:
+        for i, (_, droppable, _) in enumerate(self.queue):
+            if droppable:
+                del self.queue[i]
+                self.dropped += 1
+                DROPS.inc("client_queue")
+                return True
+        return False
+
+    async def run_writer(self, on_dead):
+        ws = self.websocket
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                payload, _, queued_at = self.queue.popleft()
+                if isinstance(payload, bytes):
+                    send = ws.send_bytes(payload)
+                else:
+                    send = ws.send_text(payload)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+                BROADCAST_LATENCY.observe(time.perf_counter() - queued_at)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Dropping client after send failure: {e!r}")
+            on_dead(self)
+
+
+class ConnectionManager:
+    def __init__(self, max_queue: int = 256, overflow: str = "drop_oldest", send_timeout: float = 2.0,
+                 droppable_types=DROPPABLE_TYPES):
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.droppable_types = droppable_types
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.pulse_streams: Dict[int, PulseStream] = {}
+        self.stats = {"broadcasts": 0, "disconnected": 0}
+
+    async def connect(self, websocket: WebSocket) -> ClientConnection:
+        await websocket.accept()
+        client = ClientConnection(websocket, self.max_queue, self.overflow, self.send_timeout)
+        client.writer = asyncio.create_task(client.run_writer(self._drop))
+        self.clients[websocket] = client
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        client.closed = True
+        # Lets the writer exit even if its cancellation is lost inside wait_for
+        client._ready.set()
+        self.unsubscribe_pulses(websocket, client)
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def _drop(self, client: ClientConnection):
+        if self.clients.get(client.websocket) is not client:
+            return
+        self.disconnect(client.websocket)
+        self.stats["disconnected"] += 1
+        DROPS.inc("client_disconnect")
+        # Closing makes the endpoint's receive loop exit too
+        asyncio.ensure_future(self._close(client.websocket))
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queues a message for a single client, keeping it ordered with broadcasts."""
+        client = self.clients.get(websocket)
+        if client and not client.enqueue(serialize(message)):
+            self._drop(client)
+
+    def broadcast(self, message: dict):
+        """Serializes once and queues for every client. Never waits on the network."""
+        if not self.clients:
+            return
+        droppable = message.get("type") in self.droppable_types
+        payload = None
+        self.stats["broadcasts"] += 1
+        for client in list(self.clients.values()):
+            if droppable and client.pulse_stream is not None:
+                continue  # Gets these packed into its binary frames instead
+            if payload is None:
+                payload = serialize(message)
+            if not client.enqueue(payload, droppable):
+                logger.warning("Client queue overflowed with undroppable messages; disconnecting")
+                self._drop(client)
+
+    def broadcast_pulse(self, lobe_id: int, note: int, velocity: int, t: float):
+        for stream in self.pulse_streams.values():
+            stream.add_pulse(lobe_id, note, velocity, t)
+        self.broadcast({"type": "pulse", "lobe_id": lobe_id, "note": note, "velocity": velocity})
+
+    def broadcast_stem_pulse(self, timestamp: float):
+        for stream in self.pulse_streams.values():
+            stream.add_stem_pulse()
+        self.broadcast({"type": "stem_pulse", "timestamp": timestamp})
+
+    def subscribe_pulses(self, websocket: WebSocket, fps) -> int:
+        """Moves a client onto the binary pulse stream at the negotiated frame rate."""
+        client = self.clients.get(websocket)
+        if client is None:
+            return 0
+        fps = clamp_fps(fps)
+        self.unsubscribe_pulses(websocket, client)
+        stream = self.pulse_streams.get(fps)
+        if stream is None:
+            stream = self.pulse_streams[fps] = PulseStream(fps)
+        stream.subscribers.add(client)
+        client.pulse_stream = stream
+        if stream.task is None or stream.task.done():
+            stream.task = asyncio.create_task(stream.run(self._emit_frame))
+        return fps
+
+    def unsubscribe_pulses(self, websocket: WebSocket, client: Optional[ClientConnection] = None):
+        client = client or self.clients.get(websocket)
+        if client is None or client.pulse_stream is None:
+            return
+        stream = client.pulse_stream
+        stream.subscribers.discard(client)
+        client.pulse_stream = None
+        if not stream.subscribers:
+            self.pulse_streams.pop(stream.fps, None)
+            if stream.task:
+                stream.task.cancel()
+
+    def _emit_frame(self, stream: PulseStream, frame: bytes):
+        for client in list(stream.subscribers):
+            client.enqueue(frame, droppable=True)
+
+    def queue_stats(self) -> dict:
+        return {
+            **self.stats,
+            "clients": len(self.clients),
+            "queue_depths": [len(c.queue) for c in self.clients.values()],
+            "dropped": sum(c.dropped for c in self.clients.values()),
+            "pulse_streams": {fps: len(s.subscribers) for fps, s in self.pulse_streams.items()},
+        }
@@ -0,0 +1,282 @@
+"""
+Clock sources and phase-locked tempo following.
+
+A clock source reports MIDI realtime messages (24 ppqn ticks, start, stop,
+continue) stamped with the monotonic clock on its own input thread.
+ClockSync runs every tick through a second-order PLL and publishes a beat
+grid (anchor time + tempo) once per beat, which the generator aligns to.
+
+MAPLE_CLOCK selects the source: "internal" (default, free-running on
+AppState.tempo), "midi[:<port index>]" or "software[:<bpm>]".
+"""
+import logging
+import random
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger("maple.clock")
+
+TICKS_PER_BEAT = 24
+CLOCK_TICK = 0xF8
+CLOCK_START = 0xFA
+CLOCK_CONTINUE = 0xFB
+CLOCK_STOP = 0xFC
+TRANSPORT = {CLOCK_START: "start", CLOCK_CONTINUE: "continue", CLOCK_STOP: "stop"}
+
+PHASE_ERROR = metrics.histogram(
+    "maple_clock_phase_error_seconds", "Absolute error between predicted and received clock ticks.")
+RECOVERY_TIME = metrics.histogram(
+    "maple_clock_recovery_seconds", "Time from losing clock lock to regaining it.",
+    (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0))
+
+
+class Grid(NamedTuple):
+    """Beat grid published once per beat: filtered time of the beat, tempo and beat number."""
+    anchor: float
+    tempo: float
+    beat: int
+    locked: bool
+
+
+class PhaseLockedLoop:
+    """
+    Second-order PLL over tick timestamps. `alpha` pulls the phase toward
+    each received tick and `beta` trims the period, so jitter is smoothed
+    while tempo drift is followed. Lock is dropped when a tick misses by
+    twice `lock_threshold` and regained after `lock_ticks` consecutive ticks
+    within it; a jump larger than `unlock_threshold` reseeds the loop.
+    """
+
+    def __init__(self, alpha: float = 0.1, beta: float = 0.005, lock_threshold: float = 0.002,
+                 lock_ticks: int = TICKS_PER_BEAT, unlock_threshold: float = 0.02):
+        self.alpha = alpha
+        self.beta = beta
+        self.lock_threshold = lock_threshold
+        self.lock_ticks = lock_ticks
+        self.unlock_threshold = unlock_threshold
+        self.reset()
+
+    def reset(self):
+        self.period: Optional[float] = None
+        self.predicted: Optional[float] = None
+        self.phase: Optional[float] = None
+        self.last: Optional[float] = None
+        self.locked = False
+        self.good = 0
+        self.lost_at: Optional[float] = None
+        self.error = 0.0
+
+    @property
+    def tempo(self) -> Optional[float]:
+        return 60.0 / (self.period * TICKS_PER_BEAT) if self.period else None
+
+    def update(self, t: float) -> Optional[float]:
+        """Feeds one tick timestamp; returns the phase error, or None while seeding."""
+        last, self.last = self.last, t
+        if last is None:
+            self.lost_at = t
+            return None
+        if self.period is None:
+            self._seed(t, t - last)
+            return None
+
+        err = t - self.predicted
+        limit = max(self.unlock_threshold, self.period * 0.5)
+        if abs(err) > limit:
+            # Tempo jump or dropout: start over from the raw interval
+            if self.locked:
+                self.locked = False
+                self.lost_at = t
+            self._seed(t, t - last)
+            self.error = err
+            return err
+
+        self.period += self.beta * err
+        self.phase = self.predicted + self.alpha * err
+        self.predicted = self.phase + self.period
+        self.error = err
+        if abs(err) < self.lock_threshold:
+            self.good += 1
+            if not self.locked and self.good >= self.lock_ticks:
+                self.locked = True
+                if self.lost_at is not None:
+                    RECOVERY_TIME.observe(t - self.lost_at)
+                    self.lost_at = None
+        else:
+            self.good = 0
+            if self.locked and abs(err) >= 2 * self.lock_threshold:
+                self.locked = False
+                self.lost_at = t
+        return err
+
+    def _seed(self, t: float, interval: float):
+        self.period = interval if interval > 0 else self.period
+        self.phase = t
+        self.predicted = t + self.period
+        self.good = 0
+
+
+class InternalClock:
+    """No external reference; the generator free-runs on AppState.tempo."""
+
+    def start(self, callback: Callable[[int, float], None]):
+        pass
+
+    def stop(self):
+        pass
+
+
+class MidiClockInput:
+    """MIDI clock from an input port. rtmidi calls back on its own input thread."""
+
+    def __init__(self, port: int = 0, backend_factory=None):
+        self.port = port
+        self.backend_factory = backend_factory
+        self.midi_in = None
+        self._callback = None
+
+    def start(self, callback: Callable[[int, float], None]):
+        factory = self.backend_factory
+        if factory is None:
+            import rtmidi
+            factory = rtmidi.MidiIn
+        self._callback = callback
+        self.midi_in = factory()
+        self.midi_in.ignore_types(sysex=True, timing=False, active_sense=True)
+        self.midi_in.set_callback(self._on_message)
+        self.midi_in.open_port(self.port)
+        logger.info(f"Listening for MIDI clock on input {self.port}")
+
+    def _on_message(self, event, data=None):
+        stamp = time.monotonic()
+        status = event[0][0]
+        if status == CLOCK_TICK or status in TRANSPORT:
+            self._callback(status, stamp)
+
+    def stop(self):
+        if self.midi_in is not None:
+            self.midi_in.cancel_callback()
+            self.midi_in.close_port()
+            self.midi_in = None
+
+
+class SoftwareClock:
+    """Local stand-in for an external clock: a thread sending start and 24 ppqn ticks, with optional jitter."""
+
+    def __init__(self, bpm: float = 120.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self.bpm = bpm
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, callback: Callable[[int, float], None]):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(callback,), name="maple-soft-clock", daemon=True)
+        self._thread.start()
+
+    def _run(self, callback):
+        callback(CLOCK_START, time.monotonic())
+        deadline = time.monotonic()
+        while self._running:
+            deadline += 60.0 / (self.bpm * TICKS_PER_BEAT)
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            callback(CLOCK_TICK, time.monotonic() + self.rng.uniform(-self.jitter, self.jitter))
+        callback(CLOCK_STOP, time.monotonic())
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(1.0)
+            self._thread = None
+
+
+def make_clock_source(spec: str):
+    kind, _, arg = (spec or "internal").partition(":")
+    if kind == "midi":
+        return MidiClockInput(int(arg or 0))
+    if kind == "software":
+        return SoftwareClock(float(arg or 120))
+    if kind != "internal":
+        logger.warning(f"Unknown clock source {spec!r}; using the internal clock")
+    return InternalClock()
+
+
+class ClockSync:
+    """
+    Follows a clock source. Ticks are filtered on the source's thread and the
+    resulting Grid is swapped in with one assignment; transport messages and
+    grid updates are handed to the event loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, source=None, on_transport: Optional[Callable[[str], None]] = None,
+                 on_grid: Optional[Callable[[Grid], None]] = None, pll: Optional[PhaseLockedLoop] = None):
+        self.source = source or InternalClock()
+        self.on_transport = on_transport
+        self.on_grid = on_grid
+        self.pll = pll or PhaseLockedLoop()
+        self.grid: Optional[Grid] = None
+        self.ticks = 0
+        self.stats = {"ticks": 0, "starts": 0, "stops": 0, "continues": 0}
+        self.loop = None
+
+    @property
+    def external(self) -> bool:
+        return not isinstance(self.source, InternalClock)
+
+    def start(self, loop=None):
+        self.loop = loop
+        self.source.start(self.on_message)
+
+    def stop(self):
+        self.source.stop()
+
+    def _dispatch(self, fn, *args):
+        if fn is None:
+            return
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(fn, *args)
+        else:
+            fn(*args)
+
+    def on_message(self, status: int, t: float):
+        """Runs on the input thread."""
+        if status == CLOCK_TICK:
+            self.stats["ticks"] += 1
+            err = self.pll.update(t)
+            if err is not None:
+                PHASE_ERROR.observe(abs(err))
+            if self.ticks % TICKS_PER_BEAT == 0 and self.pll.phase is not None:
+                self.grid = Grid(self.pll.phase, self.pll.tempo, self.ticks // TICKS_PER_BEAT, self.pll.locked)
+                self._dispatch(self.on_grid, self.grid)
+            self.ticks += 1
+            return
+        kind = TRANSPORT.get(status)
+        if kind is None:
+            return
+        self.stats[kind + "s"] += 1
+        if kind == "start":
+            # Start means beat one on the next tick
+            self.ticks = 0
+        self._dispatch(self.on_transport, kind)
+
+    def tempo_for(self, fallback: float) -> float:
+        """The followed tempo; the last known one while the clock is missing, else `fallback`."""
+        grid = self.grid
+        return grid.tempo if grid is not None else fallback
+
+    def summary(self) -> dict:
+        pll = self.pll
+        return {
+            **self.stats,
+            "source": type(self.source).__name__,
+            "locked": pll.locked,
+            "tempo": pll.tempo,
+            "phase_error_ms": pll.error * 1000.0,
+            "beat": self.grid.beat if self.grid else None,
+        }
@@ -0,0 +1,344 @@
+"""
+Runs FractalLogic and MidiEngine in their own process.
+
+The FastAPI process publishes every state version, and the beat grid of
+the external clock it follows, into a shared-memory state block (seqlock
+protected JSON) and reads note/stem events back from a shared-memory ring
+of fixed-size records. MAPLE_ENGINE picks the generator as in the server. The worker is started as an
+independent session, so a stalled or restarting UI process doesn't stop
+the music; the next UI process simply re-attaches.
+
+    python engine_process.py          # run the engine worker
+    python engine_process.py --stop   # ask a running worker to shut down
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("maple.engine_process")
+
+STATE_BLOCK = "maple_state"
+EVENT_RING = "maple_events"
+STATE_BLOCK_SIZE = 1 << 20
+EVENT_RING_CAPACITY = 8192
+
+# State block header: seqlock counter (odd while writing), payload length, control flags
+STATE_HEADER = struct.Struct("<QII")
+CONTROL_STOP = 1
+
+# Event ring header: write index, read index, dropped count, capacity
+RING_HEADER = struct.Struct("<QQQI")
+RING_HEADER_SIZE = 64
+# Record: time f64, lobe_id u16, note u8, velocity u8, kind u8, padding
+RECORD = struct.Struct("<dHBBB3x")
+KIND_NOTE = 0
+KIND_STEM = 1
+
+
+def _open_shm(name: str, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    if create:
+        try:
+            # A crashed worker can leave a stale block behind
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    shm = shared_memory.SharedMemory(name=name)
+    # Attaching processes must not unlink the owner's block when they exit
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedStateBlock:
+    """Single-writer state block; readers retry when they catch a write in progress."""
+
+    def __init__(self, name: str = STATE_BLOCK, create: bool = False, size: int = STATE_BLOCK_SIZE):
+        self.shm = _open_shm(name, create, size)
+        self.owner = create
+        self.buf = self.shm.buf
+        if create:
+            STATE_HEADER.pack_into(self.buf, 0, 0, 0, 0)
+
+    def write(self, data: dict):
+        payload = json.dumps(data, separators=(",", ":")).encode()
+        if STATE_HEADER.size + len(payload) > len(self.buf):
+            raise ValueError(f"State of {len(payload)} bytes does not fit the shared block")
+        seq, _, control = STATE_HEADER.unpack_from(self.buf, 0)
+        STATE_HEADER.pack_into(self.buf, 0, seq + 1, 0, control)
+        self.buf[STATE_HEADER.size:STATE_HEADER.size + len(payload)] = payload
+        STATE_HEADER.pack_into(self.buf, 0, seq + 2, len(payload), control)
+
+    def read(self, last_seq: int = -1) -> Tuple[int, Optional[dict]]:
+        """Returns (seq, data); data is None when unchanged since `last_seq` or mid-write."""
+        seq, length, _ = STATE_HEADER.unpack_from(self.buf, 0)
+        if seq == last_seq or seq & 1 or length == 0:
+            return last_seq, None
+        payload = bytes(self.buf[STATE_HEADER.size:STATE_HEADER.size + length])
+        if STATE_HEADER.unpack_from(self.buf, 0)[0] != seq:
+            return last_seq, None
+        return seq, json.loads(payload)
+
+    def _set_control(self, flag: int):
+        seq, length, control = STATE_HEADER.unpack_from(self.buf, 0)
+        STATE_HEADER.pack_into(self.buf, 0, seq, length, control | flag)
+
+    def request_stop(self):
+        self._set_control(CONTROL_STOP)
+
+    def stop_requested(self) -> bool:
+        return bool(STATE_HEADER.unpack_from(self.buf, 0)[2] & CONTROL_STOP)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class EventRing:
+    """Single-producer/single-consumer ring of fixed-size event records in shared memory."""
+
+    def __init__(self, name: str = EVENT_RING, create: bool = False, capacity: int = EVENT_RING_CAPACITY):
+        size = RING_HEADER_SIZE + capacity * RECORD.size
+        self.shm = _open_shm(name, create, size)
+        self.owner = create
+        self.buf = self.shm.buf
+        if create:
+            RING_HEADER.pack_into(self.buf, 0, 0, 0, 0, capacity)
+        self.capacity = RING_HEADER.unpack_from(self.buf, 0)[3]
+
+    def push(self, kind: int, lobe_id: int, note: int, velocity: int, t: float) -> bool:
+        write, read, dropped, cap = RING_HEADER.unpack_from(self.buf, 0)
+        if write - read >= cap:
+            struct.pack_into("<Q", self.buf, 16, dropped + 1)
+            return False
+        RECORD.pack_into(self.buf, RING_HEADER_SIZE + (write % cap) * RECORD.size, t, lobe_id, note, velocity, kind)
+        struct.pack_into("<Q", self.buf, 0, write + 1)
+        return True
+
+    def drain(self, max_items: int = 4096) -> List[tuple]:
+        write, read, _, cap = RING_HEADER.unpack_from(self.buf, 0)
+        n = min(write - read, max_items)
+        items = [RECORD.unpack_from(self.buf, RING_HEADER_SIZE + ((read + i) % cap) * RECORD.size) for i in range(n)]
+        struct.pack_into("<Q", self.buf, 8, read + n)
+        return items
+
+    def skip(self):
+        write = struct.unpack_from("<Q", self.buf, 0)[0]
+        struct.pack_into("<Q", self.buf, 8, write)
+
+    @property
+    def dropped(self) -> int:
+        return RING_HEADER.unpack_from(self.buf, 0)[2]
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_worker(state_name: str = STATE_BLOCK, ring_name: str = EVENT_RING, backend_factory=None,
+               poll: float = 0.005, spin: float = 0.001):
+    """Engine loop: follows the shared state, plays MIDI and reports events until asked to stop."""
+    from fractal_logic import make_logic
+    from midi_engine import MidiEngine
+    from state_manager import AppState, StateManager
+
+    block = SharedStateBlock(state_name, create=True)
+    ring = EventRing(ring_name, create=True)
+    engine = MidiEngine(backend_factory)
+    # MAPLE_JOURNAL records what the worker plays, as the in-process engine does
+    journal = None
+    if os.environ.get("MAPLE_JOURNAL"):
+        from journal import Journal
+        journal = engine.journal = Journal(os.environ["MAPLE_JOURNAL"], prefix="maple-worker")
+    logic = make_logic()
+    states = StateManager(history=1)
+    if journal is not None:
+        states.subscribe(journal.on_state_commit)
+    seq = -1
+    last_state = None
+    # [anchor, tempo, beat, locked] of the external clock, forwarded by the UI process;
+    # monotonic time is system-wide, so the anchor holds here too
+    grid = None
+    tempo = states.state.tempo
+    playing = False
+    port = states.state.selected_midi_port
+    logger.info("Engine worker running")
+    try:
+        while not block.stop_requested():
+            seq, data = block.read(seq)
+            if data is not None:
+                changed = data["state"] != last_state
+                if changed:
+                    last_state = data["state"]
+                    state = states.replace_state(AppState.from_dict(last_state)).state
+                    if state.selected_midi_port != port:
+                        engine.open_port(state.selected_midi_port)
+                        port = state.selected_midi_port
+                    if state.playing and not playing:
+                        logic.reset_engine()
+                    elif playing and not state.playing:
+                        engine.all_notes_off()
+                    playing = state.playing
+                if changed or data.get("clock") != grid:
+                    grid = data.get("clock")
+                    tempo = grid[1] if grid else states.state.tempo
+                    if changed:
+                        logic.reschedule(tempo, states.snapshot.plan)
+                    if grid and playing:
+                        logic.align(grid[0], tempo, states.snapshot.plan)
+
+            # Sleep to the next deadline, but never longer than the state poll interval;
+            # only a real note or note-off deadline is worth spinning for
+            now = time.monotonic()
+            deadline = None
+            for d in (logic.next_deadline() if playing else None, engine.next_note_off()):
+                if d is not None and d < now + poll and (deadline is None or d < deadline):
+                    deadline = d
+            if deadline is None:
+                time.sleep(poll)
+            else:
+                if deadline - now > spin:
+                    time.sleep(deadline - now - spin)
+                while time.monotonic() < deadline:
+                    pass
+
+            engine.flush_note_offs()
+            if not playing:
+                continue
+            snapshot = states.snapshot
+            for event in logic.tick(tempo, snapshot.plan, snapshot.state.selected_notes):
+                if event['type'] == 'note':
+                    out = engine.send_note_on(event['channel'], event['note'], event['velocity'], event['port'],
+                                              event['lobe_id'])
+                    engine.schedule_note_off(event['channel'], event['note'], event['time'] + event['duration'],
+                                             out, event['lobe_id'])
+                    if journal is not None:
+                        journal.note_on(event['time'], event['channel'], event['note'], event['velocity'],
+                                        event['lobe_id'], engine.port_index(event['port']))
+                    ring.push(KIND_NOTE, event['lobe_id'], event['note'], event['velocity'], event['time'])
+                elif event['type'] == 'stem_pulse':
+                    if journal is not None:
+                        journal.stem(event['time'])
+                    ring.push(KIND_STEM, 0, 0, 0, event['timestamp'])
+            logic.refill()
+    finally:
+        logger.info("Engine worker stopping")
+        engine.all_notes_off()
+        engine.close()
+        if journal is not None:
+            journal.close()
+        block.close()
+        ring.close()
+
+
+class EngineClient:
+    """UI-side handle: publishes state versions and pumps worker events to the browsers."""
+
+    def __init__(self, state_name: str = STATE_BLOCK, ring_name: str = EVENT_RING):
+        self.state_name = state_name
+        self.ring_name = ring_name
+        self.block: Optional[SharedStateBlock] = None
+        self.ring: Optional[EventRing] = None
+        self.snapshot = None
+        self.grid = None
+
+    def attach(self) -> bool:
+        try:
+            self.block = SharedStateBlock(self.state_name)
+            self.ring = EventRing(self.ring_name)
+        except FileNotFoundError:
+            if self.block:
+                self.block.close()
+                self.block = None
+            return False
+        # Events produced while no UI was attached are stale
+        self.ring.skip()
+        return True
+
+    def start(self, timeout: float = 5.0) -> bool:
+        """Attaches to a running worker, spawning a detached one if there is none. Blocks; run it in a thread."""
+        if self.attach():
+            logger.info("Attached to running engine worker")
+            return True
+        here = os.path.dirname(os.path.abspath(__file__))
+        subprocess.Popen([sys.executable, os.path.join(here, "engine_process.py")], cwd=here,
+                         start_new_session=True)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            if self.attach():
+                logger.info("Spawned engine worker")
+                return True
+        logger.error("Engine worker did not come up")
+        return False
+
+    def current_state(self) -> Optional[dict]:
+        """The state the worker is playing, so a restarted UI can pick up where it left off."""
+        _, data = self.block.read()
+        return data["state"] if data else None
+
+    def publish(self, snapshot, delta=None):
+        self.snapshot = snapshot
+        try:
+            self.block.write({"version": snapshot.version, "state": snapshot.state.to_dict(),
+                              "clock": list(self.grid) if self.grid is not None else None})
+        except ValueError as e:
+            # Runs as a state listener; the worker keeps playing the last state that fit
+            logger.error(f"Could not publish state {snapshot.version} to the engine worker: {e}")
+
+    def publish_grid(self, grid):
+        """Forwards a new beat grid of the external clock; the worker snaps to it as the in-process engine does."""
+        self.grid = grid
+        if self.block is not None and self.snapshot is not None:
+            self.publish(self.snapshot)
+
+    async def pump(self, manager, interval: float = 1 / 120):
+        while True:
+            for t, lobe_id, note, velocity, kind in self.ring.drain():
+                if kind == KIND_NOTE:
+                    manager.broadcast_pulse(lobe_id, note, velocity, t)
+                else:
+                    manager.broadcast_stem_pulse(t)
+            await asyncio.sleep(interval)
+
+    def stop_worker(self):
+        self.block.request_stop()
+
+    def close(self):
+        for part in (self.block, self.ring):
+            if part:
+                part.close()
+        self.block = self.ring = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maple engine worker process.")
+    parser.add_argument("--stop", action="store_true", help="Stop a running worker")
+    args = parser.parse_args(argv)
+    if args.stop:
+        client = EngineClient()
+        if not client.attach():
+            print("No engine worker running")
+            return
+        client.stop_worker()
+        client.close()
+        return
+    run_worker()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,11 +2,16 @@ import random
 import time
 import math
 import logging
+import os
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+from scheduler import DeadlineQueue
 
 logger = logging.getLogger("maple.fractal")
 
+STEM = "stem"
+
 @dataclass
 class Lobe:
     id: int
@@ -25,85 +30,179 @@ class Lobe:
             # Default C Major pentatonic
             self.scale = [60, 62, 64, 67, 69]
 
+def register_pool(scale: List[int], register: str) -> List[int]:
+    """Filters the scale to the lobe's register."""
+    if register == "low":
+        return [n for n in scale if n < 72]
+    if register == "high":
+        return [n for n in scale if n >= 72]
+    return list(scale)
+
+def beat_interval(tempo: int, division: float) -> float:
+    return (60.0 / tempo) / max(0.1, division)
+
 class FractalLogic:
-    def __init__(self):
+    """
+    Deadline-driven generator. Every lobe (and the stem) has its next beat
+    computed ahead of time on the monotonic clock and kept in a priority
+    queue, so the caller can sleep exactly until `next_deadline()`.
+    """
+
+    def __init__(self, clock=time.monotonic, rng=None):
+        # Both are injectable so offline renders are deterministic
+        self.clock = clock
+        self.rng = rng or random
         self.reset_engine()
 
     def reset_engine(self):
         """Resets all internal phases and timers for a clean start."""
-        self.last_tick = time.time()
-        self.last_stem_pulse = 0
-        # Clear all dynamic phase attributes
-        for attr in list(vars(self).keys()):
-            if attr.startswith("lobe_phase_"):
-                setattr(self, attr, 0.0)
+        now = self.clock()
+        self.last_tick = now
+        self.start_time = now
+        # Last beat time per lobe id; deadlines are derived from these
+        self.last_beat: Dict = {}
+        self.deadlines = DeadlineQueue()
+        self._scheduled: Dict = {}
+        # Stem fires immediately on start
+        self.last_beat[STEM] = None
+        self._schedule(STEM, now)
         logger.info("FractalLogic: Engine Reset")
-        
-    def tick(self, tempo: int, lobes: List, global_scale: List[int]):
+
+    def _schedule(self, key, deadline: float):
+        self._scheduled[key] = deadline
+        self.deadlines.push(deadline, key)
+
+    def reschedule(self, tempo: int, lobes: List):
+        """Recomputes every pending deadline after tempo/division edits."""
+        self.deadlines.clear()
+        self._scheduled.clear()
+        now = self.clock()
+        stem_last = self.last_beat.get(STEM)
+        self._schedule(STEM, now if stem_last is None else stem_last + 60.0 / tempo)
+        for lobe in lobes:
+            if not lobe.active:
+                continue
+            last = self.last_beat.get(lobe.id, self.start_time)
+            self._schedule(lobe.id, last + beat_interval(tempo, lobe.division))
+
+    def align(self, anchor: float, tempo: float, lobes: List):
+        """
+        Snaps every pending deadline to the nearest point of an external beat
+        grid (a beat at `anchor`, at `tempo`). Beats that already fired are
+        never repeated.
+        """
+        pending = dict(self._scheduled)
+        self.deadlines.clear()
+        self._scheduled.clear()
+        targets = [(STEM, 60.0 / tempo)]
+        targets.extend((lobe.id, beat_interval(tempo, lobe.division)) for lobe in lobes if lobe.active)
+        for key, interval in targets:
+            deadline = pending.get(key)
+            if deadline is None:
+                last = self.last_beat.get(key, self.start_time)
+                deadline = self.clock() if last is None else last + interval
+            snapped = anchor + round((deadline - anchor) / interval) * interval
+            last = self.last_beat.get(key)
+            if last is not None and snapped <= last + interval * 0.5:
+                snapped += interval
+            self._schedule(key, snapped)
+
+    def next_deadline(self) -> Optional[float]:
+        return self.deadlines.peek()
+
+    def tick(self, tempo: int, lobes: List, global_scale: List[int], now: Optional[float] = None):
+        """
+        Fires every lobe whose deadline has passed. Each event carries the
+        scheduled monotonic `time` it was due at, which may be slightly
+        earlier than `now`.
+        """
         # Use only the global scale. Empty scale means silence.
         scale = global_scale if global_scale is not None else []
-            
+
         events = []
-        now = time.time()
-        dt = now - self.last_tick
+        if now is None:
+            now = self.clock()
         self.last_tick = now
-        
-        # Stem Pulse Logic
-        pulse_interval = 60.0 / tempo
-        if not hasattr(self, 'last_stem_pulse'):
-            self.last_stem_pulse = 0
-            
-        if now - self.last_stem_pulse >= pulse_interval:
-            self.last_stem_pulse = now
-            events.append({
-                "type": "stem_pulse",
-                "timestamp": now
-            })
-
-        # Lobe Generation Logic
-        for lobe in lobes:
-            if not lobe.active:
+        by_id = {lobe.id: lobe for lobe in lobes}
+
+        for deadline, key in self.deadlines.pop_due(now):
+            if self._scheduled.get(key) != deadline:
+                continue  # Stale entry superseded by reschedule()
+
+            if key == STEM:
+                interval = 60.0 / tempo
+                self.last_beat[STEM] = deadline
+                self._schedule(STEM, self._advance(deadline, interval, now))
+                events.append({
+                    "type": "stem_pulse",
+                    "timestamp": time.time(),
+                    "time": deadline
+                })
                 continue
-            
-            # Phase Tracking for rhythm
-            phase_key = f"lobe_phase_{lobe.id}"
-            if not hasattr(self, phase_key):
-                setattr(self, phase_key, 0.0)
-            
-            div = max(0.1, lobe.division)
-            beat_interval = (60.0 / tempo) / div
-            
-            current_phase = getattr(self, phase_key)
-            new_phase = current_phase + dt
-            
-            if new_phase >= beat_interval:
-                setattr(self, phase_key, new_phase % beat_interval)
-                
-                # Filter scale based on register
-                lobe_scale = scale
-                if lobe.register == "low":
-                    lobe_scale = [n for n in scale if n < 72]
-                elif lobe.register == "high":
-                    lobe_scale = [n for n in scale if n >= 72]
-
-                if lobe_scale and random.random() < lobe.probability:
-                    base_note = random.choice(lobe_scale)
-                    note = max(0, min(127, base_note + lobe.transpose))
-                    
-                    velocity = max(0, min(127, lobe.velocity))
-                    duration = beat_interval * 0.8
-                    
-                    events.append({
-                        "type": "note",
-                        "lobe_id": lobe.id,
-                        "channel": lobe.instrument_channel,
-                        "note": note,
-                        "velocity": velocity,
-                        "duration": duration
-                    })
-            else:
-                setattr(self, phase_key, new_phase)
-                
+
+            lobe = by_id.get(key)
+            if lobe is None or not lobe.active:
+                del self._scheduled[key]
+                continue
+
+            interval = beat_interval(tempo, lobe.division)
+            self.last_beat[key] = deadline
+            self._schedule(key, self._advance(deadline, interval, now))
+
+            # Compiled plans (state_manager.LobePlan) carry a pre-filtered pool
+            lobe_scale = getattr(lobe, "pool", None)
+            if lobe_scale is None:
+                lobe_scale = register_pool(scale, lobe.register)
+
+            note = self._choose_note(lobe, lobe_scale)
+            if note is not None:
+                velocity = max(0, min(127, lobe.velocity))
+                duration = interval * 0.8
+
+                events.append({
+                    "type": "note",
+                    "lobe_id": lobe.id,
+                    "channel": lobe.instrument_channel,
+                    "port": lobe.output_port,
+                    "note": note,
+                    "velocity": velocity,
+                    "duration": duration,
+                    "time": deadline
+                })
+
         return events
 
+    def _choose_note(self, lobe, pool) -> Optional[int]:
+        """The note a due lobe plays, or None to rest."""
+        if pool and self.rng.random() < lobe.probability:
+            return max(0, min(127, self.rng.choice(pool) + lobe.transpose))
+        return None
+
+    def refill(self):
+        """Called between ticks; generators that prepare notes ahead do it here."""
+
+    @staticmethod
+    def _advance(deadline: float, interval: float, now: float) -> float:
+        """Next beat on the grid; beats missed during a stall are skipped, not replayed."""
+        nxt = deadline + interval
+        if nxt <= now:
+            nxt += math.floor((now - nxt) / interval + 1) * interval
+        return nxt
+
+def make_logic(engine: Optional[str] = None, clock=time.monotonic, seed: Optional[int] = None):
+    """
+    Builds the generator named by `engine` (MAPLE_ENGINE when None): "vector"
+    for the NumPy engine, "phrase" for L-system phrases, anything else for
+    independent per-beat draws. A seed makes the draws repeatable.
+    """
+    if engine is None:
+        engine = os.environ.get("MAPLE_ENGINE", "random")
+    if engine == "vector":
+        from vector_engine import VectorLobeEngine
+        return VectorLobeEngine(clock=clock, seed=seed)
+    if engine == "phrase":
+        from phrase import PhraseLogic
+        return PhraseLogic(clock=clock, seed=seed or 0)
+    return FractalLogic(clock=clock, rng=random.Random(seed) if seed is not None else None)
+
 fractal_logic = FractalLogic()
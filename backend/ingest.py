@@ -0,0 +1,206 @@
+"""
+Ingestion stage for UI control messages.
+
+update_lobe / update_global payloads are checked against schemas compiled
+once at import, reduced to the keys that actually change and merged per
+lobe and key. The merged edits go in as one state version, so one
+broadcast, per flush: at the next generator tick, or `window` seconds after
+the first queued edit when nothing is ticking.
+
+The newest message wins: a value equal to the committed one cancels any
+pending edit of that key, whoever queued it (a slider dragged back, or
+play pressed and then stop by someone else). Clients therefore send only
+the keys they change.
+
+Whole states (client uploads, state files, presets) go through the same
+schemas with `validate_state()` before they reach AppState.from_dict.
+"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from metrics import metrics
+from state_manager import GLOBAL_FIELDS, LOBE_FIELDS, StateManager
+
+logger = logging.getLogger("maple.ingest")
+
+MESSAGE_TYPES = ("update_lobe", "update_global")
+
+CONTROL_MESSAGES = metrics.counter(
+    "maple_control_messages_total", "UI control messages by outcome (queued, merged, rejected).", "outcome")
+
+
+def _int(lo: int, hi: int) -> Callable:
+    # type() rather than isinstance(): JSON true/false must not pass as 1/0
+    return lambda v: type(v) is int and lo <= v <= hi
+
+
+def _number(lo: float, hi: float) -> Callable:
+    return lambda v: type(v) in (int, float) and lo <= v <= hi
+
+
+def _bool(v) -> bool:
+    return type(v) is bool
+
+
+def _text(max_len: int) -> Callable:
+    return lambda v: type(v) is str and len(v) <= max_len
+
+
+def _choice(*options: str) -> Callable:
+    return lambda v: type(v) is str and v in options
+
+
+def _optional(check: Callable) -> Callable:
+    return lambda v: v is None or check(v)
+
+
+def _notes(v) -> bool:
+    return type(v) is list and len(v) <= 128 and all(type(n) is int and 0 <= n <= 127 for n in v)
+
+
+LOBE_SCHEMA = {
+    "name": _text(128),
+    "active": _bool,
+    "probability": _number(0.0, 1.0),
+    "instrument_channel": _int(0, 15),
+    "division": _number(0.1, 64.0),
+    "transpose": _int(-48, 48),
+    "velocity": _int(0, 127),
+    "register": _choice("all", "low", "high"),
+    "output_port": _optional(_text(256)),
+}
+GLOBAL_SCHEMA = {
+    "tempo": _int(20, 400),
+    "selected_midi_port": _int(0, 255),
+    "selected_notes": _notes,
+    "playing": _bool,
+}
+assert set(LOBE_SCHEMA) == set(LOBE_FIELDS) and set(GLOBAL_SCHEMA) == set(GLOBAL_FIELDS)
+
+
+def validate(schema: Dict[str, Callable], payload: dict) -> Optional[str]:
+    """First schema violation in `payload`, or None. Unknown keys are ignored."""
+    for key, value in payload.items():
+        check = schema.get(key)
+        if check is not None and not check(value):
+            return f"invalid {key}: {value!r}"
+    return None
+
+
+def validate_state(data) -> Optional[str]:
+    """First schema violation in a whole-state dict, or None. Lobes must be listed in id order."""
+    if type(data) is not dict:
+        return "state must be an object"
+    error = validate(GLOBAL_SCHEMA, data)
+    if error is not None:
+        return error
+    lobes = data.get("lobes", [])
+    if type(lobes) is not list:
+        return "lobes must be a list"
+    for i, lobe in enumerate(lobes):
+        if type(lobe) is not dict:
+            return f"lobe {i} must be an object"
+        if type(lobe.get("id")) is not int or lobe["id"] != i:
+            return f"lobe {i} has id {lobe.get('id')!r}"
+        if "name" not in lobe:
+            return f"lobe {i} has no name"
+        error = validate(LOBE_SCHEMA, lobe)
+        if error is not None:
+            return f"lobe {i}: {error}"
+    return None
+
+
+class Ingest:
+    """Validates, merges and applies one session's control messages."""
+
+    def __init__(self, states: StateManager, on_apply: Optional[Callable[[dict], None]] = None,
+                 window: Optional[float] = 0.01):
+        self.states = states
+        # on_apply(global changes) runs after each merged commit, for port and transport side effects
+        self.on_apply = on_apply
+        # None leaves flushing entirely to the caller
+        self.window = window
+        # Pending edits: key -> value
+        self.lobes: Dict[int, Dict[str, Any]] = {}
+        self.globals: Dict[str, Any] = {}
+        self._timer = None
+        self.stats = {"received": 0, "merged": 0, "rejected": 0, "commits": 0}
+
+    def submit(self, msg: dict) -> Optional[str]:
+        """Queues one update message. Returns why it was rejected, or None."""
+        self.stats["received"] += 1
+        state = self.states.state
+        if msg.get("type") == "update_lobe":
+            payload = msg.get("lobe")
+            if type(payload) is not dict:
+                return self._reject("lobe must be an object")
+            lobe_id = payload.get("id")
+            if type(lobe_id) is not int or not 0 <= lobe_id < len(state.lobes):
+                return self._reject(f"unknown lobe {lobe_id!r}")
+            error = validate(LOBE_SCHEMA, payload)
+            if error is not None:
+                return self._reject(error)
+            pending = self.lobes.get(lobe_id)
+            merged = pending is not None
+            if pending is None:
+                pending = self.lobes[lobe_id] = {}
+            self._merge(pending, LOBE_SCHEMA, payload, state.lobes[lobe_id])
+            if not pending:
+                del self.lobes[lobe_id]
+        else:
+            payload = msg.get("updates")
+            if type(payload) is not dict:
+                return self._reject("updates must be an object")
+            error = validate(GLOBAL_SCHEMA, payload)
+            if error is not None:
+                return self._reject(error)
+            merged = bool(self.globals)
+            self._merge(self.globals, GLOBAL_SCHEMA, payload, state)
+
+        if merged:
+            self.stats["merged"] += 1
+            CONTROL_MESSAGES.inc("merged")
+        else:
+            CONTROL_MESSAGES.inc("queued")
+        if self._timer is None and self.window is not None and (self.lobes or self.globals):
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return None
+
+    @staticmethod
+    def _merge(pending: dict, schema: dict, payload: dict, current):
+        for key, value in payload.items():
+            if key not in schema:
+                continue
+            if getattr(current, key) != value:
+                pending[key] = value
+            else:
+                pending.pop(key, None)  # Set back to what is committed
+
+    def _reject(self, reason: str) -> str:
+        self.stats["rejected"] += 1
+        CONTROL_MESSAGES.inc("rejected")
+        logger.debug(f"Rejected control message: {reason}")
+        return reason
+
+    def flush(self) -> bool:
+        """Applies everything pending as one state version. Returns False if nothing was pending."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.lobes and not self.globals:
+            return False
+        lobes, changes = self.lobes, self.globals
+        self.lobes, self.globals = {}, {}
+        self.states.update_many(lobes, changes)
+        self.stats["commits"] += 1
+        if self.on_apply is not None:
+            self.on_apply(changes)
+        return True
+
+    def close(self):
+        """Drops pending edits and the flush timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.lobes, self.globals = {}, {}
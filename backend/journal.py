@@ -0,0 +1,286 @@
+"""
+Append-only, memory-mapped event journal and replay tool.
+
+Every record is a fixed 32-byte slot stamped with the monotonic clock:
+note-ons, note-offs, stem pulses, panics and state commits. A state record
+is followed by raw slots holding its JSON payload. Files rotate once they
+reach `max_bytes`; unwritten space stays zero, which readers treat as the end.
+Files are never overwritten, and each session journals under its own prefix
+(`maple-<session id>`, `maple-worker` for the engine worker); replay one
+prefix at a time.
+
+    python journal.py dump journal/maple-default-*.mlj
+    python journal.py replay journal/maple-default-*.mlj --speed 2 --out replay.mid
+    python journal.py replay journal/maple-default-*.mlj --port 1
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger("maple.journal")
+
+MAGIC = b"MAPLEJN1"
+SLOT = 32
+# File header: magic, wall-clock and monotonic time at creation, slot size
+FILE_HEADER = struct.Struct("<8sddI4x")
+# Record: time, kind, channel, note, velocity, lobe_id, port, state version, payload length
+RECORD = struct.Struct("<dBBBBHhII4x")
+
+NOTE_ON = 1
+NOTE_OFF = 2
+STEM = 3
+PANIC = 4
+STATE = 5
+KIND_NAMES = {NOTE_ON: "note_on", NOTE_OFF: "note_off", STEM: "stem_pulse", PANIC: "panic", STATE: "state"}
+
+NO_LOBE = 0xFFFF
+
+
+class JournalEvent(NamedTuple):
+    t: float
+    kind: int
+    channel: int
+    note: int
+    velocity: int
+    lobe_id: Optional[int]
+    port: Optional[int]
+    version: int
+    payload: Optional[dict]
+
+
+class Journal:
+    """Single-writer journal; call from the event loop thread only."""
+
+    def __init__(self, directory: str = "journal", max_bytes: int = 64 << 20, prefix: str = "maple"):
+        self.directory = directory
+        self.max_bytes = max(SLOT * 2, max_bytes - max_bytes % SLOT)
+        self.prefix = prefix
+        self.files: List[str] = []
+        self.records = 0
+        self._sequence = 0
+        self._file = None
+        self._map = None
+        self._pos = 0
+        os.makedirs(directory, exist_ok=True)
+        self._rotate()
+
+    def _rotate(self):
+        self._close_file()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        while True:
+            path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{self._sequence:04d}.mlj")
+            self._sequence += 1
+            try:
+                # Exclusive create: a restart within the same second must not truncate the last journal
+                self._file = open(path, "x+b")
+                break
+            except FileExistsError:
+                continue
+        self._file.truncate(self.max_bytes)
+        self._map = mmap.mmap(self._file.fileno(), self.max_bytes)
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, time.time(), time.monotonic(), SLOT)
+        self._pos = SLOT
+        self.files.append(path)
+        logger.info(f"Journal writing to {path}")
+
+    def append(self, kind: int, t: float, channel: int = 0, note: int = 0, velocity: int = 0,
+               lobe_id: int = NO_LOBE, port: int = -1, version: int = 0):
+        if self._pos + SLOT > self.max_bytes:
+            self._rotate()
+        RECORD.pack_into(self._map, self._pos, t, kind, channel, note, velocity, lobe_id, port, version, 0)
+        self._pos += SLOT
+        self.records += 1
+
+    def note_on(self, t: float, channel: int, note: int, velocity: int, lobe_id=None, port=None):
+        self.append(NOTE_ON, t, channel, note, velocity, NO_LOBE if lobe_id is None else lobe_id,
+                    -1 if port is None else port)
+
+    def note_off(self, t: float, channel: int, note: int, lobe_id=None):
+        self.append(NOTE_OFF, t, channel, note, 0, NO_LOBE if lobe_id is None else lobe_id)
+
+    def stem(self, t: float):
+        self.append(STEM, t)
+
+    def panic(self, t: float):
+        self.append(PANIC, t)
+
+    def state(self, t: float, version: int, payload: dict):
+        data = json.dumps(payload, separators=(",", ":")).encode()
+        slots = -(-len(data) // SLOT)
+        if self._pos + SLOT * (1 + slots) > self.max_bytes:
+            self._rotate()
+            if SLOT * (2 + slots) > self.max_bytes:
+                logger.error(f"State payload of {len(data)} bytes exceeds the journal file size; skipped")
+                return
+        RECORD.pack_into(self._map, self._pos, t, STATE, 0, 0, 0, NO_LOBE, -1, version, len(data))
+        start = self._pos + SLOT
+        self._map[start:start + len(data)] = data
+        self._pos = start + slots * SLOT
+        self.records += 1
+
+    def on_state_commit(self, snapshot, delta):
+        """StateManager listener: journals the delta, or the whole state on a full resync."""
+        payload = delta if delta is not None else {"type": "init", "state": snapshot.state.to_dict()}
+        self.state(time.monotonic(), snapshot.version, payload)
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def _close_file(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def close(self):
+        self._close_file()
+
+
+def read_journal(path: str) -> Iterator[JournalEvent]:
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, _, _, slot = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or slot != SLOT:
+        raise ValueError(f"{path} is not a Maple journal")
+    pos = SLOT
+    while pos + SLOT <= len(data):
+        t, kind, channel, note, velocity, lobe_id, port, version, length = RECORD.unpack_from(data, pos)
+        if kind == 0:
+            break
+        pos += SLOT
+        payload = None
+        if kind == STATE:
+            payload = json.loads(data[pos:pos + length])
+            pos += -(-length // SLOT) * SLOT
+        yield JournalEvent(t, kind, channel, note, velocity, None if lobe_id == NO_LOBE else lobe_id,
+                           None if port < 0 else port, version, payload)
+
+
+def read_journals(paths: Iterable[str]) -> Iterator[JournalEvent]:
+    for path in sorted(paths):
+        yield from read_journal(path)
+
+
+def replay_to_engine(events: Iterable[JournalEvent], engine, speed: float = 1.0, clock=time.monotonic,
+                     sleep=time.sleep) -> int:
+    """Plays journaled MIDI through a MidiEngine; speed <= 0 replays as fast as possible."""
+    start = clock()
+    origin = None
+    outs = {}
+    sent = 0
+    for event in events:
+        if event.kind not in (NOTE_ON, NOTE_OFF, PANIC):
+            continue
+        if origin is None:
+            origin = event.t
+        if speed > 0:
+            wait = start + (event.t - origin) / speed - clock()
+            if wait > 0:
+                sleep(wait)
+        if event.kind == NOTE_ON:
+            # Journals store the index a lobe was routed to; engines route by name
+            port = engine.ports.get(event.port) if event.port is not None else None
+            outs[(event.channel, event.note)] = engine.send_note_on(event.channel, event.note, event.velocity,
+                                                                    port.name if port is not None else None)
+        elif event.kind == NOTE_OFF:
+            engine.send_note_off(event.channel, event.note, outs.pop((event.channel, event.note), None))
+        else:
+            engine.all_notes_off()
+            outs.clear()
+        sent += 1
+    return sent
+
+
+def replay_to_midi(events: Iterable[JournalEvent], speed: float = 1.0, tempo: int = 120, ticks_per_beat: int = 480):
+    """
+    Writes journaled notes to a mido.MidiFile, time-scaled by `speed`.
+    A panic, and the end of the journal, end every note still sounding.
+    """
+    import mido
+
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo), time=0))
+    ticks_per_second = tempo / 60.0 * ticks_per_beat / (speed if speed > 0 else 1.0)
+    origin = None
+    last_tick = 0
+    # (channel, note) -> note-ons not yet ended
+    sounding = {}
+
+    def release(delta):
+        for channel, note in sounding:
+            track.append(mido.Message('note_off', channel=channel, note=note, velocity=0, time=delta))
+            delta = 0
+        sounding.clear()
+
+    for event in events:
+        if event.kind not in (NOTE_ON, NOTE_OFF, PANIC):
+            continue
+        if origin is None:
+            origin = event.t
+        tick = max(last_tick, int(round((event.t - origin) * ticks_per_second)))
+        key = (event.channel, event.note)
+        if event.kind == PANIC:
+            if not sounding:
+                continue
+            release(tick - last_tick)
+        elif event.kind == NOTE_ON:
+            sounding[key] = sounding.get(key, 0) + 1
+            track.append(mido.Message('note_on', channel=event.channel, note=event.note, velocity=event.velocity,
+                                      time=tick - last_tick))
+        elif key in sounding:
+            sounding[key] -= 1
+            if not sounding[key]:
+                del sounding[key]
+            track.append(mido.Message('note_off', channel=event.channel, note=event.note, velocity=0,
+                                      time=tick - last_tick))
+        else:
+            continue  # Already ended by a panic
+        last_tick = tick
+    release(0)
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return midi_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or replay Maple event journals.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    dump = sub.add_parser("dump", help="Print journal records as JSON lines")
+    dump.add_argument("files", nargs="+")
+    replay = sub.add_parser("replay", help="Replay journaled notes to MIDI or a .mid file")
+    replay.add_argument("files", nargs="+")
+    replay.add_argument("--speed", type=float, default=1.0, help="Playback speed; 0 = as fast as possible")
+    replay.add_argument("--out", help="Write a .mid file instead of playing")
+    replay.add_argument("--port", type=int, help="Output port index (default: virtual port)")
+    args = parser.parse_args(argv)
+
+    events = read_journals(args.files)
+    if args.command == "dump":
+        for event in events:
+            print(json.dumps({**event._asdict(), "kind": KIND_NAMES.get(event.kind, event.kind)}))
+    elif args.out:
+        replay_to_midi(events, speed=args.speed).save(args.out)
+        print(args.out)
+    else:
+        from midi_engine import midi_engine as engine
+        if args.port is not None:
+            engine.open_port(args.port)
+        try:
+            sent = replay_to_engine(events, engine, speed=args.speed)
+            logger.info(f"Replayed {sent} events")
+        finally:
+            engine.all_notes_off()
+            engine.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
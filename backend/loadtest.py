@@ -0,0 +1,241 @@
+"""
+Soak and load test: the whole app in one process against simulated clients.
+
+Runs the FastAPI app (lifespan, session hub) with a fake
+MIDI backend and connects N in-process WebSocket clients to /ws: plain
+listeners, slow clients that take `--slow-delay` seconds per message, and
+spammers that send `update_lobe` at `--spam-rate` per second like a dragged
+slider. After `--duration` seconds it prints a JSON report:
+
+    lateness     note-on send time minus deadline (main session)
+    broadcast    stem pulse creation to delivery, per client kind
+    cpu_percent  process CPU over the run (the clients are cheap stand-ins)
+    memory       RSS samples and growth
+    leaks        note-offs, voices, tasks and connections left behind
+
+    python loadtest.py --clients 50 --slow 5 --spammers 5 --lobes 16 --duration 60 --out report.json
+    python loadtest.py ... --baseline last_release.json
+
+--baseline prints the ratio of the headline numbers to an earlier report.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+
+from bench import FakeWebSocket, install_fake_rtmidi
+from scheduler import JitterReport
+
+# Headline numbers compared against --baseline; all lower-is-better
+HEADLINES = (
+    ("lateness", "p99_ms"),
+    ("lateness", "max_ms"),
+    ("broadcast", "fast", "p99_ms"),
+    ("cpu_percent",),
+    ("memory", "growth_mb"),
+)
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # Peak rather than current outside Linux; still shows growth
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class SimClient(FakeWebSocket):
+    """A browser stand-in: messages it "types" go through `inbox`; deliveries are timed on receipt."""
+
+    def __init__(self, kind: str, delay: float = 0.0):
+        super().__init__(delay)
+        self.kind = kind
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.latency = JitterReport(max_samples=100000)
+
+    async def receive_text(self) -> str:
+        from fastapi import WebSocketDisconnect
+
+        message = await self.inbox.get()
+        if message is None:
+            raise WebSocketDisconnect(1000)
+        return message
+
+    async def send_text(self, data: str):
+        await super().send_text(data)
+        if data.startswith('{"type":"stem_pulse"'):
+            self.latency.record(json.loads(data)["timestamp"], time.time())
+
+    async def close(self):
+        await super().close()
+        self.inbox.put_nowait(None)
+
+    def leave(self):
+        self.inbox.put_nowait(None)
+
+
+async def spam(client: SimClient, lobes: int, rate: float, rng: random.Random):
+    """update_lobe messages, as the UI sends while a slider is dragged."""
+    while True:
+        client.inbox.put_nowait(json.dumps(
+            {"type": "update_lobe", "lobe": {"id": rng.randrange(lobes), "probability": round(rng.uniform(0.5, 1.0), 2)}}))
+        await asyncio.sleep(1.0 / rate)
+
+
+def client_tasks() -> int:
+    """Connection handler, writer and pulse stream tasks still alive."""
+    names = ("serve", "ClientConnection.run_writer", "PulseStream.run")
+    return sum(1 for task in asyncio.all_tasks() if getattr(task.get_coro(), "__qualname__", "") in names)
+
+
+def merge_latency(clients: List[SimClient]) -> dict:
+    merged = JitterReport(max_samples=10 ** 7)
+    for client in clients:
+        merged.samples.extend(client.latency.samples)
+        merged.count += client.latency.count
+    return merged.summary()
+
+
+async def run(clients: int = 20, slow: int = 2, spammers: int = 2, lobes: int = 8, tempo: int = 120,
+              duration: float = 30.0, spam_rate: float = 30.0, slow_delay: float = 0.05, churn: float = 0.0,
+              seed: int = 0, sample_interval: float = 1.0) -> dict:
+    install_fake_rtmidi()
+    import main
+    from state_manager import AppState, LobeState
+
+    rng = random.Random(seed)
+    main.state_manager.replace_state(AppState(
+        lobes=[LobeState(i, f"Lobe {i}", probability=0.8, division=(0.5, 1.0, 2.0, 4.0)[i % 4],
+                         register=("all", "low", "high")[i % 3], instrument_channel=i % 16) for i in range(lobes)],
+        tempo=tempo, playing=True))
+
+    async with main.app.router.lifespan_context(main.app):
+        session = main.default_session
+        sims: Dict[SimClient, asyncio.Task] = {}
+
+        def connect(kind: str, delay: float = 0.0) -> SimClient:
+            client = SimClient(kind, delay)
+            sims[client] = asyncio.create_task(main.serve(client, session))
+            return client
+
+        for i in range(clients):
+            kind = "slow" if i < slow else "spammer" if i < slow + spammers else "fast"
+            connect(kind, slow_delay if kind == "slow" else 0.0)
+        spam_tasks = [asyncio.create_task(spam(c, lobes, spam_rate, random.Random(rng.random())))
+                      for c in sims if c.kind == "spammer"]
+
+        await asyncio.sleep(1.0)  # Connect and settle before measuring
+        gc.collect()
+        session.jitter = JitterReport(max_samples=10 ** 6)
+        for client in sims:
+            client.latency.reset()
+            client.sent = 0
+        objects_start = len(gc.get_objects())
+        memory = [rss_mb()]
+        cpu, start = time.process_time(), time.monotonic()
+        churned = 0
+        next_churn = start + churn if churn > 0 else float("inf")
+        while (now := time.monotonic()) < start + duration:
+            await asyncio.sleep(min(sample_interval, start + duration - now))
+            memory.append(rss_mb())
+            if time.monotonic() >= next_churn:
+                # Replace one listener to check that departed connections are cleaned up
+                leaving = next((c for c in sims if c.kind == "fast" and not c.closed), None)
+                if leaving is not None:
+                    leaving.leave()
+                    leaving.closed = True
+                    connect("fast")
+                    churned += 1
+                next_churn += churn
+        elapsed = time.monotonic() - start
+        cpu = time.process_time() - cpu
+        voices_playing = len(main.midi_engine.voices)
+
+        for task in spam_tasks:
+            task.cancel()
+        for client in sims:
+            client.leave()
+        await asyncio.wait(list(sims.values()), timeout=5.0)
+        main.state_manager.update_global({"playing": False})
+        session.stop_notes()
+        await asyncio.sleep(0.5)
+        gc.collect()
+        by_kind = {kind: [c for c in sims if c.kind == kind] for kind in ("fast", "slow", "spammer")}
+        report = {
+            "config": {"clients": clients, "slow": slow, "spammers": spammers, "lobes": lobes, "tempo": tempo,
+                       "duration": duration, "spam_rate": spam_rate, "slow_delay": slow_delay, "churn": churn},
+            "elapsed_s": elapsed,
+            "notes": session.jitter.count,
+            "lateness": session.jitter.summary(),
+            "broadcast": {kind: merge_latency(group) for kind, group in by_kind.items() if group},
+            "messages_delivered": {kind: sum(c.sent for c in group) for kind, group in by_kind.items() if group},
+            "cpu_percent": cpu / elapsed * 100.0,
+            "memory": {"start_mb": memory[0], "end_mb": memory[-1], "peak_mb": max(memory),
+                       "growth_mb": memory[-1] - memory[0], "samples_mb": memory},
+            "leaks": {
+                "clients_connected": len(session.manager.clients),
+                "clients_dropped_by_server": session.manager.stats["disconnected"],
+                "clients_churned": churned,
+                "note_offs_pending": len(main.midi_engine.note_offs),
+                "voices_sounding": len(main.midi_engine.voices),
+                "voices_while_playing": voices_playing,
+                "client_tasks_left": client_tasks(),
+                "gc_objects_growth": len(gc.get_objects()) - objects_start,
+            },
+            "ingest": dict(session.ingest.stats),
+            "midi": main.midi_engine.port_stats(),
+        }
+    return report
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Current / baseline for each headline number (above 1.0 is worse)."""
+    ratios = {}
+    for path in HEADLINES:
+        current, previous = report, baseline
+        for key in path:
+            current = current.get(key, {}) if isinstance(current, dict) else None
+            previous = previous.get(key, {}) if isinstance(previous, dict) else None
+        if isinstance(current, (int, float)) and isinstance(previous, (int, float)) and previous:
+            ratios[".".join(path)] = current / previous
+    return ratios
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Soak/load test the Maple backend in-process.")
+    parser.add_argument("--clients", type=int, default=20, help="Total simulated clients")
+    parser.add_argument("--slow", type=int, default=2, help="How many of them are slow")
+    parser.add_argument("--spammers", type=int, default=2, help="How many of them spam update_lobe")
+    parser.add_argument("--lobes", type=int, default=8)
+    parser.add_argument("--tempo", type=int, default=120)
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--spam-rate", type=float, default=30.0, help="update_lobe messages per second per spammer")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="Seconds a slow client takes per message")
+    parser.add_argument("--churn", type=float, default=0.0, help="Replace a listener every N seconds (0 = never)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the report here as well as to stdout")
+    parser.add_argument("--baseline", help="Earlier report to compare the headline numbers against")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args.clients, args.slow, args.spammers, args.lobes, args.tempo, args.duration,
+                             args.spam_rate, args.slow_delay, args.churn, args.seed))
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["compared_to_baseline"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=4)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,89 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
+import atexit
 import json
 import logging
+import logging.handlers
+import os
+import queue
 from midi_engine import midi_engine
-from fractal_logic import fractal_logic
+from fractal_logic import make_logic
 from state_manager import state_manager, AppState
-import time
+from scheduler import scheduler, JitterReport
+from broadcast import ConnectionManager
+from preset_store import PresetStore, Autosaver
+from engine_process import EngineClient
+from journal import Journal
+from sessions import Session, SessionHub
+from ingest import MESSAGE_TYPES as INGEST_TYPES, validate_state
+from clock_sync import ClockSync, make_clock_source
+from metrics import metrics, CONTENT_TYPE
 
-logging.basicConfig(level=logging.INFO)
+# Handlers only enqueue records; formatting and I/O happen on the listener thread, off the MIDI hot path
+log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger("maple.main")
 
+STATE_FILE = "maple_state.json"
+preset_store = PresetStore(os.environ.get("MAPLE_PRESET_DB", "maple_presets.db"))
+
+# MAPLE_ENGINE=vector swaps in the NumPy engine for large lobe counts,
+# MAPLE_ENGINE=phrase the L-system phrase generator (see phrase.py)
+fractal_logic = make_logic()
+
+# MAPLE_JOURNAL=<directory> records every emitted event and state commit for replay (see journal.py)
+journal = Journal(os.environ["MAPLE_JOURNAL"], prefix="maple-default") if os.environ.get("MAPLE_JOURNAL") else None
+if journal is not None:
+    midi_engine.journal = journal
+    state_manager.subscribe(journal.on_state_commit)
+
+# MAPLE_ENGINE_PROCESS=1 plays MIDI from a separate worker process (see engine_process.py)
+engine_client = EngineClient() if os.environ.get("MAPLE_ENGINE_PROCESS") == "1" else None
+
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Start the generation loop
-    asyncio.create_task(generation_loop())
+    # Attaching may spawn the worker and wait for it; keep that off the event loop
+    if engine_client is not None and await asyncio.to_thread(engine_client.start):
+        # Pick up whatever the worker is already playing, then keep it fed
+        current = engine_client.current_state()
+        if current:
+            state_manager.replace_state(AppState.from_dict(current))
+        state_manager.subscribe(engine_client.publish)
+        state_manager.subscribe(broadcast_commit)
+        engine_client.publish(state_manager.snapshot)
+        asyncio.create_task(engine_client.pump(manager))
+    else:
+        default_session.drives_midi = True
+        # Open the MIDI output off the event loop so the first note doesn't pay for it
+        await asyncio.to_thread(midi_engine.start)
+        # The main performance is dispatched by the hub like every other session
+        session_hub.add(default_session)
+    asyncio.create_task(midi_engine.ports.watch(on_ports_changed))
+    asyncio.create_task(session_hub.run())
+    clock_sync.start(asyncio.get_running_loop())
+    # MAPLE_AUTOSAVE=<seconds> enables debounced autosave of the live state
+    autosave_delay = float(os.environ.get("MAPLE_AUTOSAVE", "0"))
+    if autosave_delay > 0:
+        state_manager.subscribe(Autosaver(preset_store, autosave_delay).on_state_commit)
+    if os.path.exists(preset_store.path):
+        asyncio.create_task(preset_store.warm())
     yield
+    clock_sync.stop()
+    session_hub.close()
+    preset_store.close()
+    if journal is not None:
+        journal.close()
+    if engine_client is not None:
+        # Detach only; the worker keeps playing across UI restarts
+        engine_client.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -30,171 +95,226 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+manager = ConnectionManager()
+# The main performance on /ws; with an engine worker its MIDI is played out of process
+default_session = Session("default", state_manager, midi_engine, fractal_logic, manager, STATE_FILE,
+                          drives_midi=engine_client is None, journal=journal, jitter=JitterReport())
+# Every playing session, the default one included, is driven by the hub's single timer task
+session_hub = SessionHub(ports=midi_engine.ports,
+                         idle_timeout=float(os.environ.get("MAPLE_SESSION_IDLE", "300")),
+                         max_sessions=int(os.environ.get("MAPLE_MAX_SESSIONS", "1000")),
+                         scheduler=scheduler, journal_dir=os.environ.get("MAPLE_JOURNAL") or None)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+def init_message():
+    return default_session.init_message()
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def broadcast_commit(snapshot, delta):
+    """Syncs clients after every state version while the engine worker plays (the hub does it otherwise)."""
+    manager.broadcast(delta if delta is not None else init_message())
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+def on_clock_transport(kind):
+    """MIDI start/continue/stop from the external clock drive playback."""
+    logger.info(f"Clock transport: {kind}")
+    if kind == "start":
+        if state_manager.state.playing:
+            fractal_logic.reset_engine()
+            session_hub.arm(default_session)
+        state_manager.update_global({"playing": True})
+    elif kind == "continue":
+        state_manager.update_global({"playing": True})
+    elif kind == "stop":
+        state_manager.update_global({"playing": False})
+        default_session.stop_notes()
 
-manager = ConnectionManager()
+def on_clock_grid(grid):
+    """A new beat grid from the external clock: snap the main performance to it."""
+    if engine_client is not None and engine_client.block is not None:
+        engine_client.publish_grid(grid)
+    elif default_session.id in session_hub.sessions:
+        default_session.align()
+        session_hub.arm(default_session)
 
-async def generation_loop():
-    logger.info("Starting generation loop")
-    was_playing = False
-    
-    while True:
-        is_playing = state_manager.state.playing
-        
-        # Detect transition from Stopped to Playing
-        if is_playing and not was_playing:
-            logger.info("Playback STARTED: Resetting Engine")
-            fractal_logic.reset_engine()
-        
-        was_playing = is_playing
-
-        if not is_playing:
-            fractal_logic.last_tick = time.time() 
-            await asyncio.sleep(0.1)
-            continue
-
-        try:
-            # Pass global tempo, lobes, and scale from state_manager to tick
-            events = fractal_logic.tick(
-                state_manager.state.tempo, 
-                state_manager.state.lobes,
-                state_manager.state.selected_notes
-            )
-            
-            if events:
-                for event in events:
-                    if event['type'] == 'note':
-                        midi_engine.send_note_on(event['channel'], event['note'], event['velocity'])
-                        
-                        logger.info(f"Broadcasting Note: {event['note']} for Lobe {event['lobe_id']} [Port: {midi_engine.active_port_name}]")
-                        await manager.broadcast({
-                            "type": "pulse",
-                            "lobe_id": event['lobe_id'],
-                            "note": event['note']
-                        })
-                        
-                        asyncio.create_task(schedule_note_off(event['channel'], event['note'], event['duration']))
-                    
-                    elif event['type'] == 'stem_pulse':
-                        await manager.broadcast({
-                            "type": "stem_pulse",
-                            "timestamp": event['timestamp']
-                        })
-
-        except Exception as e:
-            logger.error(f"Error in generation loop: {e}", exc_info=True)
-            await asyncio.sleep(1.0) # Backoff briefly on error
-
-        await asyncio.sleep(0.02) # Higher resolution for tempo
-
-async def schedule_note_off(channel, note, duration):
-    await asyncio.sleep(duration)
-    midi_engine.send_note_off(channel, note)
+# MAPLE_CLOCK=internal|midi[:<input port>]|software[:<bpm>] picks the tempo reference
+clock_sync = ClockSync(make_clock_source(os.environ.get("MAPLE_CLOCK", "internal")), on_clock_transport,
+                       on_grid=on_clock_grid)
+default_session.clock_sync = clock_sync
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+def on_ports_changed(ports):
+    # Unplugged devices' outputs are closed; lobes routed to them follow the default until they return
+    session_hub.ports_changed(ports)
+    if default_session.id not in session_hub.sessions:
+        # Engine worker: the main performance isn't hosted by the hub
+        midi_engine.prune(ports)
+        manager.broadcast({
+            "type": "ports_changed",
+            "ports": [p.name for p in ports]
+        })
+
+def apply_state(session: Session, websocket: WebSocket, data, keep_playing: bool = True) -> bool:
+    """Swaps in a whole state from a client, file or preset once it passes the control schemas."""
+    error = validate_state(data)
+    if error is not None:
+        logger.warning(f"Rejected state: {error}")
+        session.manager.send(websocket, {"type": "error", "message": f"Invalid state: {error}"})
+        return False
+    new_state = AppState.from_dict(data)
+    if keep_playing:
+        new_state.playing = session.states.state.playing
+    session.states.replace_state(new_state)
+    # The selected port may have changed with it
+    session.select_port(session.states.state.selected_midi_port)
+    return True
+
+async def serve(websocket: WebSocket, session: Session):
+    """Runs one client connection against a session until it disconnects."""
+    await session.manager.connect(websocket)
     try:
         # Send initial full state and port list
-        await websocket.send_json({
-            "type": "init",
-            "state": state_manager.state.to_dict(),
-            "ports": midi_engine.get_port_names()
-        })
+        session.manager.send(websocket, session.init_message())
 
         while True:
             data = await websocket.receive_text()
             msg = json.loads(data)
+            session.touch()
             
-            if msg['type'] == 'update_lobe':
-                lobe = state_manager.update_lobe(msg['lobe']['id'], msg['lobe'])
-                if lobe:
-                    logger.info(f"Updated Lobe {lobe.id}")
-                    # Broadcast update to all clients to keep them in sync
-                    await manager.broadcast({
-                        "type": "state_update",
-                        "lobe": vars(lobe)
-                    })
-
-            elif msg['type'] == 'update_global':
-                updates = msg['updates']
-                logger.info(f"Received global update request: {updates}")
-                state_manager.update_global(updates)
-                
-                # Handle MIDI port switching specifically if it changed
-                if 'selected_midi_port' in updates:
-                    p_idx = updates['selected_midi_port']
-                    logger.info(f"Triggering MIDI port switch to index {p_idx}")
-                    midi_engine.open_port(p_idx)
-                
-                if 'playing' in updates and updates['playing'] is False:
-                    logger.info("Playback STOPPED: Triggering All Notes Off")
-                    midi_engine.all_notes_off()
-                
-                await manager.broadcast({
-                    "type": "global_update",
-                    "updates": updates
-                })
+            if msg['type'] in INGEST_TYPES:
+                # Validated and merged; applied with one commit at the next tick (see ingest.py)
+                error = session.ingest.submit(msg)
+                if error is not None:
+                    session.manager.send(websocket, {"type": "error", "message": error})
+                continue
+
+            # Everything else sees the edits queued before it
+            session.ingest.flush()
+
+            if msg['type'] == 'subscribe_pulses':
+                # Opt into coalesced binary pulse frames at the requested rate
+                fps = session.manager.subscribe_pulses(websocket, msg.get('fps'))
+                session.manager.send(websocket, {"type": "pulse_stream", "fps": fps})
+
+            elif msg['type'] == 'unsubscribe_pulses':
+                session.manager.unsubscribe_pulses(websocket)
+                session.manager.send(websocket, {"type": "pulse_stream", "fps": 0})
+
+            elif msg['type'] == 'resync':
+                # Client saw a version gap: replay what it missed, or send everything
+                deltas = session.states.deltas_since(msg.get('version', -1))
+                if deltas is None:
+                    session.manager.send(websocket, session.init_message())
+                else:
+                    for delta in deltas:
+                        session.manager.send(websocket, delta)
 
             elif msg['type'] == 'save_state':
-                success = state_manager.save_to_file("maple_state.json")
+                # Atomic write, off the event loop
+                success = await asyncio.to_thread(session.states.save_to_file, session.state_file)
                 logger.info(f"State save {'successful' if success else 'failed'}")
 
             elif msg['type'] == 'load_state':
-                new_state = state_manager.load_from_file("maple_state.json")
-                if new_state:
-                    logger.info("State loaded successfully. Broadcasting updates.")
-                    # Broadcast full init to refresh everyone
-                    await manager.broadcast({
-                        "type": "init",
-                        "state": state_manager.state.to_dict(),
-                        "ports": midi_engine.get_port_names()
-                    })
-                    
-                    # Specifically trigger MIDI port switch if it changed in loaded state
-                    midi_engine.open_port(state_manager.state.selected_midi_port)
+                data = await asyncio.to_thread(session.states.read_json, session.state_file)
+                if data is not None and apply_state(session, websocket, data, keep_playing=False):
+                    logger.info("State loaded successfully. Clients synced by delta.")
+
+            elif msg['type'] == 'save_preset':
+                await preset_store.save(msg['name'], session.states.state.to_dict(), msg.get('tags', []))
+                logger.info(f"Preset saved: {msg['name']}")
+                session.manager.broadcast({"type": "presets", "presets": await preset_store.list()})
+
+            elif msg['type'] == 'load_preset':
+                data = await preset_store.load(msg['name'])
+                if data is None:
+                    session.manager.send(websocket, {"type": "error", "message": f"Unknown preset {msg['name']}"})
+                else:
+                    # Keep playing through preset switches
+                    apply_state(session, websocket, data)
+
+            elif msg['type'] == 'list_presets':
+                presets = await preset_store.list(tag=msg.get('tag'), query=msg.get('query'))
+                session.manager.send(websocket, {"type": "presets", "presets": presets})
+
+            elif msg['type'] == 'delete_preset':
+                if await preset_store.delete(msg['name']):
+                    session.manager.broadcast({"type": "presets", "presets": await preset_store.list()})
 
             elif msg['type'] == 'apply_full_state':
-                state_data = msg['state']
                 logger.info("Applying full state from client")
-                
-                # Preserve current playing state
-                current_playing = state_manager.state.playing
-                
-                state_manager.state = AppState.from_dict(state_data)
-                state_manager.state.playing = current_playing
-                
-                # Broadcast back to all to sync up
-                await manager.broadcast({
-                    "type": "init",
-                    "state": state_manager.state.to_dict(),
-                    "ports": midi_engine.get_port_names()
-                })
-                # Re-open midi port just in case it changed
-                midi_engine.open_port(state_manager.state.selected_midi_port)
+                # Preserve current playing state; commit broadcasts only what changed
+                apply_state(session, websocket, msg.get('state'))
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        session.manager.disconnect(websocket)
     except Exception as e:
         logger.error(f"WebSocket Error: {e}", exc_info=True)
-        manager.disconnect(websocket)
+        session.manager.disconnect(websocket)
+    session.touch()
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await serve(websocket, default_session)
+
+@app.websocket("/ws/{session_id}")
+async def session_endpoint(websocket: WebSocket, session_id: str):
+    """Independent performance with its own state, engine and clients, created on first connect."""
+    session = default_session if session_id == default_session.id else session_hub.get(session_id)
+    if session is None:
+        await websocket.close(code=1008)
+        return
+    await serve(websocket, session)
 
 @app.get("/ports")
 def get_ports():
     return midi_engine.get_port_names()
 
+@app.get("/midi_outputs")
+def get_midi_outputs():
+    return midi_engine.port_stats()
+
+@app.get("/note_offs")
+def get_note_off_stats():
+    return midi_engine.note_off_stats
+
+@app.get("/presets")
+async def get_presets(tag: str = None, q: str = None):
+    return await preset_store.list(tag=tag, query=q)
+
+@app.get("/sessions")
+def get_sessions():
+    return session_hub.summary()
+
+@app.get("/ingest")
+def get_ingest_stats():
+    """Control messages received, merged into pending edits and rejected by validation."""
+    return default_session.ingest.stats
+
+@app.get("/clock")
+def get_clock():
+    return clock_sync.summary()
+
+@app.get("/clients")
+def get_client_stats():
+    return manager.queue_stats()
+
+@app.get("/jitter")
+def get_jitter():
+    """Lateness of note sends relative to their scheduled deadlines."""
+    return default_session.jitter.summary()
+
+def collect_gauges():
+    return [
+        ("maple_clients", "gauge", "Connected WebSocket clients.", len(manager.clients)),
+        ("maple_note_offs_pending", "gauge", "Note-offs waiting in the timer heap.", len(midi_engine.note_offs)),
+        ("maple_voices_active", "gauge", "Notes currently sounding.", len(midi_engine.voices)),
+        ("maple_state_version", "gauge", "Current state version.", state_manager.version),
+        ("maple_clock_locked", "gauge", "1 while locked to the external clock.", int(clock_sync.pll.locked)),
+        ("maple_clock_tempo_bpm", "gauge", "Tempo being followed.", clock_sync.tempo_for(state_manager.state.tempo)),
+    ]
+
+metrics.collect(collect_gauges)
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of timing histograms and counters."""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
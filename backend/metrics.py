@@ -0,0 +1,121 @@
+"""
+Low-overhead timing and throughput metrics rendered in Prometheus text format.
+
+Recording is a bisect plus a couple of integer adds, so it is safe on the
+session dispatch path and the MIDI output threads; all formatting happens at
+scrape time.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from 50 µs up to 1 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+INTERVAL_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _fmt(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            lines.append(f'{self.name}_bucket{{le="{_fmt(float(bound))}"}} {total}')
+        lines.append(f"{self.name}_sum {_fmt(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, optionally split by a single label."""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: Dict[object, int] = {}
+
+    def inc(self, key=None, amount: int = 1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if not self.values and self.label is None:
+            lines.append(f"{self.name} 0")
+        for key, value in sorted(self.values.items(), key=lambda kv: str(kv[0])):
+            if self.label is None:
+                lines.append(f"{self.name} {value}")
+            else:
+                lines.append(f'{self.name}{{{self.label}="{key}"}} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+        # Callables returning (name, type, help, value) rows read at scrape time
+        self.collectors: List[Callable[[], List[Tuple[str, str, str, float]]]] = []
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        metric = Counter(name, help, label)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, collector: Callable[[], List[Tuple[str, str, str, float]]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, kind, help, value in collector():
+                lines.extend((f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_fmt(value)}"))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+
+TICK_INTERVAL = metrics.histogram(
+    "maple_tick_interval_seconds", "Time between successive generator ticks.", INTERVAL_BUCKETS)
+EVENT_LATENESS = metrics.histogram(
+    "maple_event_lateness_seconds", "Note-on send time minus its scheduled deadline.")
+MIDI_SEND_LATENCY = metrics.histogram(
+    "maple_midi_send_latency_seconds", "Time a MIDI message waits in the output ring before the backend send.")
+BROADCAST_LATENCY = metrics.histogram(
+    "maple_broadcast_latency_seconds", "Time from enqueueing a WebSocket message to the send completing.")
+QUEUE_DEPTH = metrics.histogram(
+    "maple_client_queue_depth", "Per-client outgoing queue depth seen at enqueue.", DEPTH_BUCKETS)
+
+NOTES = metrics.counter("maple_notes_total", "Note-ons sent, by lobe.", "lobe")
+NOTE_OFFS = metrics.counter("maple_note_offs_total", "Scheduled note-offs sent, by lobe.", "lobe")
+STOLEN = metrics.counter("maple_voices_stolen_total", "Voices cut short by a polyphony cap, by lobe.", "lobe")
+DROPS = metrics.counter("maple_dropped_total", "Messages dropped, by where they were dropped.", "reason")
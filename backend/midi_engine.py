@@ -1,89 +1,393 @@
-import rtmidi
-import mido
 import logging
+import time
+
+from scheduler import DeadlineQueue
+from midi_output import MidiOutput, encode_note_on, encode_note_off, encode_cc, NOTE_OFF_BY_INDEX
+from midi_ports import PortRegistry
+from metrics import NOTE_OFFS, STOLEN
 
 logger = logging.getLogger("maple.midi")
 
+VIRTUAL_PORT_NAME = "Maple Output"
+# Polyphony caps; the table's one-byte reference counts bound the global one
+VOICE_LIMIT = 128
+LOBE_VOICE_LIMIT = 16
+
+def rtmidi_out():
+    # Imported on first use so importing this module never touches the MIDI stack
+    import rtmidi
+    return rtmidi.MidiOut()
+
+class OutputPort:
+    """One open MidiOut with its own send queue and output thread."""
+
+    def __init__(self, midi_out, name):
+        self.midi_out = midi_out
+        self.name = name
+        self.output = MidiOutput(midi_out)
+        self.output.start()
+        # Sounding voices per (channel << 7) | note
+        self.active = bytearray(16 * 128)
+
+    def send(self, message):
+        return self.output.send(message)
+
+    def close(self):
+        self.output.flush()
+        self.output.stop()
+        self.midi_out.close_port()
+
 class MidiEngine:
-    def __init__(self):
-        self.midi_out = rtmidi.MidiOut()
+    """
+    Keeps a pool of simultaneously open output ports. The selected port is
+    the default route; lobes may route to any other port by name, which is
+    opened on first use and stays open until its device is unplugged. Note-offs remember the port their note-on went
+    to, so routing changes never strand in-flight notes.
+
+    Every note-on starts a voice. Each port keeps a 16x128 table of voice
+    counts, so a retrigger restarts the note once and only the last
+    voice's note-off reaches the synth. Voices past the per-lobe or global
+    cap steal the oldest one, and stopping releases exactly the notes that
+    are sounding.
+
+    Construction does no device I/O; the default port opens on `start()` or
+    on the first note, whichever comes first.
+    """
+
+    def __init__(self, backend_factory=None, virtual_name=VIRTUAL_PORT_NAME, ports=None,
+                 voice_limit=VOICE_LIMIT, lobe_voice_limit=LOBE_VOICE_LIMIT):
+        # backend_factory builds MidiOut-like objects (e.g. midi_output.FakeMidiOut for headless runs)
+        self.backend_factory = backend_factory or rtmidi_out
+        self.virtual_name = virtual_name
+        # Engines may share one registry so the port list is enumerated once
+        self.ports = ports or PortRegistry(self.backend_factory)
+        # Open outputs keyed by PortInfo; None is the virtual port
+        self.pool = {}
+        self.default = None
         self.active_port_name = "None"
-        self._setup_initial_port()
+        # PortInfo of the default hardware port; None while on the virtual port
+        self.active_port = None
+        # Single timer heap for pending note-offs, drained by the session's steps
+        self.note_offs = DeadlineQueue()
+        self.note_off_stats = {"pending": 0, "peak": 0, "sent": 0, "cancelled": 0, "retriggers": 0, "stolen": 0}
+        self.voice_limit = min(voice_limit, 255)
+        self.lobe_voice_limit = lobe_voice_limit
+        # voice id -> (output, table index, lobe id, routed to the default port); oldest first
+        self.voices = {}
+        # lobe id -> {voice id: None}, oldest first
+        self.lobe_voices = {}
+        self._next_voice = 0
+        # Optional journal.Journal recording note-offs and panics
+        self.journal = None
+        self.started = False
+
+    def start(self):
+        """Opens the default output. Safe to call from a worker thread before playback."""
+        if not self.started:
+            self.started = True
+            try:
+                self._setup_initial_port()
+            except Exception as e:
+                logger.error(f"MIDI output unavailable: {e}")
+
+    @property
+    def midi_out(self):
+        return self.default.midi_out if self.default else None
+
+    @property
+    def output(self):
+        return self.default.output if self.default else None
+
+    def _open(self, port):
+        """Returns the pooled output for `port` (None = virtual), opening it if needed."""
+        out = self.pool.get(port)
+        if out is not None:
+            return out
+        midi_out = self.backend_factory()
+        if port is None:
+            midi_out.open_virtual_port(self.virtual_name)
+            out = OutputPort(midi_out, f"{self.virtual_name} (Virtual)")
+        else:
+            midi_out.open_port(port.index)
+            out = OutputPort(midi_out, port.name)
+        self.pool[port] = out
+        logger.info(f"Opened MIDI output: {out.name}")
+        return out
 
     def _setup_initial_port(self):
+        self.active_port = None
         # Default to virtual port on Linux/macOS
         try:
-            self.midi_out.open_virtual_port("Maple Output")
-            self.active_port_name = "Maple Output (Virtual)"
-            logger.info("Initialized with virtual MIDI port: Maple Output")
+            self.default = self._open(None)
+            self.active_port_name = self.default.name
+            logger.info(f"Initialized with virtual MIDI port: {self.virtual_name}")
         except Exception as e:
             logger.warning(f"Could not open virtual port: {e}")
-            ports = self.midi_out.get_ports()
-            if ports:
-                self.midi_out.open_port(0)
-                self.active_port_name = ports[0]
+            port = self.ports.get(0)
+            if port is not None:
+                self.default = self._open(port)
+                self.active_port = port
+                self.active_port_name = port.name
                 logger.info(f"Initialized with default hardware port: {self.active_port_name}")
 
     def get_port_names(self):
-        # We need a fresh MidiOut (or temporary) to get ports without interference
-        temp_out = rtmidi.MidiOut()
-        return temp_out.get_ports()
+        # Served from the registry cache; the hotplug watcher keeps it fresh
+        return self.ports.names()
 
     def open_port(self, port_index):
+        """Makes `port_index` the default route. Previously opened ports stay open."""
+        self.started = True
+        port = self.ports.get(port_index)
+        if port is None and self.ports.refresh():
+            port = self.ports.get(port_index)
+        if port is not None and port == self.active_port:
+            return True  # Already the default; nothing to rebuild
+        if port is None and self.active_port is None and self.default is not None:
+            logger.warning(f"Port index {port_index} invalid. Staying on virtual port.")
+            return False
+
         logger.info(f"REQUESTED: Switch to MIDI port index {port_index}")
+        previous = self.default
         try:
-            # Recreate MidiOut to clear any virtual ports or stuck states
-            if self.midi_out:
-                self.midi_out.close_port()
-                del self.midi_out
-            
-            self.midi_out = rtmidi.MidiOut()
-            ports = self.midi_out.get_ports()
-            
-            if 0 <= port_index < len(ports):
-                self.midi_out.open_port(port_index)
-                self.active_port_name = ports[port_index]
+            if port is not None:
+                self.default = self._open(port)
+                self.active_port = port
+                self.active_port_name = port.name
                 logger.info(f"SUCCESS: Switched to hardware port: {self.active_port_name}")
-                return True
+                switched = True
             else:
                 logger.error(f"Port index {port_index} invalid. Falling back to virtual.")
                 self._setup_initial_port()
-                return False
+                switched = False
         except Exception as e:
             logger.error(f"FAILED to switch port: {e}")
-            self.midi_out = rtmidi.MidiOut()
+            self.pool.pop(port, None)
             self._setup_initial_port()
-            return False
+            switched = False
+        if previous is not None and previous is not self.default:
+            # Notes that followed the old default end there now; routed lobes keep theirs
+            self.release(previous, default_only=True)
+        return switched
 
-    def send_note_on(self, channel, note, velocity):
-        if not self.midi_out: return
+    def route(self, port_name=None):
+        """Output for a lobe's port name; None or an unavailable port means the default."""
+        if not self.started:
+            self.start()
+        if port_name is None:
+            return self.default
+        # By name, so a hotplug reorder never moves a lobe to another device
+        port = self.ports.find(port_name)
+        if port is None or port == self.active_port:
+            return self.default
         try:
-            msg = mido.Message('note_on', channel=channel, note=note, velocity=velocity)
-            self.midi_out.send_message(msg.bytes())
+            return self._open(port)
         except Exception as e:
-            logger.error(f"MIDI Send Error: {e}")
+            logger.error(f"Could not open routed port {port.name}: {e}")
+            self.pool.pop(port, None)
+            return self.default
 
-    def send_note_off(self, channel, note):
-        if not self.midi_out: return
-        try:
-            msg = mido.Message('note_off', channel=channel, note=note)
-            self.midi_out.send_message(msg.bytes())
-        except Exception as e:
-            logger.error(f"MIDI Send Off Error: {e}")
-    
-    def send_cc(self, channel, control, value):
-        msg = mido.Message('control_change', channel=channel, control=control, value=value)
-        self.midi_out.send_message(msg.bytes())
+    def port_index(self, port_name):
+        """Current index of a routed port, for records that store indices; None for the default."""
+        port = self.ports.find(port_name) if port_name is not None else None
+        return port.index if port is not None else None
+
+    def prune(self, ports):
+        """
+        Follows a hotplug change: outputs whose device moved to another
+        index are re-keyed, and those whose device is gone have their voices
+        released and are closed. A lobe routed to a missing port plays on
+        the default until the device returns.
+        """
+        by_name = {p.name: p for p in ports}
+        for port, out in list(self.pool.items()):
+            if port is None:
+                continue
+            current = by_name.get(port.name)
+            if current == port:
+                continue
+            del self.pool[port]
+            if current is not None:
+                # The open handle still points at the device
+                self.pool[current] = out
+                if port == self.active_port:
+                    self.active_port = current
+                continue
+            self.release(out)
+            try:
+                out.close()
+            except Exception as e:
+                logger.warning(f"Error closing unplugged MIDI output {out.name}: {e}")
+            logger.info(f"Closed unplugged MIDI output: {out.name}")
+            if out is self.default:
+                self.default = None
+                self.active_port_name = "None"
+                try:
+                    self._setup_initial_port()
+                except Exception as e:
+                    logger.error(f"MIDI output unavailable: {e}")
+
+    def send_note_on(self, channel, note, velocity, port=None, lobe_id=None):
+        """Starts a voice via the routed output and returns the output so the note-off can follow."""
+        out = self.route(port)
+        if out is None: return None
+        lobe = self.lobe_voices.get(lobe_id) if lobe_id is not None else None
+        if lobe is not None and len(lobe) >= self.lobe_voice_limit:
+            self._steal(next(iter(lobe)))
+        if len(self.voices) >= self.voice_limit:
+            self._steal(next(iter(self.voices)))
+
+        index = (channel & 0x0F) << 7 | (note & 0x7F)
+        if out.active[index]:
+            # Retrigger: end the sounding note first so the synth restarts it cleanly
+            out.output.send_many((NOTE_OFF_BY_INDEX[index], encode_note_on(channel, note, velocity)))
+            self.note_off_stats["retriggers"] += 1
+        else:
+            out.send(encode_note_on(channel, note, velocity))
+        out.active[index] += 1
+
+        voice = self._next_voice = self._next_voice + 1
+        self.voices[voice] = (out, index, lobe_id, port is None or out is self.default)
+        if lobe_id is not None:
+            if lobe is None:
+                lobe = self.lobe_voices[lobe_id] = {}
+            lobe[voice] = None
+        return out
+
+    def _drop_voice(self, voice, t=None):
+        out, index, lobe_id, _ = self.voices.pop(voice)
+        lobe = self.lobe_voices.get(lobe_id)
+        if lobe is not None:
+            del lobe[voice]
+            if not lobe:
+                del self.lobe_voices[lobe_id]
+        out.active[index] -= 1
+        if self.journal is not None:
+            self.journal.note_off(time.monotonic() if t is None else t, index >> 7, index & 0x7F, lobe_id)
+        return out, index, lobe_id
+
+    def _end_voice(self, voice, t=None):
+        """Drops one voice; the note-off goes out once no other voice holds the note."""
+        out, index, _ = self._drop_voice(voice, t)
+        if not out.active[index]:
+            out.send(NOTE_OFF_BY_INDEX[index])
+
+    def _steal(self, voice):
+        STOLEN.inc(self.voices[voice][2])
+        self.note_off_stats["stolen"] += 1
+        self._end_voice(voice)
+
+    def _find_voice(self, out, index):
+        """Oldest voice holding `index` on `out`, or None."""
+        for voice, (voice_out, voice_index, _, _) in self.voices.items():
+            if voice_out is out and voice_index == index:
+                return voice
+        return None
+
+    def send_note_off(self, channel, note, out=None):
+        """Ends the oldest voice of the note now; untracked notes get a plain note-off."""
+        out = out or self.default
+        if out is None: return
+        voice = self._find_voice(out, (channel & 0x0F) << 7 | (note & 0x7F))
+        if voice is None:
+            out.send(encode_note_off(channel, note))
+        else:
+            self._end_voice(voice)
+
+    def schedule_note_off(self, channel, note, deadline, out=None, lobe_id=None):
+        """Queues the end of the note just started on `out` for the given monotonic deadline."""
+        out = out or self.default
+        voice = self._next_voice
+        if self.voices.get(voice, (None, -1))[:2] != (out, (channel & 0x0F) << 7 | (note & 0x7F)):
+            voice = None  # Not the latest note-on; sent as a plain note-off
+        self.note_offs.push(deadline, (channel, note, out, lobe_id, voice))
+        stats = self.note_off_stats
+        stats["pending"] = len(self.note_offs)
+        if stats["pending"] > stats["peak"]:
+            stats["peak"] = stats["pending"]
+
+    def next_note_off(self):
+        return self.note_offs.peek()
+
+    def flush_note_offs(self, now=None):
+        """Sends every note-off that is due. Returns how many were sent."""
+        if now is None:
+            now = time.monotonic()
+        due = self.note_offs.pop_due(now)
+        voices = self.voices
+        for deadline, (channel, note, out, lobe_id, voice) in due:
+            if voice is None:
+                if out is not None:
+                    out.send(encode_note_off(channel, note))
+                if self.journal is not None:
+                    self.journal.note_off(deadline, channel, note, lobe_id)
+            elif voice in voices:
+                self._end_voice(voice, deadline)
+            else:
+                continue  # Already stolen or released
+            NOTE_OFFS.inc(lobe_id)
+        self.note_off_stats["sent"] += len(due)
+        self.note_off_stats["pending"] = len(self.note_offs)
+        return len(due)
+
+    def cancel_note_offs(self, send=False):
+        """Drops all pending note-offs, optionally sending them immediately first."""
+        if send:
+            self.flush_note_offs(float("inf"))
+        else:
+            self.note_off_stats["cancelled"] += len(self.note_offs)
+            self.note_offs.clear()
+            self.note_off_stats["pending"] = 0
+
+    def send_cc(self, channel, control, value, port=None):
+        out = self.route(port)
+        if out is None: return
+        out.send(encode_cc(channel, control, value))
+
+    def release(self, out, default_only=False):
+        """
+        Ends the voices sounding on `out` (only those routed there as the
+        default port if `default_only`) with one batch of note-offs.
+        Returns how many note-offs were queued.
+        """
+        ended = [voice for voice, (voice_out, _, _, routed) in self.voices.items()
+                 if voice_out is out and (routed or not default_only)]
+        messages = []
+        for voice in ended:
+            _, index, _ = self._drop_voice(voice)
+            if not out.active[index]:
+                messages.append(NOTE_OFF_BY_INDEX[index])
+        return out.output.send_many(messages) if messages else 0
 
     def all_notes_off(self):
-        if not self.midi_out: return
-        logger.info("MIDI: Sending All Notes Off to all channels")
-        for channel in range(16):
-            # CC 123 is All Notes Off
-            msg = mido.Message('control_change', channel=channel, control=123, value=0)
-            self.midi_out.send_message(msg.bytes())
-            # Also send CC 120 (All Sound Off) for safety
-            msg_sound_off = mido.Message('control_change', channel=channel, control=120, value=0)
-            self.midi_out.send_message(msg_sound_off.bytes())
+        """Ends every sounding voice: one batch of note-offs per port, only for notes actually on."""
+        # Pending note-offs go even with no port open, or they would fire after the stop
+        self.cancel_note_offs()
+        if not self.pool: return
+        if self.journal is not None:
+            self.journal.panic(time.monotonic())
+        journal, self.journal = self.journal, None
+        try:
+            sent = sum(self.release(out) for out in list(self.pool.values()))
+        finally:
+            self.journal = journal
+        logger.info(f"MIDI: Released {sent} sounding notes")
+
+    def port_stats(self):
+        """Per-port send counters and queue latency."""
+        return {
+            out.name: {**out.output.stats, "queued": len(out.output.ring), "default": out is self.default,
+                       "latency": out.output.latency.summary()}
+            for out in self.pool.values()
+        }
+
+    def close(self):
+        for out in self.pool.values():
+            out.close()
+        self.pool.clear()
+        self.default = None
+        self.voices.clear()
+        self.lobe_voices.clear()
+        # Reopens lazily if used again
+        self.started = False
 
 midi_engine = MidiEngine()
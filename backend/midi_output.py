@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from metrics import DROPS, MIDI_SEND_LATENCY
+from scheduler import JitterReport
+
+logger = logging.getLogger("maple.midi.output")
+
+# Precomputed raw status bytes / messages so the hot path never builds mido objects
+NOTE_OFF_STATUS = [0x80 | ch for ch in range(16)]
+NOTE_ON_STATUS = [0x90 | ch for ch in range(16)]
+CC_STATUS = [0xB0 | ch for ch in range(16)]
+NOTE_OFF_MESSAGES = [[(0x80 | ch, note, 0) for note in range(128)] for ch in range(16)]
+# Flat note-off table indexed by (channel << 7) | note, the active-note table layout
+NOTE_OFF_BY_INDEX = [msg for row in NOTE_OFF_MESSAGES for msg in row]
+
+
+def encode_note_on(channel: int, note: int, velocity: int) -> tuple:
+    return (NOTE_ON_STATUS[channel & 0x0F], note & 0x7F, velocity & 0x7F)
+
+
+def encode_note_off(channel: int, note: int) -> tuple:
+    return NOTE_OFF_MESSAGES[channel & 0x0F][note & 0x7F]
+
+
+def encode_cc(channel: int, control: int, value: int) -> tuple:
+    return (CC_STATUS[channel & 0x0F], control & 0x7F, value & 0x7F)
+
+
+class RingBuffer:
+    """
+    Bounded single-producer/single-consumer ring. The asyncio thread is the
+    only writer of `_tail` and the output thread the only writer of `_head`,
+    so no lock is needed under the GIL.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._buf: List = [None] * size
+        self._mask = size - 1
+        self._head = 0
+        self._tail = 0
+        self.capacity = size
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def put(self, item) -> bool:
+        tail = self._tail
+        if tail - self._head > self._mask:
+            return False
+        self._buf[tail & self._mask] = item
+        self._tail = tail + 1
+        return True
+
+    def take(self, max_items: int) -> List:
+        head = self._head
+        n = min(self._tail - head, max_items)
+        buf, mask = self._buf, self._mask
+        items = [buf[(head + i) & mask] for i in range(n)]
+        self._head = head + n
+        return items
+
+
+class FakeMidiOut:
+    """
+    Stand-in for rtmidi.MidiOut that records what reaches the wire.
+    `send_delay` simulates a slow device; `keep` limits memory on long benchmarks.
+    """
+
+    def __init__(self, ports: Optional[List[str]] = None, send_delay: float = 0.0, keep: int = 100000):
+        self.ports = ports if ports is not None else ["Fake Synth A", "Fake Synth B"]
+        self.send_delay = send_delay
+        self.keep = keep
+        self.sent: List[tuple] = []
+        self.sent_count = 0
+        self.port_name: Optional[str] = None
+
+    def get_ports(self):
+        return list(self.ports)
+
+    def open_port(self, index=0, name=None):
+        self.port_name = self.ports[index]
+
+    def open_virtual_port(self, name=None):
+        self.port_name = name or "Fake Virtual"
+
+    def close_port(self):
+        self.port_name = None
+
+    def is_port_open(self):
+        return self.port_name is not None
+
+    def send_message(self, message):
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        if len(self.sent) < self.keep:
+            self.sent.append(tuple(message))
+        self.sent_count += 1
+
+
+class MidiOutput:
+    """
+    Dedicated output thread draining pre-encoded messages from a ring buffer
+    into a MidiOut-like backend in batches.
+    """
+
+    def __init__(self, backend=None, capacity: int = 4096, batch: int = 64, clock=time.perf_counter):
+        self.backend = backend
+        self.ring = RingBuffer(capacity)
+        self.batch = batch
+        self.clock = clock
+        self.latency = JitterReport()
+        # "sent" counts messages the backend accepted; ones it raised on count as "errors"
+        self.stats = {"sent": 0, "dropped": 0, "errors": 0, "batches": 0}
+        self._wake = threading.Event()
+        self._queued = 0
+        self._done = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="maple-midi-out", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def send(self, message: tuple) -> bool:
+        """Enqueues a raw message; never blocks. Returns False if the ring is full."""
+        if not self.ring.put((message, self.clock())):
+            self.stats["dropped"] += 1
+            DROPS.inc("midi_ring")
+            return False
+        self._queued += 1
+        self._wake.set()
+        return True
+
+    def send_many(self, messages) -> int:
+        now = self.clock()
+        queued = 0
+        for message in messages:
+            if self.ring.put((message, now)):
+                queued += 1
+            else:
+                self.stats["dropped"] += 1
+                DROPS.inc("midi_ring")
+        if queued:
+            self._queued += queued
+            self._wake.set()
+        return queued
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """Blocks until everything queued so far has been handed to the backend."""
+        target = self._queued
+        if not self._running:
+            self._drain()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._done < target:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+    def _drain(self):
+        ring = self.ring
+        while len(ring):
+            items = ring.take(self.batch)
+            backend = self.backend
+            if backend is None:
+                self.stats["dropped"] += len(items)
+                self._done += len(items)
+                continue
+            sent = 0
+            for message, queued_at in items:
+                try:
+                    backend.send_message(message)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"MIDI Send Error: {e}")
+                else:
+                    sent += 1
+                    sent_at = self.clock()
+                    self.latency.record(queued_at, sent_at)
+                    MIDI_SEND_LATENCY.observe(sent_at - queued_at)
+            self.stats["sent"] += sent
+            self.stats["batches"] += 1
+            self._done += len(items)
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(0.1)
+            self._wake.clear()
+            self._drain()
+        self._drain()
+
+
+def benchmark(count: int = 100000, send_delay: float = 0.0) -> dict:
+    """Pushes `count` note on/off pairs through a FakeMidiOut and reports throughput and latency."""
+    backend = FakeMidiOut(send_delay=send_delay, keep=0)
+    output = MidiOutput(backend, capacity=count * 2)
+    output.start()
+    start = time.perf_counter()
+    for i in range(count):
+        note = i & 0x7F
+        output.send(encode_note_on(i & 0x0F, note, 100))
+        output.send(encode_note_off(i & 0x0F, note))
+    output.flush(timeout=60.0)
+    elapsed = time.perf_counter() - start
+    output.stop()
+    return {
+        "messages": backend.sent_count,
+        "seconds": elapsed,
+        "messages_per_sec": backend.sent_count / elapsed if elapsed else 0.0,
+        "latency": output.latency.summary(),
+        "stats": output.stats,
+    }
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(benchmark(), indent=4))
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("maple.midi.ports")
+
+
+class PortInfo(NamedTuple):
+    """Stable identity of an output port: a changed name at the same index is a different port."""
+    index: int
+    name: str
+
+
+class PortRegistry:
+    """
+    Enumerates MIDI output ports once through a single long-lived probe and
+    caches the result. `watch()` re-enumerates off the event loop and reports
+    hotplug changes; the probe is locked since refreshes also come from the
+    event loop.
+    """
+
+    def __init__(self, backend_factory):
+        self.backend_factory = backend_factory
+        self.ports: Tuple[PortInfo, ...] = ()
+        self._probe = None
+        self._probe_lock = threading.Lock()
+        self._loaded = False
+        self.refreshes = 0
+
+    def refresh(self) -> bool:
+        """Re-enumerates ports. Returns True if the list changed. Safe to call from a worker thread."""
+        with self._probe_lock:
+            if self._probe is None:
+                self._probe = self.backend_factory()
+            ports = tuple(PortInfo(i, name) for i, name in enumerate(self._probe.get_ports()))
+            self.refreshes += 1
+            self._loaded = True
+            if ports == self.ports:
+                return False
+            self.ports = ports
+            return True
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            # No MIDI stack on this host; the watcher keeps retrying
+            logger.warning(f"Could not enumerate MIDI ports: {e}")
+            self._loaded = True
+
+    def names(self) -> List[str]:
+        self._ensure_loaded()
+        return [p.name for p in self.ports]
+
+    def get(self, index: int) -> Optional[PortInfo]:
+        self._ensure_loaded()
+        if 0 <= index < len(self.ports):
+            return self.ports[index]
+        return None
+
+    def find(self, name: str) -> Optional[PortInfo]:
+        self._ensure_loaded()
+        for port in self.ports:
+            if port.name == name:
+                return port
+        return None
+
+    async def watch(self, on_change: Callable[[Tuple[PortInfo, ...]], None], interval: float = 2.0,
+                    max_interval: float = 60.0):
+        """
+        Polls for device changes in a worker thread and calls on_change on the
+        event loop. While refreshes fail (e.g. no MIDI stack on this host) the
+        failure is logged once and polling backs off up to `max_interval`.
+        """
+        delay = interval
+        failing = False
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                changed = await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                if not failing:
+                    logger.warning(f"Port refresh failed, backing off up to {max_interval}s: {e}")
+                    failing = True
+                delay = min(delay * 2, max_interval)
+                continue
+            if failing:
+                logger.info("Port refresh recovered")
+                failing = False
+                delay = interval
+            if changed:
+                logger.info(f"MIDI ports changed: {[p.name for p in self.ports]}")
+                on_change(self.ports)
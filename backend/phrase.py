@@ -0,0 +1,242 @@
+"""
+Self-similar phrase generator.
+
+Every lobe walks the expansion of its own L-system. Rules are drawn once
+from the lobe's seed, expansions of shallow subtrees are memoized, and notes
+are expanded into per-lobe buffers a few bars ahead between ticks, so a tick
+only pops the next note. Lobe fields map onto the grammar:
+
+    division     branching: triplet divisions (1.5, 3, 6, ...) split in
+                 threes, everything else in twos
+    probability  threshold on each terminal's weight; weights are summed
+                 down the tree, so repeated motifs return with variations
+    register     the pitch pool the melodic contour moves through
+    transpose    offset added to every note
+
+MAPLE_ENGINE=phrase selects it in the server; `render.py --engine phrase`
+renders it offline.
+"""
+import logging
+import math
+import random
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from fractal_logic import FractalLogic
+
+logger = logging.getLogger("maple.phrase")
+
+# Contour symbols: stay, step up, step down (in pool degrees)
+MOVES = {"S": 0, "U": 1, "D": -1}
+AXIOM = "S"
+DEPTH = 16
+# Subtrees up to this depth are memoized whole (16 or 81 terminals)
+CHUNK_DEPTH = 4
+BEATS_PER_BAR = 4
+# The contour ranges one octave either side of the pool
+OCTAVES = 3
+
+
+def arity_for(division: float) -> int:
+    thirds = division * 2.0 / 3.0
+    return 3 if abs(thirds - round(thirds)) < 1e-9 else 2
+
+
+class Grammar:
+    """
+    Deterministic L-system with uniform branching. Each rule slot carries a
+    weight in [0, 1); a terminal's weight is the sum (mod 1) of the slot
+    weights on its path. Any step is reachable in O(depth) without expanding
+    what precedes it.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[Tuple[str, float], ...]], depth: int = DEPTH, axiom: str = AXIOM):
+        self.rules = rules
+        self.axiom = axiom
+        self.depth = depth
+        self.arity = len(rules[axiom])
+        self.length = self.arity ** depth
+        self.chunk_depth = min(depth, CHUNK_DEPTH)
+        self.chunk = self.arity ** self.chunk_depth
+        self._memo: Dict[Tuple[str, int], Tuple[Tuple[int, float], ...]] = {}
+
+    @classmethod
+    def generate(cls, seed: str, arity: int, depth: int = DEPTH) -> "Grammar":
+        rng = random.Random(seed)
+        symbols = list(MOVES)
+        rules = {sym: tuple((rng.choice(symbols), rng.random()) for _ in range(arity)) for sym in symbols}
+        return cls(rules, depth)
+
+    def expand(self, sym: str, depth: int) -> Tuple[Tuple[int, float], ...]:
+        """(move, weight) terminals of one subtree, memoized."""
+        key = (sym, depth)
+        terminals = self._memo.get(key)
+        if terminals is None:
+            if depth == 0:
+                terminals = ((MOVES[sym], 0.0),)
+            else:
+                terminals = tuple((move, (w + cw) % 1.0)
+                                  for child, w in self.rules[sym]
+                                  for move, cw in self.expand(child, depth - 1))
+            self._memo[key] = terminals
+        return terminals
+
+    def chunk_at(self, position: int) -> Tuple[Tuple[Tuple[int, float], ...], float]:
+        """The memoized chunk holding `position` and the weight accumulated above it."""
+        index = (position % self.length) // self.chunk
+        digits = []
+        for _ in range(self.depth - self.chunk_depth):
+            index, digit = divmod(index, self.arity)
+            digits.append(digit)
+        sym, offset = self.axiom, 0.0
+        for digit in reversed(digits):
+            sym, w = self.rules[sym][digit]
+            offset += w
+        return self.expand(sym, self.chunk_depth), offset % 1.0
+
+
+@lru_cache(maxsize=1024)
+def grammar_for(seed: int, lobe_id: int, arity: int, depth: int = DEPTH) -> Grammar:
+    return Grammar.generate(f"{seed}:{lobe_id}:{arity}", arity, depth)
+
+
+class LobePhrase:
+    """A lobe's cursor through its grammar, with notes expanded ahead of playback."""
+
+    def __init__(self, grammar: Grammar):
+        self.grammar = grammar
+        self.position = 0
+        self.degree: Optional[int] = None
+        # (note or None for a rest, position, degree before the step)
+        self.buffer: Deque[Tuple[Optional[int], int, Optional[int]]] = deque()
+        self.pool: Tuple[int, ...] = ()
+        self.probability = 0.0
+        self.transpose = 0
+        self.ahead = 1
+
+    def configure(self, pool: Sequence[int], probability: float, transpose: int):
+        pool = tuple(pool)
+        if (pool, probability, transpose) == (self.pool, self.probability, self.transpose):
+            return
+        self.rewind()
+        self.pool, self.probability, self.transpose = pool, probability, transpose
+        if self.degree is not None and pool:
+            self.degree = min(self.degree, OCTAVES * len(pool) - 1)
+
+    def rewind(self):
+        """Drops unplayed notes so they are expanded again with new parameters."""
+        if self.buffer:
+            _, self.position, self.degree = self.buffer[0]
+            self.buffer.clear()
+
+    def fill(self, count: int):
+        pool = self.pool
+        n = len(pool)
+        if not n:
+            return
+        grammar = self.grammar
+        span = OCTAVES * n
+        if self.degree is None:
+            self.degree = n  # Bottom of the middle octave
+        while len(self.buffer) < count:
+            chunk, offset = grammar.chunk_at(self.position)
+            for move, weight in chunk[self.position % grammar.chunk:]:
+                before = self.degree
+                degree = before + move
+                if not 0 <= degree < span:
+                    degree = before - move  # Reflect at the edges of the range
+                self.degree = degree
+                note = None
+                if (offset + weight) % 1.0 < self.probability:
+                    note = max(0, min(127, pool[degree % n] + 12 * (degree // n - 1) + self.transpose))
+                self.buffer.append((note, self.position, before))
+                self.position = (self.position + 1) % grammar.length
+                if len(self.buffer) >= count:
+                    break
+
+
+class PhraseLogic(FractalLogic):
+    """
+    FractalLogic with lobe notes read from L-system phrase buffers instead
+    of independent random draws. Deadlines, the stem and event format are
+    unchanged; `refill()` tops the buffers up between ticks.
+    """
+
+    def __init__(self, clock=time.monotonic, seed: int = 0, bars_ahead: float = 2.0, depth: int = DEPTH):
+        self.seed = seed
+        self.bars_ahead = bars_ahead
+        self.depth = depth
+        super().__init__(clock=clock)
+
+    def reset_engine(self):
+        # Phrases restart from their first step with playback
+        self.phrases: Dict[int, LobePhrase] = {}
+        super().reset_engine()
+
+    def reschedule(self, tempo: int, lobes: List):
+        super().reschedule(tempo, lobes)
+        active = set()
+        for lobe in lobes:
+            if not lobe.active:
+                continue
+            active.add(lobe.id)
+            phrase = self._phrase(lobe)
+            pool = getattr(lobe, "pool", None)
+            phrase.configure(phrase.pool if pool is None else pool, lobe.probability, lobe.transpose)
+        for lobe_id in set(self.phrases) - active:
+            del self.phrases[lobe_id]
+        self.refill()
+
+    def _phrase(self, lobe) -> LobePhrase:
+        arity = arity_for(lobe.division)
+        phrase = self.phrases.get(lobe.id)
+        if phrase is None or phrase.grammar.arity != arity:
+            grammar = grammar_for(self.seed, lobe.id, arity, self.depth)
+            fresh = LobePhrase(grammar)
+            if phrase is not None:
+                # Keep the place in the piece across a change of branching
+                phrase.rewind()
+                fresh.position, fresh.degree = phrase.position % grammar.length, phrase.degree
+                fresh.configure(phrase.pool, phrase.probability, phrase.transpose)
+            phrase = self.phrases[lobe.id] = fresh
+        phrase.ahead = max(1, math.ceil(self.bars_ahead * BEATS_PER_BAR * lobe.division))
+        return phrase
+
+    def refill(self):
+        for phrase in self.phrases.values():
+            if len(phrase.buffer) < phrase.ahead:
+                phrase.fill(phrase.ahead)
+
+    def _choose_note(self, lobe, pool) -> Optional[int]:
+        if not pool:
+            return None
+        phrase = self.phrases.get(lobe.id)
+        if phrase is None:
+            phrase = self._phrase(lobe)
+        if pool is not phrase.pool:
+            phrase.configure(pool, lobe.probability, lobe.transpose)
+        if not phrase.buffer:
+            # Underrun: refill() has not run since the last tick
+            phrase.fill(phrase.ahead)
+        return phrase.buffer.popleft()[0]
+
+
+def benchmark(depths=(8, 16, 32, 64), steps: int = 100000) -> dict:
+    """Microseconds per expanded step at increasing recursion depth."""
+    results = {}
+    for depth in depths:
+        phrase = LobePhrase(Grammar.generate(f"bench:{depth}", 2, depth))
+        phrase.configure((60, 62, 64, 67, 69), 0.7, 0)
+        # Start deep inside the expansion so every chunk walks the full path
+        phrase.position = phrase.grammar.length // 3
+        start = time.perf_counter()
+        phrase.fill(steps)
+        results[depth] = (time.perf_counter() - start) / steps * 1e6
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(benchmark(), indent=4))
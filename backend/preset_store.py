@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger("maple.presets")
+
+AUTOSAVE_NAME = "autosave"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS preset_tags (
+    tag TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES presets(name) ON DELETE CASCADE,
+    PRIMARY KEY (tag, name)
+);
+CREATE INDEX IF NOT EXISTS presets_updated ON presets(updated_at);
+CREATE INDEX IF NOT EXISTS preset_tags_name ON preset_tags(name);
+"""
+
+
+class PresetStore:
+    """
+    Named, tagged presets in SQLite. Each write is a single transaction, so a
+    crash leaves either the old or the new preset, never a torn file. The
+    async methods run the blocking work in a worker thread, and loads are
+    served from an in-memory LRU when possible. The LRU has its own lock so
+    cache hits on the event loop never wait behind a database query.
+    """
+
+    def __init__(self, path: str = "maple_presets.db", cache_size: int = 128):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened lazily so the file only appears once presets are used
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, name: str, data: dict):
+        with self._cache_lock:
+            self.cache[name] = data
+            self.cache.move_to_end(name)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _cached(self, name: str) -> Optional[dict]:
+        with self._cache_lock:
+            data = self.cache.get(name)
+            if data is not None:
+                self.cache.move_to_end(name)
+            return data
+
+    # Blocking implementations; call through the async wrappers on the event loop
+
+    def save_sync(self, name: str, data: dict, tags: Iterable[str] = ()):
+        payload = json.dumps(data, separators=(",", ":"))
+        tags = sorted({t.strip() for t in tags if t and t.strip()})
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO presets(name, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+                    (name, payload, time.time()),
+                )
+                conn.execute("DELETE FROM preset_tags WHERE name = ?", (name,))
+                conn.executemany("INSERT INTO preset_tags(tag, name) VALUES (?, ?)", [(t, name) for t in tags])
+            self.stats["writes"] += 1
+            self._remember(name, data)
+
+    def load_sync(self, name: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db().execute("SELECT data FROM presets WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            data = json.loads(row[0])
+            self._remember(name, data)
+            return data
+
+    def list_sync(self, tag: Optional[str] = None, query: Optional[str] = None, limit: int = 500) -> List[dict]:
+        sql = "SELECT p.name, p.updated_at, (SELECT group_concat(tag) FROM preset_tags t WHERE t.name = p.name) FROM presets p"
+        where, args = [], []
+        if tag:
+            where.append("EXISTS (SELECT 1 FROM preset_tags t WHERE t.name = p.name AND t.tag = ?)")
+            args.append(tag)
+        if query:
+            where.append("p.name LIKE ? ESCAPE '\\'")
+            args.append("%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY p.updated_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._db().execute(sql, args).fetchall()
+        return [
+            {"name": name, "updated_at": updated_at, "tags": sorted(tags.split(",")) if tags else []}
+            for name, updated_at, tags in rows
+        ]
+
+    def delete_sync(self, name: str) -> bool:
+        with self._lock:
+            conn = self._db()
+            with conn:
+                deleted = conn.execute("DELETE FROM presets WHERE name = ?", (name,)).rowcount
+            with self._cache_lock:
+                self.cache.pop(name, None)
+        return bool(deleted)
+
+    def warm_sync(self, count: int) -> int:
+        """Preloads the most recently updated presets into the LRU."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT name, data FROM presets ORDER BY updated_at DESC LIMIT ?", (count,)
+            ).fetchall()
+            # Oldest first so the most recent end up most-recently-used
+            for name, data in reversed(rows):
+                self._remember(name, json.loads(data))
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Event-loop friendly API
+
+    async def save(self, name: str, data: dict, tags: Iterable[str] = ()):
+        await asyncio.to_thread(self.save_sync, name, data, list(tags))
+
+    async def load(self, name: str) -> Optional[dict]:
+        cached = self._cached(name)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+        self.stats["misses"] += 1
+        return await asyncio.to_thread(self.load_sync, name)
+
+    async def list(self, tag: Optional[str] = None, query: Optional[str] = None) -> List[dict]:
+        return await asyncio.to_thread(self.list_sync, tag, query)
+
+    async def delete(self, name: str) -> bool:
+        return await asyncio.to_thread(self.delete_sync, name)
+
+    async def warm(self, count: Optional[int] = None) -> int:
+        return await asyncio.to_thread(self.warm_sync, count or self.cache_size)
+
+
+class Autosaver:
+    """
+    Debounced autosave: every state commit restarts a timer, and the live
+    state is written once edits have been quiet for `delay` seconds.
+    """
+
+    def __init__(self, store: PresetStore, delay: float = 2.0, name: str = AUTOSAVE_NAME):
+        self.store = store
+        self.delay = delay
+        self.name = name
+        self.saved_version = None
+        self._pending = None
+        self._task: Optional[asyncio.Task] = None
+
+    def on_state_commit(self, snapshot, delta):
+        self._pending = snapshot
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                pass  # No loop (e.g. scripted use); nothing to debounce against
+
+    async def _run(self):
+        while True:
+            seen = self._pending
+            await asyncio.sleep(self.delay)
+            if self._pending is seen:
+                break
+        snapshot = self._pending
+        if snapshot.version == self.saved_version:
+            return
+        try:
+            await self.store.save(self.name, snapshot.state.to_dict(), tags=["autosave"])
+            self.saved_version = snapshot.version
+        except Exception as e:
+            logger.error(f"Autosave failed: {e}")
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import struct
+import time
+from typing import List, Set, Tuple
+
+logger = logging.getLogger("maple.pulse_stream")
+
+# Binary frame layout (little endian), mirrored by frontend/src/pulseFrame.js:
+#   header: version u8, stem pulse count u8, record count u16, frame time f64 (seconds)
+#   record: lobe_id u16, note u8, velocity u8, offset from frame time f32 (seconds)
+FRAME_VERSION = 1
+HEADER = struct.Struct("<BBHd")
+RECORD = struct.Struct("<HBBf")
+
+MIN_FPS = 1
+MAX_FPS = 120
+DEFAULT_FPS = 60
+MAX_RECORDS = 0xFFFF
+
+
+def clamp_fps(fps) -> int:
+    try:
+        fps = int(fps)
+    except (TypeError, ValueError):
+        return DEFAULT_FPS
+    return max(MIN_FPS, min(MAX_FPS, fps))
+
+
+def encode_frame(frame_time: float, pulses: List[Tuple[int, int, int, float]], stem_pulses: int = 0) -> bytes:
+    """Packs (lobe_id, note, velocity, time) pulses into one frame."""
+    pulses = pulses[:MAX_RECORDS]
+    buf = bytearray(HEADER.size + RECORD.size * len(pulses))
+    HEADER.pack_into(buf, 0, FRAME_VERSION, min(stem_pulses, 255), len(pulses), frame_time)
+    offset = HEADER.size
+    pack = RECORD.pack_into
+    for lobe_id, note, velocity, t in pulses:
+        pack(buf, offset, lobe_id & 0xFFFF, note & 0x7F, velocity & 0x7F, t - frame_time)
+        offset += RECORD.size
+    return bytes(buf)
+
+
+def decode_frame(data: bytes):
+    """Inverse of encode_frame; returns (frame_time, stem_pulses, [(lobe_id, note, velocity, time)])."""
+    version, stem_pulses, count, frame_time = HEADER.unpack_from(data, 0)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported pulse frame version {version}")
+    pulses = [
+        (lobe_id, note, velocity, frame_time + offset)
+        for lobe_id, note, velocity, offset in RECORD.iter_unpack(data[HEADER.size:HEADER.size + count * RECORD.size])
+    ]
+    return frame_time, stem_pulses, pulses
+
+
+class PulseStream:
+    """
+    Accumulates pulses for every subscriber at one frame rate and emits a
+    single packed frame per display frame, encoded once for all of them.
+    """
+
+    def __init__(self, fps: int, clock=time.monotonic):
+        self.fps = fps
+        self.clock = clock
+        self.subscribers: Set = set()
+        self.pulses: List[Tuple[int, int, int, float]] = []
+        self.stem_pulses = 0
+        self.frames = 0
+        self.task = None
+
+    def add_pulse(self, lobe_id: int, note: int, velocity: int, t: float):
+        self.pulses.append((lobe_id, note, velocity, t))
+
+    def add_stem_pulse(self):
+        self.stem_pulses += 1
+
+    def take_frame(self, frame_time: float):
+        if not self.pulses and not self.stem_pulses:
+            return None
+        frame = encode_frame(frame_time, self.pulses, self.stem_pulses)
+        self.pulses = []
+        self.stem_pulses = 0
+        self.frames += 1
+        return frame
+
+    async def run(self, emit):
+        """Flushes a frame every 1/fps seconds until the last subscriber leaves."""
+        interval = 1.0 / self.fps
+        while self.subscribers:
+            await asyncio.sleep(interval)
+            frame = self.take_frame(self.clock())
+            if frame is not None:
+                emit(self, frame)
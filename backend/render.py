@@ -0,0 +1,117 @@
+import argparse
+import logging
+import os
+import time
+from typing import List, Optional
+
+import mido
+
+from fractal_logic import make_logic
+from state_manager import AppState, StateManager
+
+logger = logging.getLogger("maple.render")
+
+TICKS_PER_BEAT = 480
+BEATS_PER_BAR = 4
+
+
+class VirtualClock:
+    """Clock that only moves when the renderer advances it."""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def render_events(state: AppState, seconds: float, seed: int = 0, engine: str = "random") -> List[tuple]:
+    """
+    Runs the generator against a virtual clock as fast as possible.
+    Returns (time, is_note_on, channel, note, velocity) tuples sorted by time,
+    with note-offs ordered before note-ons at the same instant.
+    """
+    clock = VirtualClock()
+    logic = make_logic(engine, clock, seed)
+    logic.reschedule(state.tempo, state.lobes)
+
+    messages = []
+    seq = 0
+    while True:
+        deadline = logic.next_deadline()
+        if deadline is None or deadline >= seconds:
+            break
+        clock.now = deadline
+        for event in logic.tick(state.tempo, state.lobes, state.selected_notes, now=deadline):
+            if event['type'] != 'note':
+                continue
+            on_at = event['time']
+            messages.append((on_at, 1, seq, event['channel'], event['note'], event['velocity']))
+            messages.append((on_at + event['duration'], 0, seq, event['channel'], event['note'], 0))
+            seq += 1
+        logic.refill()
+
+    messages.sort()
+    return [(t, bool(kind), channel, note, velocity) for t, kind, _, channel, note, velocity in messages]
+
+
+def render_midi(state: AppState, seconds: Optional[float] = None, bars: Optional[int] = None,
+                seed: int = 0, ticks_per_beat: int = TICKS_PER_BEAT, engine: str = "random") -> mido.MidiFile:
+    if seconds is None:
+        seconds = (bars if bars is not None else 16) * BEATS_PER_BAR * 60.0 / state.tempo
+
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    track.append(mido.MetaMessage('track_name', name=f"Maple seed {seed}", time=0))
+    track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(state.tempo), time=0))
+
+    ticks_per_second = state.tempo / 60.0 * ticks_per_beat
+    last_tick = 0
+    for t, is_on, channel, note, velocity in render_events(state, seconds, seed, engine):
+        tick = int(round(t * ticks_per_second))
+        kind = 'note_on' if is_on else 'note_off'
+        track.append(mido.Message(kind, channel=channel, note=note, velocity=velocity, time=tick - last_tick))
+        last_tick = tick
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return midi_file
+
+
+def load_state(path: str) -> AppState:
+    state = StateManager().load_from_file(path)
+    if state is None:
+        raise FileNotFoundError(path)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render Maple states to Standard MIDI Files faster than real time.")
+    parser.add_argument("states", nargs="*", default=["maple_state.json"], help="Saved state JSON files")
+    length = parser.add_mutually_exclusive_group()
+    length.add_argument("--bars", type=int, help="Length in 4/4 bars (default 16)")
+    length.add_argument("--minutes", type=float, help="Length in minutes")
+    parser.add_argument("--seed", type=int, default=0, help="First RNG seed")
+    parser.add_argument("--variations", type=int, default=1, help="Render this many consecutive seeds per state")
+    parser.add_argument("--out-dir", default=".", help="Directory for the .mid files")
+    parser.add_argument("--engine", choices=("random", "phrase"), default="random",
+                        help="Note generator: independent random draws or L-system phrases")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    seconds = args.minutes * 60.0 if args.minutes is not None else None
+    start = time.perf_counter()
+    rendered = 0
+    for path in args.states:
+        state = load_state(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for seed in range(args.seed, args.seed + args.variations):
+            out = os.path.join(args.out_dir, f"{name}_s{seed}.mid")
+            render_midi(state, seconds=seconds, bars=args.bars, seed=seed, engine=args.engine).save(out)
+            rendered += 1
+            print(out)
+    logger.info(f"Rendered {rendered} file(s) in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
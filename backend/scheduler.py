@@ -0,0 +1,129 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger("maple.scheduler")
+
+
+class DeadlineQueue:
+    """Min-heap of (deadline, item) pairs on the monotonic clock."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, deadline: float, item: Any):
+        heapq.heappush(self._heap, (deadline, next(self._seq), item))
+
+    def peek(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[float, Any]]:
+        """Removes and returns every (deadline, item) with deadline <= now, earliest first."""
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, item = heapq.heappop(heap)
+            due.append((deadline, item))
+        return due
+
+    def clear(self):
+        self._heap.clear()
+
+
+class JitterReport:
+    """Collects scheduled-vs-actual send times and summarizes the lateness."""
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self.samples: List[float] = []
+        self.count = 0
+        self._next = 0
+
+    def record(self, scheduled: float, actual: float):
+        lateness = actual - scheduled
+        if len(self.samples) < self.max_samples:
+            self.samples.append(lateness)
+        else:
+            # Ring buffer once full so the report tracks recent behaviour
+            self.samples[self._next] = lateness
+            self._next = (self._next + 1) % self.max_samples
+        self.count += 1
+
+    def reset(self):
+        self.samples.clear()
+        self.count = 0
+        self._next = 0
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"count": self.count, "samples": 0}
+        ordered = sorted(self.samples)
+        n = len(ordered)
+
+        def pct(p):
+            return ordered[min(n - 1, int(math.ceil(p / 100.0 * n)) - 1)] * 1000.0
+
+        return {
+            "count": self.count,
+            "samples": n,
+            "mean_ms": sum(ordered) / n * 1000.0,
+            "p50_ms": pct(50),
+            "p99_ms": pct(99),
+            "max_ms": ordered[-1] * 1000.0,
+            "min_ms": ordered[0] * 1000.0,
+        }
+
+
+class LookaheadScheduler:
+    """
+    Sleeps until an absolute monotonic deadline instead of polling.
+
+    The event loop can only time out at millisecond granularity, so we sleep
+    until `spin` seconds before the deadline and spin out the remainder,
+    yielding to the loop on every pass so other tasks keep running.
+    `wake()` interrupts a pending sleep, e.g. after tempo or lobe edits move
+    the next deadline earlier.
+    """
+
+    def __init__(self, spin: float = 0.001, clock=time.monotonic):
+        self.spin = spin
+        self.clock = clock
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    async def _wait(self, timeout: float) -> bool:
+        """True if woken within `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def sleep_until(self, deadline: Optional[float], idle: float = 0.1) -> bool:
+        """
+        Waits for `deadline` (or `idle` seconds when there is none).
+        Returns False if woken early by `wake()`, True once the deadline is reached.
+        """
+        self._wake.clear()
+        if deadline is None:
+            # Nothing is due, so there is nothing to be precise about
+            return not await self._wait(idle)
+        coarse = deadline - self.clock() - self.spin
+        if coarse > 0 and await self._wait(coarse):
+            return False
+        while self.clock() < deadline:
+            await asyncio.sleep(0)
+        return True
+
+
+scheduler = LookaheadScheduler()
@@ -0,0 +1,158 @@
+"""
+Production launcher: one process, no reloader, uvloop when installed, and
+the last autosaved (or saved) state preloaded before the first request.
+
+    python serve.py [--host 0.0.0.0] [--port 8000] [--resume] [--fake-midi]
+    python serve.py --benchmark [--runs 5] [--target-ms 1000]
+
+--benchmark measures cold start: wall time from launching a fresh process
+to its first MIDI note-on, and fails when the median misses the target.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger("maple.serve")
+
+PROBE_ENV = "MAPLE_STARTUP_PROBE"
+PROBE_LINE = "MAPLE_FIRST_NOTE"
+
+
+def event_loop() -> str:
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def last_state(store, state_file: str):
+    """The autosave preset from the warm cache, else the saved state file."""
+    from ingest import validate_state
+    from preset_store import AUTOSAVE_NAME
+    from state_manager import AppState, StateManager
+
+    candidates = []
+    if os.path.exists(store.path):
+        candidates.append((lambda: store.load_sync(AUTOSAVE_NAME), f"preset {AUTOSAVE_NAME!r}"))
+    candidates.append((lambda: StateManager.read_json(state_file), state_file))
+    for load, source in candidates:
+        data = load()
+        if data is None:
+            continue
+        error = validate_state(data)
+        if error is None:
+            return AppState.from_dict(data), source
+        logger.warning(f"Ignoring {source}: {error}")
+    return None, None
+
+
+def install_probe(midi_engine):
+    """Reports the first note-on on stdout, then exits; used by the cold-start benchmark."""
+    send = midi_engine.send_note_on
+
+    def probe(*args, **kwargs):
+        out = send(*args, **kwargs)
+        print(PROBE_LINE, flush=True)
+        os._exit(0)
+        return out
+
+    midi_engine.send_note_on = probe
+
+
+def serve(host: str, port: int, resume: bool, fake_midi: bool, log_level: str):
+    if fake_midi:
+        from bench import install_fake_rtmidi
+        install_fake_rtmidi()
+
+    import uvicorn
+    import main
+
+    state, source = last_state(main.preset_store, main.STATE_FILE)
+    if state is not None:
+        if not resume:
+            state.playing = False
+        main.state_manager.replace_state(state)
+        logger.info(f"Preloaded state from {source} (playing={state.playing})")
+    if os.environ.get(PROBE_ENV):
+        install_probe(main.midi_engine)
+
+    uvicorn.run(main.app, host=host, port=port, loop=event_loop(), reload=False, workers=1, log_level=log_level)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cold_start_benchmark(runs: int = 5, target_ms: float = 1000.0, timeout: float = 30.0) -> dict:
+    """
+    Launches fresh server processes with a playing one-lobe state and times
+    process start to first note-on. The lobe fires every 1/64 beat, so the
+    musical wait is under 10 ms of the total.
+    """
+    import tempfile
+    from state_manager import AppState, LobeState, write_json_atomic
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        state = AppState(lobes=[LobeState(0, "Probe", probability=1.0, division=16.0)], playing=True)
+        write_json_atomic(os.path.join(tmp, "maple_state.json"), state.to_dict())
+        env = {**os.environ, PROBE_ENV: "1", "MAPLE_PRESET_DB": os.path.join(tmp, "presets.db"),
+               "PYTHONPATH": here + os.pathsep + os.environ.get("PYTHONPATH", "")}
+        for _ in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, os.path.join(here, "serve.py"), "--port", str(free_port()), "--resume",
+                 "--fake-midi", "--log-level", "warning"],
+                cwd=tmp, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            try:
+                # The probe exits right after the first note-on
+                out, _ = proc.communicate(timeout=timeout)
+                if PROBE_LINE in out:
+                    samples.append((time.perf_counter() - start) * 1000.0)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+    median = statistics.median(samples) if samples else None
+    return {
+        "runs": runs,
+        "completed": len(samples),
+        "samples_ms": samples,
+        "median_ms": median,
+        "max_ms": max(samples) if samples else None,
+        "target_ms": target_ms,
+        "ok": median is not None and len(samples) == runs and median <= target_ms,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Maple backend for production.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--resume", action="store_true", help="Resume playback if the preloaded state was playing")
+    parser.add_argument("--fake-midi", action="store_true", help="Use a fake MIDI backend (hosts without ALSA/CoreMIDI)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--benchmark", action="store_true", help="Measure time from process start to first note")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=1000.0)
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        report = cold_start_benchmark(args.runs, args.target_ms)
+        print(json.dumps(report, indent=4))
+        sys.exit(0 if report["ok"] else 1)
+    serve(args.host, args.port, args.resume, args.fake_midi, args.log_level)
+
+
+if __name__ == "__main__":
+    # Logging is configured by main.py when the app is imported
+    main()
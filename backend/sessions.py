@@ -0,0 +1,336 @@
+"""
+Independent performances hosted on one server.
+
+Each Session owns its state, generator, MIDI engine and connections.
+SessionHub creates sessions on first use, evicts idle ones and drives every
+session, the main /ws performance included, from a single deadline heap, so
+a server with hundreds of sessions still runs one timer task and one note
+dispatch path.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Callable, Dict, Optional
+
+from broadcast import ConnectionManager
+from fractal_logic import make_logic
+from ingest import Ingest
+from metrics import EVENT_LATENESS, NOTES, TICK_INTERVAL
+from scheduler import DeadlineQueue, JitterReport, LookaheadScheduler
+from state_manager import StateManager
+
+logger = logging.getLogger("maple.sessions")
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Session:
+    def __init__(self, session_id: str, states: StateManager, midi, logic, manager: ConnectionManager,
+                 state_file: Optional[str] = None, drives_midi: bool = True, clock_sync=None, journal=None,
+                 jitter: Optional[JitterReport] = None):
+        self.id = session_id
+        self.states = states
+        self.midi = midi
+        self.logic = logic
+        self.manager = manager
+        self.state_file = state_file or f"maple_state_{session_id}.json"
+        # False when MIDI is played elsewhere (the engine worker process)
+        self.drives_midi = drives_midi
+        # Optional clock_sync.ClockSync: an external clock overrides the tempo and pins the beat grid
+        self.clock_sync = clock_sync
+        # Optional journal.Journal recording emitted note-ons and stem pulses
+        self.journal = journal
+        self.engine_version = None
+        self.playing = states.state.playing
+        self.armed: Optional[float] = None
+        # Earliest next step after a failed one
+        self.retry_at: Optional[float] = None
+        self.last_step: Optional[float] = None
+        self.jitter = jitter
+        self.last_active = time.monotonic()
+        # UI edits are merged here and applied once per tick
+        self.ingest = Ingest(states, self._after_ingest)
+
+    def _after_ingest(self, changes: dict):
+        if "selected_midi_port" in changes:
+            self.select_port(changes["selected_midi_port"])
+        if changes.get("playing") is False:
+            self.stop_notes()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def init_message(self) -> dict:
+        return {
+            "type": "init",
+            "version": self.states.version,
+            "state": self.states.state.to_dict(),
+            "ports": self.midi.get_port_names(),
+        }
+
+    def select_port(self, index):
+        if self.drives_midi:
+            self.midi.open_port(index)
+
+    def stop_notes(self):
+        if self.drives_midi:
+            self.midi.all_notes_off()
+
+    def tempo_for(self, state) -> float:
+        return self.clock_sync.tempo_for(state.tempo) if self.clock_sync is not None else state.tempo
+
+    def next_deadline(self) -> Optional[float]:
+        deadlines = [d for d in (self.logic.next_deadline() if self.playing else None, self.midi.next_note_off())
+                     if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def follow(self, snapshot):
+        """Brings the generator in line with a new state version."""
+        state = snapshot.state
+        if state.playing and not self.playing:
+            logger.info(f"Session {self.id}: playback started")
+            self.logic.reset_engine()
+        elif self.playing and not state.playing:
+            self.stop_notes()
+        self.playing = state.playing
+        self.engine_version = snapshot.version
+        if state.playing:
+            self.logic.reschedule(self.tempo_for(state), snapshot.plan)
+            self.align()
+
+    def align(self):
+        """Snaps pending deadlines to the external clock's current beat grid, if there is one."""
+        grid = self.clock_sync.grid if self.clock_sync is not None else None
+        if grid is not None and self.playing:
+            self.logic.align(grid.anchor, grid.tempo, self.states.snapshot.plan)
+
+    def step(self, now: float):
+        """Releases due note-offs, applies queued edits and fires due lobes."""
+        # Note-offs first so retriggers aren't cut short
+        self.midi.flush_note_offs(now)
+        self.ingest.flush()
+        snapshot = self.states.snapshot
+        if snapshot.version != self.engine_version:
+            self.follow(snapshot)
+        if not self.playing:
+            self.last_step = None
+            return
+        if self.last_step is not None:
+            TICK_INTERVAL.observe(now - self.last_step)
+        self.last_step = now
+        state = snapshot.state
+        journal = self.journal
+        for event in self.logic.tick(self.tempo_for(state), snapshot.plan, state.selected_notes, now=now):
+            if event['type'] == 'note':
+                out = self.midi.send_note_on(event['channel'], event['note'], event['velocity'], event['port'],
+                                             event['lobe_id'])
+                sent_at = time.monotonic()
+                EVENT_LATENESS.observe(sent_at - event['time'])
+                NOTES.inc(event['lobe_id'])
+                if self.jitter is not None:
+                    self.jitter.record(event['time'], sent_at)
+                if journal is not None:
+                    journal.note_on(event['time'], event['channel'], event['note'], event['velocity'],
+                                    event['lobe_id'], self.midi.port_index(event['port']))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Session {self.id}: note {event['note']} for lobe {event['lobe_id']}")
+                self.manager.broadcast_pulse(event['lobe_id'], event['note'], event['velocity'], event['time'])
+                self.midi.schedule_note_off(event['channel'], event['note'], event['time'] + event['duration'],
+                                            out, event['lobe_id'])
+            elif event['type'] == 'stem_pulse':
+                if journal is not None:
+                    journal.stem(event['time'])
+                self.manager.broadcast_stem_pulse(event['timestamp'])
+        # Expand upcoming phrases now that this tick's notes are out
+        self.logic.refill()
+
+    def idle_for(self, now: float) -> float:
+        if self.manager.clients or self.playing:
+            return 0.0
+        return now - self.last_active
+
+    def close(self):
+        self.ingest.close()
+        for websocket in list(self.manager.clients):
+            self.manager.disconnect(websocket)
+        self.midi.all_notes_off()
+        self.midi.close()
+        if self.journal is not None:
+            self.journal.close()
+
+
+class SessionHub:
+    """Lazily created sessions sharing one deadline heap and one timer task."""
+
+    def __init__(self, backend_factory=None, ports=None, idle_timeout: float = 300.0, max_sessions: int = 1000,
+                 clock=time.monotonic, scheduler: Optional[LookaheadScheduler] = None,
+                 journal_dir: Optional[str] = None, error_backoff: float = 1.0):
+        self.backend_factory = backend_factory
+        # Each created session journals to maple-<id>-*.mlj here when set
+        self.journal_dir = journal_dir
+        self.ports = ports
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.sessions: Dict[str, Session] = {}
+        # Sessions added from outside (the main performance) are never evicted
+        self.pinned = set()
+        # State listener per session, removed again on eviction
+        self._listeners: Dict[str, Callable] = {}
+        # (deadline, session id); superseded entries are skipped when popped
+        self.deadlines = DeadlineQueue()
+        self.scheduler = scheduler or LookaheadScheduler(clock=clock)
+        # Seconds a session waits before stepping again after a step raised
+        self.error_backoff = error_backoff
+        self.stats = {"created": 0, "evicted": 0, "steps": 0}
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Returns the session, creating it on first use. None for invalid ids or when full."""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        if not SESSION_ID.match(session_id) or len(self.sessions) >= self.max_sessions:
+            return None
+        from midi_engine import MidiEngine
+        midi = MidiEngine(self.backend_factory, virtual_name=f"Maple {session_id}", ports=self.ports)
+        session = Session(session_id, StateManager(), midi, make_logic(clock=self.clock), ConnectionManager())
+        if self.journal_dir is not None:
+            from journal import Journal
+            session.journal = midi.journal = Journal(self.journal_dir, prefix=f"maple-{session_id}")
+            session.states.subscribe(session.journal.on_state_commit)
+        self._host(session)
+        self.stats["created"] += 1
+        logger.info(f"Created session {session_id}")
+        return session
+
+    def add(self, session: Session):
+        """Hosts a session built elsewhere, following its current state. It is never evicted."""
+        self.pinned.add(session.id)
+        self._host(session)
+        session.follow(session.states.snapshot)
+        self.arm(session)
+
+    def _host(self, session: Session):
+        listener = self._listeners[session.id] = lambda snapshot, delta: self._on_commit(session, snapshot, delta)
+        session.states.subscribe(listener)
+        self.sessions[session.id] = session
+
+    def _on_commit(self, session: Session, snapshot, delta):
+        session.touch()
+        session.follow(snapshot)
+        session.manager.broadcast(delta if delta is not None else session.init_message())
+        self.arm(session)
+
+    def arm(self, session: Session):
+        """(Re)queues the session at its next deadline, waking the timer if that is now the earliest."""
+        deadline = session.next_deadline()
+        if session.retry_at is not None and (deadline is None or deadline < session.retry_at):
+            deadline = session.retry_at  # Backing off after a failed step
+        if deadline is None or deadline == session.armed:
+            return
+        earliest = self.deadlines.peek()
+        session.armed = deadline
+        self.deadlines.push(deadline, session.id)
+        if earliest is None or deadline < earliest:
+            self.scheduler.wake()
+
+    async def run(self, evict_interval: float = 5.0):
+        next_evict = self.clock() + evict_interval
+        while True:
+            now = self.clock()
+            for deadline, session_id in self.deadlines.pop_due(now):
+                session = self.sessions.get(session_id)
+                if session is None or session.armed != deadline:
+                    continue
+                session.armed = None
+                try:
+                    session.step(now)
+                    session.retry_at = None
+                except Exception as e:
+                    # One attempt per backoff instead of retrying the past deadline in a hot loop.
+                    # The retry re-follows the state, restoring lobe deadlines the failed tick popped
+                    logger.error(f"Error in session {session_id}, retrying in {self.error_backoff}s: {e}",
+                                 exc_info=True)
+                    session.engine_version = None
+                    session.retry_at = now + self.error_backoff
+                self.stats["steps"] += 1
+                self.arm(session)
+            if now >= next_evict:
+                self.evict_idle(now)
+                next_evict = now + evict_interval
+            await self.scheduler.sleep_until(self.deadlines.peek(), idle=evict_interval)
+
+    def ports_changed(self, ports):
+        """Follows a hotplug change in every session: closes unplugged outputs and refreshes the clients' port lists."""
+        message = {"type": "ports_changed", "ports": [p.name for p in ports]}
+        for session in list(self.sessions.values()):
+            session.midi.prune(ports)
+            session.manager.broadcast(message)
+
+    def evict_idle(self, now: Optional[float] = None):
+        now = self.clock() if now is None else now
+        for session_id, session in list(self.sessions.items()):
+            if session_id not in self.pinned and session.idle_for(now) > self.idle_timeout:
+                self.evict(session_id)
+
+    def evict(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.states.unsubscribe(self._listeners.pop(session_id))
+        self.pinned.discard(session_id)
+        session.close()
+        self.stats["evicted"] += 1
+        logger.info(f"Evicted idle session {session_id}")
+
+    def summary(self) -> dict:
+        return {
+            **self.stats,
+            "active": len(self.sessions),
+            "pending_deadlines": len(self.deadlines),
+            "sessions": {
+                sid: {"clients": len(s.manager.clients), "playing": s.playing, "version": s.states.version,
+                      "ingest": s.ingest.stats}
+                for sid, s in self.sessions.items()
+            },
+        }
+
+    def close(self):
+        for session_id in list(self.sessions):
+            self.evict(session_id)
+
+
+def benchmark(session_counts=(1, 10, 100, 300), seconds: float = 5.0, lobes: int = 5) -> dict:
+    """CPU use and note lateness of one hub driving N playing sessions with one client each."""
+    from bench import FakeWebSocket
+    from midi_output import FakeMidiOut
+
+    async def scenario(count):
+        hub = SessionHub(backend_factory=FakeMidiOut)
+        jitter = JitterReport(max_samples=100000)
+        for i in range(count):
+            session = hub.get(f"bench-{i}")
+            session.jitter = jitter
+            await session.manager.connect(FakeWebSocket())
+            for lobe in range(lobes):
+                session.states.update_lobe(lobe, {"active": True, "probability": 1.0})
+            session.states.update_global({"playing": True, "tempo": 120 + i % 60})
+        runner = asyncio.create_task(hub.run())
+        cpu = time.process_time()
+        await asyncio.sleep(seconds)
+        cpu = time.process_time() - cpu
+        runner.cancel()
+        steps = hub.stats["steps"]
+        hub.close()
+        return {"cpu_percent": cpu / seconds * 100.0, "steps": steps, "lateness": jitter.summary()}
+
+    return {count: asyncio.run(scenario(count)) for count in session_counts}
+
+
+if __name__ == "__main__":
+    import json
+    from bench import install_fake_rtmidi
+    install_fake_rtmidi()
+    logging.basicConfig(level=logging.WARNING)
+    print(json.dumps(benchmark(), indent=4))
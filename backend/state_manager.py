@@ -1,8 +1,12 @@
-from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from dataclasses import dataclass, field, fields, replace
+from collections import deque
+from typing import Callable, List, Dict, NamedTuple, Optional, Tuple
 import logging
 import json
 import os
+import tempfile
+
+from fractal_logic import register_pool
 
 logger = logging.getLogger("maple.state")
 
@@ -17,6 +21,7 @@ class LobeState:
     transpose: int = 0  # Semitones offset
     velocity: int = 100
     register: str = "all"  # all, low, high
+    output_port: Optional[str] = None  # Port name to route to; None = selected port
 
     @classmethod
     def from_dict(cls, data: dict):
@@ -40,7 +45,7 @@ class AppState:
         return {
             "tempo": self.tempo,
             "selected_midi_port": self.selected_midi_port,
-            "lobes": [vars(l) for l in self.lobes],
+            "lobes": [dict(vars(l)) for l in self.lobes],
             "selected_notes": self.selected_notes,
             "playing": self.playing,
         }
@@ -57,9 +62,68 @@ class AppState:
         filtered_data = {k: v for k, v in data.items() if k in valid_keys and k != 'lobes'}
         return cls(lobes=lobes, **filtered_data)
 
+class LobePlan(NamedTuple):
+    """Precompiled, immutable playback parameters for one lobe."""
+    id: int
+    active: bool
+    instrument_channel: int
+    division: float
+    probability: float
+    transpose: int
+    velocity: int
+    register: str
+    output_port: Optional[str]
+    pool: Tuple[int, ...]  # Register-filtered scale
+
+def compile_lobe(lobe: LobeState, scale: List[int]) -> LobePlan:
+    return LobePlan(
+        id=lobe.id,
+        active=lobe.active,
+        instrument_channel=lobe.instrument_channel,
+        division=max(0.1, lobe.division),
+        probability=lobe.probability,
+        transpose=lobe.transpose,
+        velocity=max(0, min(127, lobe.velocity)),
+        register=lobe.register,
+        output_port=lobe.output_port,
+        pool=tuple(register_pool(scale, lobe.register)),
+    )
+
+@dataclass(frozen=True)
+class StateSnapshot:
+    version: int
+    state: AppState
+    plan: Tuple[LobePlan, ...]
+
+LOBE_FIELDS = tuple(f.name for f in fields(LobeState) if f.name != "id")
+GLOBAL_FIELDS = tuple(f.name for f in fields(AppState) if f.name != "lobes")
+
+def diff_states(old: AppState, new: AppState) -> Optional[dict]:
+    """Field-level changes between two states, or None if the lobe layout changed."""
+    if [l.id for l in old.lobes] != [l.id for l in new.lobes]:
+        return None
+    lobes = []
+    for a, b in zip(old.lobes, new.lobes):
+        if a is b:
+            continue
+        changed = {k: getattr(b, k) for k in LOBE_FIELDS if getattr(a, k) != getattr(b, k)}
+        if changed:
+            lobes.append({"id": b.id, **changed})
+    glob = {k: getattr(new, k) for k in GLOBAL_FIELDS if getattr(old, k) != getattr(new, k)}
+    return {"lobes": lobes, "global": glob}
+
 class StateManager:
-    def __init__(self):
-        self.state = AppState(
+    """
+    Copy-on-write state. Every mutation builds a new AppState (sharing
+    untouched lobes), bumps the version, recompiles only the affected lobe
+    plans and swaps `snapshot` in one assignment. Readers grab `snapshot`
+    once and never see a half-applied edit.
+    """
+
+    def __init__(self, history: int = 256):
+        self.history: deque = deque(maxlen=history)
+        self.listeners: List[Callable] = []
+        self.snapshot = self._compile(0, AppState(
             lobes=[
                 LobeState(0, "Left Bottom", instrument_channel=0),
                 LobeState(1, "Left Top", instrument_channel=0),
@@ -67,45 +131,158 @@ class StateManager:
                 LobeState(3, "Right Top", instrument_channel=0),
                 LobeState(4, "Right Bottom", instrument_channel=0),
             ]
-        )
+        ))
+
+    @property
+    def state(self) -> AppState:
+        return self.snapshot.state
+
+    @state.setter
+    def state(self, new_state: AppState):
+        self.replace_state(new_state)
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    def subscribe(self, listener: Callable):
+        """listener(snapshot, delta) runs after every commit; delta is None for a full resync."""
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _compile(self, version, state, previous: Optional[StateSnapshot] = None, changed_ids=None):
+        scale = state.selected_notes or []
+        if previous is not None and changed_ids is not None and previous.state.selected_notes == state.selected_notes:
+            plan = tuple(
+                compile_lobe(lobe, scale) if lobe.id in changed_ids else old
+                for lobe, old in zip(state.lobes, previous.plan)
+            )
+        else:
+            plan = tuple(compile_lobe(lobe, scale) for lobe in state.lobes)
+        return StateSnapshot(version, state, plan)
+
+    def _commit(self, new_state: AppState, delta: Optional[dict], changed_ids=None):
+        previous = self.snapshot
+        version = previous.version + 1
+        self.snapshot = self._compile(version, new_state, previous, changed_ids if delta is not None else None)
+        if delta is None:
+            self.history.clear()
+        else:
+            delta = {"type": "delta", "version": version, **delta}
+            self.history.append(delta)
+        # The version has already advanced; one failing listener must not starve the rest
+        for listener in self.listeners:
+            try:
+                listener(self.snapshot, delta)
+            except Exception as e:
+                logger.error(f"State listener {listener!r} failed: {e}", exc_info=True)
+        return self.snapshot
+
+    def deltas_since(self, version: int) -> Optional[List[dict]]:
+        """Deltas a client at `version` is missing, or None if it needs a full resync."""
+        if version == self.version:
+            return []
+        if not self.history or version < self.history[0]["version"] - 1 or version > self.version:
+            return None
+        return [d for d in self.history if d["version"] > version]
 
     def update_lobe(self, lobe_id: int, updates: dict):
         if 0 <= lobe_id < len(self.state.lobes):
-            lobe = self.state.lobes[lobe_id]
-            for key, value in updates.items():
-                if hasattr(lobe, key):
-                    setattr(lobe, key, value)
-            return lobe
+            self.update_many({lobe_id: updates}, {})
+            return self.state.lobes[lobe_id]
         return None
 
     def update_global(self, updates: dict):
-        for key, value in updates.items():
-            if hasattr(self.state, key):
-                setattr(self.state, key, value)
+        return self.update_many({}, updates)
+
+    def update_many(self, lobe_updates: Dict[int, dict], global_updates: dict):
+        """Applies edits to any number of lobes and globals as a single version."""
+        state = self.state
+        lobes = list(state.lobes)
+        delta_lobes = []
+        for lobe_id, updates in lobe_updates.items():
+            if not 0 <= lobe_id < len(lobes):
+                continue
+            lobe = lobes[lobe_id]
+            changed = {k: v for k, v in updates.items() if k in LOBE_FIELDS and getattr(lobe, k) != v}
+            if changed:
+                lobes[lobe_id] = replace(lobe, **changed)
+                delta_lobes.append({"id": lobe.id, **changed})
+        changed = {k: v for k, v in global_updates.items() if k in GLOBAL_FIELDS and getattr(state, k) != v}
+        if delta_lobes or changed:
+            self._commit(replace(state, lobes=lobes if delta_lobes else state.lobes, **changed),
+                         {"lobes": delta_lobes, "global": changed}, changed_ids={l["id"] for l in delta_lobes})
         return self.state
 
+    def replace_state(self, new_state: AppState):
+        """Swaps in a whole new state, sending only what differs when the lobe layout is unchanged."""
+        delta = diff_states(self.state, new_state)
+        if delta is not None and not delta["lobes"] and not delta["global"]:
+            return self.snapshot
+        changed_ids = {l["id"] for l in delta["lobes"]} if delta is not None else None
+        return self._commit(new_state, delta, changed_ids)
+
     def save_to_file(self, filepath: str):
+        """Writes the current snapshot atomically; safe to run in a worker thread."""
         try:
-            with open(filepath, 'w') as f:
-                json.dump(self.state.to_dict(), f, indent=4)
+            write_json_atomic(filepath, self.state.to_dict())
             logger.info(f"State saved to {filepath}")
             return True
         except Exception as e:
             logger.error(f"Failed to save state: {e}")
             return False
 
-    def load_from_file(self, filepath: str):
+    @staticmethod
+    def read_json(filepath: str) -> Optional[dict]:
+        """Parses a state file into a dict without touching the live state; safe to run in a worker thread."""
         try:
             if not os.path.exists(filepath):
                 logger.warning(f"State file {filepath} not found")
                 return None
             with open(filepath, 'r') as f:
-                data = json.load(f)
-            self.state = AppState.from_dict(data)
-            logger.info(f"State loaded from {filepath}")
-            return self.state
+                return json.load(f)
         except Exception as e:
             logger.error(f"Failed to load state: {e}")
             return None
 
+    @classmethod
+    def read_file(cls, filepath: str) -> Optional[AppState]:
+        """Like read_json, as an AppState."""
+        data = cls.read_json(filepath)
+        if data is None:
+            return None
+        try:
+            return AppState.from_dict(data)
+        except Exception as e:
+            logger.error(f"Failed to load state: {e}")
+            return None
+
+    def load_from_file(self, filepath: str):
+        new_state = self.read_file(filepath)
+        if new_state is None:
+            return None
+        self.state = new_state
+        logger.info(f"State loaded from {filepath}")
+        return self.state
+
+def write_json_atomic(filepath: str, data: dict):
+    """Writes to a temp file in the same directory and renames it over the target."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(prefix=".maple-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 state_manager = StateManager()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import pytest
+
+from bench import TIMING, FakeWebSocket, check, measure
+from broadcast import ConnectionManager
+from fractal_logic import FractalLogic
+from midi_engine import MidiEngine
+from midi_output import FakeMidiOut, encode_note_off, encode_note_on
+from render import VirtualClock
+from state_manager import AppState, LobeState
+
+SCALE = [60, 62, 65, 67, 72, 74, 76, 79]
+
+
+def make_lobes(count):
+    return [LobeState(i, f"Lobe {i}", probability=0.7, division=(0.5, 1.0, 2.0, 4.0)[i % 4],
+                      register=("all", "low", "high")[i % 3], instrument_channel=i % 16) for i in range(count)]
+
+
+def assert_no_regression(name, result):
+    failure = check(name, result)
+    assert failure is None, failure
+
+
+@pytest.mark.parametrize("lobes", [5, 50, 500])
+@pytest.mark.parametrize("tempo", [60, 240])
+def test_tick_throughput(lobes, tempo):
+    plan = make_lobes(lobes)
+
+    def run():
+        # Ten simulated seconds, ticking exactly at each deadline
+        clock = VirtualClock()
+        logic = FractalLogic(clock=clock)
+        logic.reschedule(tempo, plan)
+        while True:
+            deadline = logic.next_deadline()
+            if deadline is None or deadline >= 10.0:
+                break
+            clock.now = deadline
+            logic.tick(tempo, plan, SCALE, now=deadline)
+
+    assert_no_regression(f"tick[lobes={lobes},tempo={tempo}]", measure(run, rounds=3))
+
+
+def test_note_encoding():
+    def run():
+        for note in range(128):
+            encode_note_on(note & 15, note, 100)
+            encode_note_off(note & 15, note)
+
+    assert_no_regression("encode[128 on/off pairs]", measure(run, iterations=200))
+
+
+def test_note_on_off_through_engine():
+    engine = MidiEngine(FakeMidiOut)
+
+    def run():
+        for note in range(128):
+            out = engine.send_note_on(0, note, 100)
+            engine.schedule_note_off(0, note, 0.0, out)
+        engine.flush_note_offs(1.0)
+
+    try:
+        assert_no_regression("engine[128 notes on/off]", measure(run, iterations=50))
+        engine.output.flush()
+        assert engine.output.stats["sent"] >= 256
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("clients", [1, 10, 100])
+def test_broadcast(clients):
+    async def scenario():
+        manager = ConnectionManager(max_queue=100000)
+        sockets = [FakeWebSocket() for _ in range(clients)]
+        for ws in sockets:
+            await manager.connect(ws)
+        result = measure(lambda: manager.broadcast_pulse(1, 60, 100, 0.0), iterations=100)
+        # Let the writer tasks drain what was queued
+        while any(c.queue for c in manager.clients.values()):
+            await asyncio.sleep(0)
+        for ws in sockets:
+            manager.disconnect(ws)
+        return result, sockets
+
+    result, sockets = asyncio.run(scenario())
+    assert all(ws.sent == sockets[0].sent > 0 for ws in sockets)
+    assert_no_regression(f"broadcast[clients={clients}]", result)
+
+
+def test_state_serialize_load():
+    state = AppState(lobes=make_lobes(50))
+
+    def run():
+        AppState.from_dict(json.loads(json.dumps(state.to_dict())))
+
+    assert AppState.from_dict(json.loads(json.dumps(state.to_dict()))) == state
+    assert_no_regression("state[50 lobes serialize+load]", measure(run, iterations=50))
+
+
+def test_cold_start_to_first_note():
+    from serve import cold_start_benchmark
+
+    report = cold_start_benchmark(runs=3)
+    assert report["completed"] == 3, report
+    if TIMING:
+        assert report["ok"], report
+    samples = [ms / 1000.0 for ms in report["samples_ms"]]
+    assert_no_regression("cold_start[first note]", {"min": min(samples), "median": report["median_ms"] / 1000.0,
+                                                    "rounds": 3, "iterations": 1})
+
+
+def test_load_soak_report(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    out = tmp_path / "report.json"
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest.py")
+    subprocess.run([sys.executable, script, "--clients", "12", "--slow", "2", "--spammers", "2", "--duration", "3",
+                    "--churn", "1", "--out", str(out)], cwd=tmp_path, check=True, capture_output=True, timeout=120)
+    report = json.loads(out.read_text())
+    assert report["notes"] > 0 and report["lateness"]["samples"] > 0
+    assert report["broadcast"]["fast"]["samples"] > 0
+    assert report["ingest"]["received"] > 0 and report["ingest"]["rejected"] == 0
+    # Everything a departed client or a stopped performance held is released
+    leaks = report["leaks"]
+    assert leaks["clients_connected"] == 0 and leaks["client_tasks_left"] == 0
+    assert leaks["note_offs_pending"] == 0 and leaks["voices_sounding"] == 0
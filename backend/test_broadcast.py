@@ -0,0 +1,81 @@
+import asyncio
+
+from bench import FakeWebSocket
+from broadcast import ConnectionManager
+
+
+class GatedWebSocket(FakeWebSocket):
+    """Records sends but blocks each one until the gate opens, like a stalled client."""
+
+    def __init__(self):
+        super().__init__(record=True)
+        self.gate = asyncio.Event()
+
+    async def _send(self, data):
+        await self.gate.wait()
+        await super()._send(data)
+
+
+def delta(version):
+    return {"type": "delta", "version": version, "lobes": [], "global": {}}
+
+
+def pulse(note):
+    return {"type": "pulse", "lobe_id": 0, "note": note, "velocity": 100}
+
+
+def test_full_queue_drops_oldest_pulses_and_keeps_state_updates():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4)
+        socket = GatedWebSocket()
+        client = await manager.connect(socket)
+        manager.broadcast(delta(1))
+        await asyncio.sleep(0)  # The writer takes it and blocks on the send
+        for message in (pulse(60), pulse(61), pulse(62), delta(2), pulse(63)):
+            manager.broadcast(message)
+        assert len(client.queue) == 4 and client.dropped == 1
+        socket.gate.set()
+        await asyncio.sleep(0.01)
+        manager.disconnect(socket)
+        return socket, client
+
+    socket, client = asyncio.run(scenario())
+    received = [(m["type"], m.get("version", m.get("note"))) for m in socket.messages()]
+    assert received == [("delta", 1), ("pulse", 61), ("pulse", 62), ("delta", 2), ("pulse", 63)]
+    assert client.sent == 5
+
+
+def test_queue_full_of_state_updates_disconnects_the_client():
+    async def scenario():
+        manager = ConnectionManager(max_queue=2)
+        socket = GatedWebSocket()
+        client = await manager.connect(socket)
+        for version in (1, 2, 3):
+            manager.broadcast(delta(version))
+            await asyncio.sleep(0)
+        manager.broadcast(pulse(60))  # Nothing to make room: the pulse itself is dropped
+        assert socket in manager.clients and client.dropped == 1
+        manager.broadcast(delta(4))  # A state update can't be dropped, so the client is
+        assert socket not in manager.clients and client.closed
+        await asyncio.sleep(0)
+        return manager, socket
+
+    manager, socket = asyncio.run(scenario())
+    assert socket.closed and manager.stats["disconnected"] == 1
+    assert socket.messages() == []
+
+
+def test_stalled_send_times_out_and_drops_the_client():
+    async def scenario():
+        manager = ConnectionManager(send_timeout=0.05)
+        socket = GatedWebSocket()
+        await manager.connect(socket)
+        manager.broadcast(delta(1))
+        await asyncio.sleep(0.02)
+        assert socket in manager.clients
+        await asyncio.sleep(0.1)
+        return manager, socket
+
+    manager, socket = asyncio.run(scenario())
+    assert socket not in manager.clients and socket.closed
+    assert manager.stats["disconnected"] == 1
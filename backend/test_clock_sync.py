@@ -0,0 +1,59 @@
+import random
+
+from clock_sync import CLOCK_START, CLOCK_TICK, TICKS_PER_BEAT, ClockSync, PhaseLockedLoop
+from fractal_logic import FractalLogic
+from render import VirtualClock
+from state_manager import LobeState
+
+
+def ticks(bpm, count, start=0.0, jitter=0.0, seed=0):
+    rng = random.Random(seed)
+    period = 60.0 / (bpm * TICKS_PER_BEAT)
+    return [start + i * period + rng.uniform(-jitter, jitter) for i in range(count)]
+
+
+def test_pll_locks_through_jitter_and_recovers_from_tempo_jump():
+    pll = PhaseLockedLoop()
+    for t in ticks(120, TICKS_PER_BEAT * 8, jitter=0.001):
+        pll.update(t)
+    assert pll.locked
+    assert abs(pll.tempo - 120) < 0.5
+
+    # A sudden jump to 140 bpm drops lock, then the loop settles on the new tempo
+    jump = ticks(140, TICKS_PER_BEAT * 8, start=pll.last + 60.0 / (140 * TICKS_PER_BEAT), jitter=0.001, seed=1)
+    pll.update(jump[0])
+    pll.update(jump[1])
+    assert not pll.locked
+    for t in jump[2:]:
+        pll.update(t)
+    assert pll.locked
+    assert abs(pll.tempo - 140) < 0.5
+
+
+def test_clock_sync_publishes_one_grid_per_beat():
+    grids, transport = [], []
+    sync = ClockSync(on_transport=transport.append, on_grid=grids.append)
+    sync.on_message(CLOCK_START, 0.0)
+    for t in ticks(100, TICKS_PER_BEAT * 4 + 1):
+        sync.on_message(CLOCK_TICK, t)
+    assert transport == ["start"]
+    assert [g.beat for g in grids] == [1, 2, 3, 4]
+    assert abs(grids[-1].anchor - 4 * 0.6) < 0.005
+    assert abs(sync.tempo_for(120) - 100) < 0.5
+
+
+def test_align_snaps_deadlines_to_external_grid():
+    clock = VirtualClock()
+    logic = FractalLogic(clock=clock)
+    lobes = [LobeState(0, "A", division=2.0), LobeState(1, "B", division=1.0)]
+    logic.reschedule(120, lobes)
+    logic.tick(120, lobes, [60], now=0.0)
+
+    # External beat one lands at 0.013s at 118 bpm
+    logic.align(0.013, 118.0, lobes)
+    beat = 60.0 / 118.0
+    for key, deadline in logic._scheduled.items():
+        interval = beat if key in ("stem", 1) else beat / 2
+        offset = (deadline - 0.013) / interval
+        assert abs(offset - round(offset)) < 1e-9
+        assert deadline > 0.0
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import time
+
+from clock_sync import Grid
+from engine_process import KIND_NOTE, EngineClient, SharedStateBlock
+from state_manager import StateManager
+
+NAMES = (f"maple_test_state_{os.getpid()}", f"maple_test_events_{os.getpid()}")
+
+
+def test_oversized_state_is_logged_not_raised():
+    block = SharedStateBlock(NAMES[0], create=True, size=64)
+    client = EngineClient(*NAMES)
+    client.block = block
+    try:
+        client.publish(StateManager().snapshot)  # Doesn't fit in 64 bytes
+        assert block.read() == (-1, None)
+    finally:
+        block.close()
+
+
+def test_worker_runs_vector_engine_on_the_forwarded_grid():
+    # A separate interpreter, as in production, so attaching doesn't touch the worker's shared-memory tracking
+    env = {k: v for k, v in os.environ.items() if k != "MAPLE_JOURNAL"}
+    worker = subprocess.Popen([sys.executable, "-c", "from engine_process import run_worker; "
+                               "from midi_output import FakeMidiOut; "
+                               f"run_worker({NAMES[0]!r}, {NAMES[1]!r}, backend_factory=FakeMidiOut)"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env={**env, "MAPLE_ENGINE": "vector"})
+    client = EngineClient(*NAMES)
+    try:
+        deadline = time.monotonic() + 5.0
+        while not client.attach():
+            assert time.monotonic() < deadline, "worker did not come up"
+            time.sleep(0.01)
+        states = StateManager()
+        states.update_global({"tempo": 120})
+        states.update_lobe(0, {"probability": 1.0, "division": 4.0})
+        for lobe in range(1, 5):
+            states.update_lobe(lobe, {"active": False})
+        states.subscribe(client.publish)
+        client.publish_grid(Grid(time.monotonic() + 0.05, 150.0, 0, True))
+        states.update_global({"playing": True})
+        time.sleep(0.6)
+        times = [t for t, lobe_id, _, _, kind in client.ring.drain() if kind == KIND_NOTE and lobe_id == 0]
+    finally:
+        if client.block is not None:
+            client.stop_worker()
+        worker.wait(5.0)
+        client.close()
+
+    # The grid's 150 bpm replaced the state's 120: sixteenths 0.1 s apart
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert len(gaps) >= 3 and all(abs(gap - 0.1) < 1e-6 for gap in gaps)
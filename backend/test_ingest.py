@@ -0,0 +1,61 @@
+from ingest import Ingest, validate_state
+from state_manager import StateManager
+
+
+def make_ingest():
+    states = StateManager()
+    commits, applied = [], []
+    states.subscribe(lambda snapshot, delta: commits.append(delta))
+    return states, Ingest(states, applied.append, window=None), commits, applied
+
+
+def test_rejects_bad_types_without_touching_state():
+    states, ingest, commits, _ = make_ingest()
+    assert "division" in ingest.submit({"type": "update_lobe", "lobe": {"id": 0, "division": "2"}})
+    assert ingest.submit({"type": "update_lobe", "lobe": {"id": 0, "velocity": True}}) is not None
+    assert ingest.submit({"type": "update_lobe", "lobe": {"id": 99, "velocity": 1}}) is not None
+    assert ingest.submit({"type": "update_global", "updates": {"tempo": "fast"}}) is not None
+    assert ingest.submit({"type": "update_global", "updates": {"selected_notes": [60, 200]}}) is not None
+    assert not ingest.flush()
+    assert commits == [] and ingest.stats["rejected"] == 5
+
+
+def test_storm_merges_into_one_commit_per_flush():
+    states, ingest, commits, applied = make_ingest()
+    for i in range(50):
+        ingest.submit({"type": "update_lobe", "lobe": {"id": 0, "probability": i / 100}})
+    ingest.submit({"type": "update_lobe", "lobe": {"id": 0, "division": 4.0}})
+    ingest.submit({"type": "update_lobe", "lobe": {"id": 2, "transpose": 7}})
+    ingest.submit({"type": "update_global", "updates": {"tempo": 90}})
+    ingest.submit({"type": "update_global", "updates": {"tempo": 100}})
+
+    assert ingest.flush()
+    assert len(commits) == 1
+    assert commits[0]["lobes"] == [{"id": 0, "probability": 0.49, "division": 4.0}, {"id": 2, "transpose": 7}]
+    assert commits[0]["global"] == {"tempo": 100}
+    assert applied == [{"tempo": 100}]
+    assert ingest.stats["merged"] == 51 and ingest.stats["commits"] == 1
+
+
+def test_newest_message_wins_even_when_it_restores_the_committed_value():
+    states, ingest, commits, applied = make_ingest()
+    # Play then stop from another client within one window: stopped
+    ingest.submit({"type": "update_global", "updates": {"playing": True}})
+    ingest.submit({"type": "update_global", "updates": {"playing": False}})
+    ingest.submit({"type": "update_lobe", "lobe": {"id": 1, "probability": 0.9, "velocity": 90}})
+    ingest.submit({"type": "update_lobe", "lobe": {"id": 1, "probability": 0.5}})
+    assert ingest.flush()
+    assert commits == [{"type": "delta", "version": 1, "lobes": [{"id": 1, "velocity": 90}], "global": {}}]
+    assert not states.state.playing and applied == [{}]
+
+
+def test_validate_state_checks_whole_states_against_the_schemas():
+    good = StateManager().state.to_dict()
+    assert validate_state(good) is None
+    bad = {**good, "lobes": [dict(lobe) for lobe in good["lobes"]]}
+    bad["lobes"][2]["division"] = "2"
+    assert validate_state(bad) == "lobe 2: invalid division: '2'"
+    assert validate_state({**good, "tempo": 0}) is not None
+    assert validate_state({**good, "lobes": good["lobes"][1:]}) is not None  # ids must follow positions
+    assert validate_state({"lobes": [{"id": 0}]}) is not None
+    assert validate_state([]) is not None
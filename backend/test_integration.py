@@ -12,7 +12,7 @@ async def test_integration():
         response = await websocket.recv()
         data = json.loads(response)
         if data['type'] == 'init':
-            print("Received INIT:", len(data['lobes']), "lobes")
+            print("Received INIT:", len(data['state']['lobes']), "lobes")
         else:
             print("FAILED: Did not receive INIT")
             sys.exit(1)
@@ -41,9 +41,9 @@ async def test_integration():
         while True:
             response = await websocket.recv()
             data = json.loads(response)
-            if data['type'] == 'state_update':
-                if data['lobe']['id'] == 0 and data['lobe']['probability'] == 0.99:
-                    print("Received correct STATE_UPDATE")
+            if data['type'] == 'delta':
+                if any(l['id'] == 0 and l.get('probability') == 0.99 for l in data['lobes']):
+                    print("Received correct DELTA")
                     break
             elif data['type'] == 'pulse':
                 continue # ignore pulses while waiting
@@ -0,0 +1,71 @@
+import os
+from collections import Counter
+
+import mido
+
+from broadcast import ConnectionManager
+from fractal_logic import FractalLogic
+from journal import NOTE_OFF, NOTE_ON, PANIC, STATE, STEM, Journal, read_journal, read_journals, replay_to_midi
+from midi_engine import MidiEngine
+from midi_output import FakeMidiOut
+from sessions import Session
+from state_manager import StateManager
+
+
+def test_records_round_trip_and_rotate_without_overwriting(tmp_path):
+    journal = Journal(str(tmp_path), max_bytes=32 * 8)
+    journal.note_on(1.0, 2, 60, 100, lobe_id=3, port=1)
+    journal.note_off(1.5, 2, 60)
+    journal.stem(2.0)
+    journal.state(2.5, 7, {"type": "delta", "global": {"tempo": 90}})
+    journal.panic(3.0)
+    for i in range(10):
+        journal.stem(4.0 + i)  # Forces rotation
+    journal.close()
+    assert len(journal.files) > 1
+
+    events = list(read_journals(journal.files))
+    assert [e.kind for e in events[:5]] == [NOTE_ON, NOTE_OFF, STEM, STATE, PANIC]
+    assert events[0][:7] == (1.0, NOTE_ON, 2, 60, 100, 3, 1) and events[1].lobe_id is None
+    assert events[3].version == 7 and events[3].payload == {"type": "delta", "global": {"tempo": 90}}
+    assert len(events) == 15
+
+    # A restart within the same second picks new names instead of truncating
+    again = Journal(str(tmp_path), max_bytes=32 * 8)
+    again.stem(99.0)
+    again.close()
+    assert not set(again.files) & set(journal.files)
+    assert len(list(read_journals(journal.files))) == 15
+    assert [e.t for e in read_journal(again.files[0])] == [99.0]
+
+
+def test_stop_during_playback_exports_balanced_midi(tmp_path):
+    journal = Journal(str(tmp_path), prefix="maple-test")
+    states = StateManager()
+    for lobe in range(5):
+        states.update_lobe(lobe, {"probability": 1.0, "instrument_channel": lobe})
+    midi = MidiEngine(FakeMidiOut)
+    midi.journal = journal
+    session = Session("test", states, midi, FractalLogic(), ConnectionManager(), journal=journal)
+
+    states.update_global({"playing": True})
+    session.follow(states.snapshot)
+    session.step(session.logic.clock() + 0.6)
+    assert midi.next_note_off() is not None  # Notes are sounding when playback stops
+    states.update_global({"playing": False})
+    session.follow(states.snapshot)
+    journal.close()
+    midi.close()
+
+    events = list(read_journals(journal.files))
+    assert [e.kind for e in events if e.kind in (NOTE_ON, NOTE_OFF, PANIC)][-1] == PANIC
+    path = os.path.join(str(tmp_path), "replay.mid")
+    replay_to_midi(events).save(path)
+    balance = Counter()
+    for message in mido.MidiFile(path).tracks[0]:
+        if message.type == "note_on" and message.velocity > 0:
+            balance[(message.channel, message.note)] += 1
+        elif message.type in ("note_on", "note_off"):
+            balance[(message.channel, message.note)] -= 1
+    assert sum(1 for e in events if e.kind == NOTE_ON) == 5
+    assert set(balance.values()) == {0}
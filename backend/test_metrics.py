@@ -0,0 +1,64 @@
+import asyncio
+import sys
+import types
+
+import httpx
+import pytest
+
+from bench import FakeWebSocket
+from midi_output import FakeMidiOut
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    """main.py on a fake MIDI stack, with nothing written to the working directory."""
+    monkeypatch.setitem(sys.modules, "rtmidi", types.SimpleNamespace(MidiOut=FakeMidiOut))
+    monkeypatch.setenv("MAPLE_PRESET_DB", str(tmp_path / "presets.db"))
+    for name in ("MAPLE_ENGINE", "MAPLE_ENGINE_PROCESS", "MAPLE_JOURNAL", "MAPLE_CLOCK", "MAPLE_AUTOSAVE"):
+        monkeypatch.delenv(name, raising=False)
+    import main
+    return main
+
+
+def parse(text):
+    """{'name{labels}': value} for every sample line of a Prometheus text scrape."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, value = line.rsplit(" ", 1)
+            samples[key] = float(value)
+    return samples
+
+
+def test_metrics_scrape_after_playing(app_module):
+    main = app_module
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            socket = FakeWebSocket()
+            await main.manager.connect(socket)
+            main.state_manager.update_many({0: {"probability": 1.0, "division": 4.0}}, {"playing": True})
+            await asyncio.sleep(0.5)
+            main.state_manager.update_global({"playing": False})
+            await asyncio.sleep(0.01)
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://maple") as client:
+                response = await client.get("/metrics")
+            main.manager.disconnect(socket)
+            return response
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    samples = parse(text)
+
+    assert "# TYPE maple_notes_total counter" in text
+    assert samples['maple_notes_total{lobe="0"}'] >= 3
+    # Note lateness (jitter) and tick intervals as cumulative histograms
+    for name in ("maple_event_lateness_seconds", "maple_tick_interval_seconds", "maple_client_queue_depth"):
+        assert f"# TYPE {name} histogram" in text
+        assert samples[f'{name}_bucket{{le="+Inf"}}'] == samples[f"{name}_count"] > 0
+    assert 'maple_client_queue_depth_bucket{le="0"}' in samples
+    assert samples["maple_clients"] == 1 and samples["maple_state_version"] >= 2
+    assert samples["maple_voices_active"] == 0
@@ -0,0 +1,108 @@
+from midi_engine import MidiEngine
+from midi_ports import PortInfo
+from midi_output import FakeMidiOut, encode_note_off, encode_note_on
+
+
+def wire(out):
+    out.output.flush()
+    return out.midi_out.sent
+
+
+def test_retrigger_keeps_note_until_last_voice_ends():
+    engine = MidiEngine(FakeMidiOut)
+    try:
+        out = engine.send_note_on(0, 60, 100, lobe_id=1)
+        engine.schedule_note_off(0, 60, 1.0, out, 1)
+        engine.send_note_on(0, 60, 90, lobe_id=1)
+        engine.schedule_note_off(0, 60, 2.0, out, 1)
+        assert out.active[60] == 2
+
+        # The first note's timer must not cut the retriggered note short
+        engine.flush_note_offs(1.5)
+        assert wire(out) == [encode_note_on(0, 60, 100), encode_note_off(0, 60), encode_note_on(0, 60, 90)]
+        engine.flush_note_offs(2.5)
+        assert wire(out)[-1] == encode_note_off(0, 60) and len(wire(out)) == 4
+        assert not engine.voices and not any(out.active)
+    finally:
+        engine.close()
+
+
+def test_polyphony_caps_steal_oldest_voice():
+    engine = MidiEngine(FakeMidiOut, voice_limit=4, lobe_voice_limit=2)
+    try:
+        for note in (60, 62, 64):
+            out = engine.send_note_on(0, note, 100, lobe_id=1)
+            engine.schedule_note_off(0, note, 10.0, out, 1)
+        assert encode_note_off(0, 60) in wire(out)
+        assert [v[1] for v in engine.voices.values()] == [62, 64]
+
+        # The global cap steals the oldest voice of any lobe
+        for lobe_id, note in ((2, 70), (3, 72), (4, 74)):
+            engine.send_note_on(1, note, 100, lobe_id=lobe_id)
+        assert encode_note_off(0, 62) in wire(out)
+        assert len(engine.voices) == 4 and engine.note_off_stats["stolen"] == 2
+        # Stolen voices' timers are skipped rather than sent twice
+        sent = len(wire(out))
+        engine.flush_note_offs(11.0)
+        assert len(wire(out)) == sent + 1  # only 64 was still sounding from lobe 1
+    finally:
+        engine.close()
+
+
+def test_stop_and_port_switch_release_only_sounding_notes():
+    engine = MidiEngine(FakeMidiOut)
+    try:
+        virtual = engine.send_note_on(0, 60, 100, lobe_id=0)
+        engine.send_note_on(3, 50, 100, lobe_id=0)
+        routed = engine.send_note_on(0, 40, 100, port="Fake Synth B", lobe_id=1)
+        engine.open_port(0)
+        assert wire(virtual)[-2:] == [encode_note_off(0, 60), encode_note_off(3, 50)]
+
+        hardware = engine.send_note_on(0, 61, 100, lobe_id=0)
+        engine.all_notes_off()
+        assert wire(hardware)[-1] == encode_note_off(0, 61)
+        assert wire(routed) == [encode_note_on(0, 40, 100), encode_note_off(0, 40)]
+        assert not engine.voices
+    finally:
+        engine.close()
+
+
+def test_fallback_to_virtual_releases_the_old_default():
+    engine = MidiEngine(FakeMidiOut)
+    try:
+        engine.open_port(1)
+        hardware = engine.send_note_on(0, 60, 100, lobe_id=0)
+        engine.schedule_note_off(0, 60, 5.0, hardware, 0)
+        assert not engine.open_port(7)
+        assert engine.default is not hardware
+        assert wire(hardware)[-1] == encode_note_off(0, 60) and not engine.voices
+
+        # No ports open at all: stopping still drops pending note-offs
+        engine.close()
+        engine.schedule_note_off(0, 62, 5.0)
+        engine.all_notes_off()
+        assert engine.next_note_off() is None
+    finally:
+        engine.close()
+
+
+def test_lobes_follow_their_device_across_hotplug_changes():
+    engine = MidiEngine(FakeMidiOut)
+    try:
+        synth = engine.send_note_on(0, 60, 100, port="Fake Synth B", lobe_id=1)
+        assert synth.name == "Fake Synth B" and engine.port_index("Fake Synth B") == 1
+
+        # Synth A unplugged: Synth B moves to index 0 and keeps its output and voices
+        engine.ports.ports = (PortInfo(0, "Fake Synth B"),)
+        engine.prune(engine.ports.ports)
+        assert engine.route("Fake Synth B") is synth and engine.port_index("Fake Synth B") == 0
+        assert len(engine.voices) == 1
+
+        # Synth B unplugged too: its voices end, its output closes and the lobe plays on the default
+        engine.ports.ports = ()
+        engine.prune(engine.ports.ports)
+        assert list(engine.pool) == [None] and not engine.voices
+        assert wire(synth)[-1] == encode_note_off(0, 60)
+        assert engine.route("Fake Synth B") is engine.default
+    finally:
+        engine.close()
@@ -0,0 +1,51 @@
+from midi_engine import OutputPort
+from midi_output import FakeMidiOut, MidiOutput, RingBuffer, encode_note_on
+
+
+class FlakyMidiOut(FakeMidiOut):
+    """Raises on every note below 60."""
+
+    def send_message(self, message):
+        if message[1] < 60:
+            raise OSError("device gone")
+        super().send_message(message)
+
+
+def test_ring_wraps_around_and_refuses_puts_when_full():
+    ring = RingBuffer(3)
+    assert ring.capacity == 4
+    for round_start in range(0, 40, 4):
+        assert all(ring.put(round_start + i) for i in range(4))
+        assert not ring.put("overflow") and len(ring) == 4
+        assert ring.take(3) == [round_start, round_start + 1, round_start + 2]
+        assert ring.take(10) == [round_start + 3] and len(ring) == 0
+
+
+def test_full_ring_drops_new_messages():
+    output = MidiOutput(FakeMidiOut(), capacity=2)  # Not started, so nothing drains
+    assert output.send((0x90, 60, 100)) and output.send((0x90, 61, 100))
+    assert not output.send((0x90, 62, 100))
+    assert output.send_many([(0x90, 63, 100), (0x90, 64, 100)]) == 0
+    assert output.stats["dropped"] == 3
+
+
+def test_failed_sends_are_counted_as_errors_not_sent():
+    backend = FlakyMidiOut()
+    output = MidiOutput(backend)
+    output.send_many([encode_note_on(0, note, 100) for note in (58, 59, 60, 61)])
+    output.flush()
+    assert output.stats["sent"] == 2 and output.stats["errors"] == 2
+    assert backend.sent == [encode_note_on(0, 60, 100), encode_note_on(0, 61, 100)]
+
+
+def test_close_flushes_everything_queued_before_closing_the_port():
+    midi_out = FakeMidiOut(send_delay=0.0005)
+    midi_out.open_port(0)
+    closed_with = []
+    close_port = midi_out.close_port
+    midi_out.close_port = lambda: (closed_with.append(len(midi_out.sent)), close_port())
+    port = OutputPort(midi_out, "Fake Synth A")
+    for i in range(200):
+        port.send(encode_note_on(i & 0x0F, i & 0x7F, 100))
+    port.close()
+    assert closed_with == [200] and port.output.stats["sent"] == 200
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from midi_output import FakeMidiOut
+from midi_ports import PortInfo, PortRegistry
+
+
+def test_watch_logs_a_missing_backend_once_and_backs_off(caplog):
+    attempts = []
+    available = []
+
+    def backend_factory():
+        attempts.append(None)
+        if not available:
+            raise ImportError("libasound.so.2: cannot open shared object file")
+        return FakeMidiOut(["Synth"])
+
+    registry = PortRegistry(backend_factory)
+    changes = []
+
+    async def scenario():
+        watcher = asyncio.create_task(registry.watch(changes.append, interval=0.01, max_interval=0.04))
+        await asyncio.sleep(0.3)
+        failed = len(attempts)
+        available.append(True)  # The MIDI stack shows up
+        await asyncio.sleep(0.1)
+        watcher.cancel()
+        return failed
+
+    with caplog.at_level(logging.INFO, logger="maple.midi.ports"):
+        failed = asyncio.run(scenario())
+    # 0.01 s polling would have tried ~30 times; backing off to 0.04 s keeps it under 10
+    assert 3 <= failed <= 10
+    warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 1 and "backing off" in warnings[0].getMessage()
+    assert any("recovered" in r.getMessage() for r in caplog.records)
+    assert changes == [(PortInfo(0, "Synth"),)]
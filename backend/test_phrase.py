@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from bench import TIMING
+from phrase import Grammar, LobePhrase, PhraseLogic
+from render import VirtualClock, render_events
+from state_manager import AppState, LobeState, compile_lobe
+
+SCALE = [60, 62, 65, 67, 72, 74, 76, 79]
+
+
+def test_phrase_render_is_deterministic_and_follows_lobe_settings():
+    state = AppState(lobes=[LobeState(0, "Low", probability=0.5, division=2.0, register="low", transpose=-12,
+                                      instrument_channel=0),
+                            LobeState(1, "High", probability=1.0, division=3.0, register="high",
+                                      instrument_channel=1)], tempo=120)
+    seconds = 16 * 2.0
+    events = render_events(state, seconds, seed=3, engine="phrase")
+    assert events == render_events(state, seconds, seed=3, engine="phrase")
+    assert events != render_events(state, seconds, seed=4, engine="phrase")
+
+    ons = [e for e in events if e[1]]
+    low = [note for _, _, channel, note, _ in ons if channel == 0]
+    high = [note for _, _, channel, note, _ in ons if channel == 1]
+    # probability 1.0 fires on every beat; 0.5 on roughly half
+    assert abs(len(high) - 16 * 4 * 3) <= 1
+    assert 0.3 < len(low) / (16 * 4 * 2) < 0.7
+    pools = {n % 12 for n in state.selected_notes}
+    assert {n % 12 for n in low + high} <= pools
+
+
+def test_tick_reads_buffers_and_edits_apply_to_unplayed_notes():
+    clock = VirtualClock()
+    logic = PhraseLogic(clock=clock)
+    plan = [compile_lobe(LobeState(0, "A", probability=1.0, division=1.0), SCALE)]
+    logic.reschedule(120, plan)
+    phrase = logic.phrases[0]
+    assert len(phrase.buffer) == phrase.ahead == 8
+    expected = phrase.buffer[0][0]
+    clock.now = 0.5
+    notes = [e["note"] for e in logic.tick(120, plan, SCALE, now=0.5) if e["type"] == "note"]
+    assert notes == [expected] and len(phrase.buffer) == 7
+
+    # A transpose edit re-expands the buffered steps from the same place in the phrase
+    upcoming = [note for note, *_ in phrase.buffer]
+    plan = [compile_lobe(LobeState(0, "A", probability=1.0, division=1.0, transpose=5), SCALE)]
+    logic.reschedule(120, plan)
+    assert [note for note, *_ in phrase.buffer][:7] == [n + 5 for n in upcoming]
+
+
+@pytest.mark.skipif(not TIMING, reason="timing assertions need MAPLE_BENCH=1")
+def test_expansion_cost_is_bounded_by_depth():
+    def per_step(depth):
+        phrase = LobePhrase(Grammar.generate("bench", 2, depth))
+        phrase.configure(SCALE, 0.7, 0)
+        phrase.position = phrase.grammar.length // 3
+        start = time.perf_counter()
+        phrase.fill(20000)
+        return time.perf_counter() - start
+
+    shallow, deep = min(per_step(8) for _ in range(3)), min(per_step(64) for _ in range(3))
+    # 2**64 steps deep costs a few extra levels of descent per memoized chunk, not exponential work
+    assert deep < shallow * 5
@@ -0,0 +1,59 @@
+import asyncio
+
+from preset_store import Autosaver, PresetStore
+from state_manager import StateManager
+
+
+def test_lru_is_bounded_and_keeps_recent_loads(tmp_path):
+    store = PresetStore(str(tmp_path / "presets.db"), cache_size=2)
+    try:
+        for name in ("a", "b", "c"):
+            store.save_sync(name, {"tempo": ord(name)})
+        assert list(store.cache) == ["b", "c"]
+
+        async def scenario():
+            assert await store.load("b") == {"tempo": ord("b")}  # Hit, now most recent
+            assert await store.load("a") == {"tempo": ord("a")}  # Miss, evicts c
+        asyncio.run(scenario())
+        assert list(store.cache) == ["b", "a"]
+        assert store.stats["hits"] == 1 and store.stats["misses"] == 1
+    finally:
+        store.close()
+
+
+def test_wal_round_trip_across_reopen(tmp_path):
+    path = str(tmp_path / "presets.db")
+    store = PresetStore(path)
+    state = StateManager().state.to_dict()
+    store.save_sync("set one", state, tags=["live", " live ", ""])
+    assert store._db().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    store.close()
+
+    reopened = PresetStore(path)
+    try:
+        assert reopened.load_sync("set one") == state
+        assert [p["tags"] for p in reopened.list_sync(tag="live")] == [["live"]]
+        assert reopened.delete_sync("set one") and reopened.load_sync("set one") is None
+    finally:
+        reopened.close()
+
+
+def test_autosave_debounces_a_burst_into_one_write(tmp_path):
+    store = PresetStore(str(tmp_path / "presets.db"))
+    states = StateManager()
+    autosaver = Autosaver(store, delay=0.05)
+    states.subscribe(autosaver.on_state_commit)
+
+    async def scenario():
+        for tempo in range(100, 110):
+            states.update_global({"tempo": tempo})
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.15)
+
+    try:
+        asyncio.run(scenario())
+        assert store.stats["writes"] == 1
+        assert autosaver.saved_version == states.version
+        assert store.load_sync("autosave")["tempo"] == 109
+    finally:
+        store.close()
@@ -0,0 +1,51 @@
+import os
+import re
+import struct
+
+import pytest
+
+from pulse_stream import FRAME_VERSION, HEADER, RECORD, PulseStream, decode_frame, encode_frame
+
+FRONTEND_DECODER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "src", "pulseFrame.js")
+
+
+def test_round_trip_uses_the_layout_the_frontend_parses():
+    pulses = [(0, 60, 100, 10.0), (4, 127, 1, 10.0125), (65535, 0, 127, 9.99)]
+    frame = encode_frame(10.0, pulses, stem_pulses=2)
+    assert HEADER.size == 12 and RECORD.size == 8
+    assert len(frame) == 12 + 8 * len(pulses)
+
+    frame_time, stem_pulses, decoded = decode_frame(frame)
+    assert (frame_time, stem_pulses) == (10.0, 2)
+    assert [p[:3] for p in decoded] == [p[:3] for p in pulses]
+    assert all(abs(a[3] - b[3]) < 1e-6 for a, b in zip(decoded, pulses))
+
+    # Field by field at the offsets pulseFrame.js reads
+    assert frame[0] == FRAME_VERSION and frame[1] == 2
+    assert struct.unpack_from("<H", frame, 2)[0] == 3 and struct.unpack_from("<d", frame, 4)[0] == 10.0
+    second = 12 + 8
+    assert struct.unpack_from("<H", frame, second)[0] == 4
+    assert (frame[second + 2], frame[second + 3]) == (127, 1)
+    assert abs(struct.unpack_from("<f", frame, second + 4)[0] - 0.0125) < 1e-6
+
+
+def test_frontend_decoder_constants_match():
+    with open(FRONTEND_DECODER) as f:
+        source = f.read()
+    constants = dict(re.findall(r"(PULSE_FRAME_VERSION|HEADER_SIZE|RECORD_SIZE) = (\d+);", source))
+    assert constants == {"PULSE_FRAME_VERSION": str(FRAME_VERSION), "HEADER_SIZE": str(HEADER.size),
+                         "RECORD_SIZE": str(RECORD.size)}
+
+
+def test_stream_packs_each_frame_once_and_rejects_unknown_versions():
+    stream = PulseStream(60)
+    assert stream.take_frame(1.0) is None
+    stream.add_pulse(1, 64, 90, 1.01)
+    for _ in range(300):
+        stream.add_stem_pulse()
+    frame = stream.take_frame(1.0)
+    assert decode_frame(frame)[1] == 255  # Stem count saturates at one byte
+    assert stream.take_frame(1.1) is None and stream.frames == 1
+
+    with pytest.raises(ValueError):
+        decode_frame(bytes([FRAME_VERSION + 1]) + frame[1:])
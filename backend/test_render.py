@@ -0,0 +1,40 @@
+import hashlib
+import io
+
+from render import render_midi, render_events
+from state_manager import AppState, LobeState
+
+
+def make_state():
+    return AppState(
+        lobes=[
+            LobeState(0, "Low", probability=0.8, division=2.0, register="low", transpose=-12),
+            LobeState(1, "High", probability=0.6, division=4.0, register="high", velocity=80),
+            LobeState(2, "Off", active=False),
+        ],
+        tempo=132,
+    )
+
+
+def midi_digest(seed):
+    buf = io.BytesIO()
+    render_midi(make_state(), bars=8, seed=seed).save(file=buf)
+    return hashlib.sha256(buf.getvalue()).hexdigest()
+
+
+def test_render_is_bit_identical_for_a_seed():
+    assert midi_digest(7) == midi_digest(7)
+    assert midi_digest(7) != midi_digest(8)
+
+
+def test_render_events_respect_lobe_settings():
+    seconds = 8 * 4 * 60.0 / 132
+    events = render_events(make_state(), seconds, seed=1)
+    note_ons = [e for e in events if e[1]]
+    note_offs = [e for e in events if not e[1]]
+    assert note_ons and len(note_ons) == len(note_offs)
+    assert all(t < seconds for t, *_ in note_ons)
+    # Lobe 1 alone fires up to 4 times per beat over 32 beats
+    assert len(note_ons) <= 32 * 2 + 32 * 4
+    assert all(vel in (100, 80) for _, _, _, _, vel in note_ons)
+    assert [t for t, *_ in events] == sorted(t for t, *_ in events)
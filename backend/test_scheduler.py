@@ -0,0 +1,81 @@
+import asyncio
+
+from scheduler import DeadlineQueue, JitterReport, LookaheadScheduler
+
+
+class SteppingClock:
+    """Advances by `step` every time it is read."""
+
+    def __init__(self, step: float = 0.0, now: float = 100.0):
+        self.now = now
+        self.step = step
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        self.now += self.step
+        return self.now
+
+
+def test_deadline_queue_pops_due_items_in_order():
+    queue = DeadlineQueue()
+    for deadline, item in ((3.0, "c"), (1.0, "a"), (2.0, {"b": 1}), (1.0, "a2"), (9.0, "late")):
+        queue.push(deadline, item)
+    assert queue.peek() == 1.0 and len(queue) == 5
+    # Equal deadlines keep push order; items themselves are never compared
+    assert queue.pop_due(3.0) == [(1.0, "a"), (1.0, "a2"), (2.0, {"b": 1}), (3.0, "c")]
+    assert queue.pop_due(3.0) == [] and queue.peek() == 9.0
+    queue.clear()
+    assert queue.peek() is None and len(queue) == 0
+
+
+def test_jitter_report_percentiles_and_ring_buffer():
+    report = JitterReport(max_samples=4)
+    for ms in (1, 2, 3, 4):
+        report.record(10.0, 10.0 + ms / 1000.0)
+    summary = report.summary()
+    assert summary["count"] == 4 and summary["samples"] == 4
+    assert round(summary["p50_ms"], 6) == 2.0 and round(summary["max_ms"], 6) == 4.0
+    # Once full, the oldest samples are overwritten
+    report.record(0.0, 0.010)
+    report.record(0.0, 0.020)
+    assert report.count == 6 and sorted(round(s, 6) for s in report.samples) == [0.003, 0.004, 0.01, 0.02]
+    report.reset()
+    assert report.summary() == {"count": 0, "samples": 0}
+
+
+def test_sleep_until_idle_and_wake_do_not_spin():
+    async def scenario():
+        clock = SteppingClock()
+        scheduler = LookaheadScheduler(clock=clock)
+        assert await scheduler.sleep_until(None, idle=0.01)
+        assert clock.reads == 0
+
+        asyncio.get_running_loop().call_later(0.01, scheduler.wake)
+        assert not await scheduler.sleep_until(clock.now + 60.0)
+        assert clock.reads == 1
+
+    asyncio.run(scenario())
+
+
+def test_sleep_until_spins_to_deadline_while_yielding():
+    async def scenario():
+        clock = SteppingClock(step=0.0001)
+        scheduler = LookaheadScheduler(spin=0.001, clock=clock)
+        others = 0
+
+        async def other_task():
+            nonlocal others
+            while True:
+                others += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(other_task())
+        deadline = clock.now + 0.0005
+        assert await scheduler.sleep_until(deadline)
+        task.cancel()
+        assert clock.now >= deadline
+        # The spin handed the loop to other tasks instead of blocking it
+        assert others >= clock.reads - 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,124 @@
+import asyncio
+
+from bench import FakeWebSocket
+from broadcast import ConnectionManager
+from clock_sync import Grid
+from fractal_logic import FractalLogic
+from midi_engine import MidiEngine
+from midi_output import FakeMidiOut
+from scheduler import JitterReport
+from sessions import Session, SessionHub
+from state_manager import StateManager
+
+
+class RecordingJournal:
+    def __init__(self):
+        self.kinds = []
+        self.lobe0 = []
+
+    def note_on(self, t, channel, note, velocity, lobe_id, port):
+        self.kinds.append("note_on")
+        if lobe_id == 0:
+            self.lobe0.append(t)
+
+    def stem(self, t):
+        self.kinds.append("stem")
+
+    def close(self):
+        self.kinds.append("close")
+
+
+class FixedClock:
+    """ClockSync stand-in with a grid at 150 bpm."""
+
+    def __init__(self, anchor):
+        self.grid = Grid(anchor, 150.0, 0, True)
+
+    def tempo_for(self, fallback):
+        return self.grid.tempo
+
+
+def test_hub_drives_an_added_session_through_the_shared_dispatch_path():
+    async def scenario():
+        states = StateManager()
+        states.update_global({"playing": True, "tempo": 120})
+        for lobe in range(5):
+            states.update_lobe(lobe, {"probability": 1.0, "division": 4.0})
+        journal = RecordingJournal()
+        session = Session("main", states, MidiEngine(FakeMidiOut), FractalLogic(), ConnectionManager(),
+                          journal=journal, jitter=JitterReport())
+        session.clock_sync = FixedClock(session.logic.clock() + 0.05)
+        await session.manager.connect(FakeWebSocket())
+
+        hub = SessionHub(backend_factory=FakeMidiOut, idle_timeout=0.0)
+        hub.add(session)
+        runner = asyncio.create_task(hub.run(evict_interval=0.05))
+        await asyncio.sleep(0.3)
+        hub.evict_idle(hub.clock() + 60.0)
+        assert hub.sessions["main"] is session  # Pinned sessions are never evicted
+
+        states.update_global({"playing": False})
+        await asyncio.sleep(0.05)
+        runner.cancel()
+        hub.close()
+        return session, journal
+
+    session, journal = asyncio.run(scenario())
+    assert "note_on" in journal.kinds and "stem" in journal.kinds
+    assert session.jitter.count == journal.kinds.count("note_on")
+    # The external clock's 150 bpm replaced the state's 120: sixteenths 0.1 s apart
+    gaps = [b - a for a, b in zip(journal.lobe0, journal.lobe0[1:])]
+    assert gaps and all(abs(gap - 0.1) < 1e-9 for gap in gaps[1:])
+    assert not session.playing
+    assert not session.midi.voices and session.midi.next_note_off() is None
+
+
+def test_failed_step_backs_off_and_restores_the_schedule(caplog):
+    async def scenario():
+        hub = SessionHub(backend_factory=FakeMidiOut, error_backoff=0.2)
+        session = hub.get("broken")
+        session.journal = RecordingJournal()
+        logic = session.logic
+        tick = logic.tick
+        fail_until = hub.clock() + 0.1
+
+        def failing_tick(tempo, lobes, scale, now=None):
+            if now < fail_until:
+                logic.deadlines.pop_due(now)  # Dies after taking the due lobes off the heap
+                raise RuntimeError("generator failed")
+            return tick(tempo, lobes, scale, now=now)
+
+        logic.tick = failing_tick
+        session.states.update_lobe(0, {"probability": 1.0, "division": 4.0})
+        session.states.update_global({"playing": True})
+        runner = asyncio.create_task(hub.run())
+        await asyncio.sleep(0.45)
+        runner.cancel()
+        hub.close()
+        return session
+
+    session = asyncio.run(scenario())
+    failures = [r for r in caplog.records if "Error in session broken" in r.getMessage()]
+    assert len(failures) == 1
+    # The failed tick took the stem pulse off the heap; after the backoff it is rescheduled
+    assert "stem" in session.journal.kinds and len(session.journal.lobe0) >= 3
+
+
+def test_ports_changed_reaches_every_session():
+    async def scenario():
+        hub = SessionHub(backend_factory=FakeMidiOut)
+        sockets = []
+        for session_id in ("a", "b"):
+            session = hub.get(session_id)
+            socket = FakeWebSocket(record=True)
+            await session.manager.connect(socket)
+            sockets.append(socket)
+            session.midi.send_note_on(0, 60, 100, port="Fake Synth B", lobe_id=0)
+        hub.ports_changed(())
+        await asyncio.sleep(0.05)
+        assert all(list(s.midi.pool) == [None] and not s.midi.voices for s in hub.sessions.values())
+        hub.close()
+        return sockets
+
+    for socket in asyncio.run(scenario()):
+        assert {"type": "ports_changed", "ports": []} in socket.messages()
@@ -0,0 +1,44 @@
+from dataclasses import replace
+
+from state_manager import AppState, LobeState, StateManager, diff_states
+
+
+def test_diff_states_reports_changed_fields_or_layout_change():
+    old = AppState(lobes=[LobeState(0, "A"), LobeState(1, "B")])
+    new = replace(old, tempo=90, lobes=[old.lobes[0], replace(old.lobes[1], velocity=64)])
+    assert diff_states(old, new) == {"lobes": [{"id": 1, "velocity": 64}], "global": {"tempo": 90}}
+    assert diff_states(old, old) == {"lobes": [], "global": {}}
+    assert diff_states(old, replace(old, lobes=old.lobes[:1])) is None
+
+
+def test_deltas_since_replays_history_until_it_is_exceeded():
+    states = StateManager(history=3)
+    start = states.version
+    for tempo in (100, 101, 102):
+        states.update_global({"tempo": tempo})
+    assert states.deltas_since(states.version) == []
+    assert [d["global"]["tempo"] for d in states.deltas_since(start)] == [100, 101, 102]
+    assert [d["version"] for d in states.deltas_since(start + 2)] == [start + 3]
+
+    # Older than the bounded history, or ahead of the server: full resync
+    states.update_lobe(0, {"probability": 0.9})
+    assert states.deltas_since(start) is None
+    assert states.deltas_since(states.version + 1) is None
+    assert len(states.deltas_since(start + 1)) == 3
+
+    # A layout change clears the history
+    states.replace_state(AppState(lobes=[LobeState(0, "Solo")]))
+    assert states.deltas_since(start + 4) is None
+
+
+def test_failing_listener_does_not_block_the_others():
+    states = StateManager()
+    seen = []
+
+    def broken(snapshot, delta):
+        raise RuntimeError("journal disk full")
+
+    states.subscribe(broken)
+    states.subscribe(lambda snapshot, delta: seen.append(snapshot.version))
+    states.update_global({"tempo": 99})
+    assert seen == [states.version] and states.state.tempo == 99
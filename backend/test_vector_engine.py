@@ -0,0 +1,67 @@
+import numpy as np
+
+from fractal_logic import FractalLogic
+from render import VirtualClock
+from state_manager import StateManager
+from vector_engine import VectorLobeEngine
+
+
+def run(engine, clock, states, edits, seconds=6.0, step=0.01):
+    """Ticks `engine` through `seconds` of virtual time, applying {time: (lobe updates, global updates)} edits."""
+    engine.reset_engine()
+    engine.reschedule(states.state.tempo, states.snapshot.plan)
+    notes, stems = [], []
+    pending = dict(edits)
+    for i in range(1, int(seconds / step) + 1):
+        clock.now = i * step
+        for at in [at for at in pending if at <= clock.now]:
+            states.update_many(*pending.pop(at))
+            engine.reschedule(states.state.tempo, states.snapshot.plan)
+        state = states.state
+        for event in engine.tick(state.tempo, states.snapshot.plan, state.selected_notes, now=clock.now):
+            if event["type"] == "stem_pulse":
+                stems.append(round(event["time"], 9))
+            else:
+                notes.append((round(event["time"], 9), event["lobe_id"], event["channel"], event["port"],
+                              event["note"], event["velocity"], round(event["duration"], 9)))
+    return sorted(notes), stems
+
+
+def states_for_parity():
+    states = StateManager()
+    states.update_global({"selected_notes": [60, 76]})  # One note per register, so picks can't differ
+    states.update_many({
+        0: {"probability": 1.0, "division": 1.0, "register": "low"},
+        1: {"probability": 1.0, "division": 2.0, "register": "high", "transpose": -3, "instrument_channel": 2},
+        2: {"probability": 1.0, "division": 4.0, "register": "low", "velocity": 64, "output_port": "Synth"},
+        3: {"probability": 1.0, "division": 0.5, "register": "high"},
+        4: {"active": False},
+    }, {})
+    return states
+
+
+def test_vector_engine_matches_the_scalar_engine():
+    edits = {
+        2.0: ({1: {"division": 4.0}, 4: {"active": True, "probability": 1.0, "register": "low"}}, {}),
+        3.5: ({}, {"tempo": 90}),
+        4.2: ({0: {"transpose": 5, "instrument_channel": 9}}, {}),
+    }
+    clock = VirtualClock()
+    scalar = run(FractalLogic(clock=clock), clock, states_for_parity(), edits)
+    clock = VirtualClock()
+    vector = run(VectorLobeEngine(clock=clock, seed=1), clock, states_for_parity(), edits)
+    assert scalar[0] and scalar[1]
+    assert vector == scalar
+
+
+def test_reschedule_rewrites_only_changed_rows():
+    states = states_for_parity()
+    engine = VectorLobeEngine(clock=VirtualClock())
+    engine.reschedule(120, states.snapshot.plan)
+    channel = engine.channel
+    states.update_lobe(3, {"velocity": 20})
+    engine.reschedule(120, states.snapshot.plan)
+    assert engine.channel is channel  # Arrays updated in place, not rebuilt
+    assert engine.velocity.tolist() == [100, 100, 64, 20, 100]
+    engine.align(0.0, 150.0, states.snapshot.plan)
+    assert np.allclose(engine.interval[:4], [0.4, 0.2, 0.1, 0.8])
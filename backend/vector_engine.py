@@ -0,0 +1,222 @@
+import logging
+import math
+import time
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("maple.vector")
+
+REGISTERS = {"all": 0, "low": 1, "high": 2}
+
+
+class VectorLobeEngine:
+    """
+    Structure-of-arrays drop-in for FractalLogic. Lobe parameters live in
+    NumPy arrays refreshed by `reschedule()`, and one tick does trigger
+    detection, probability draws and note picks for every due lobe in
+    batched calls. Event semantics match FractalLogic.tick.
+    """
+
+    def __init__(self, clock=time.monotonic, seed: Optional[int] = None):
+        self.clock = clock
+        self.rng = np.random.default_rng(seed)
+        self._scale_key = None
+        self.reset_engine()
+
+    def reset_engine(self):
+        """Resets all internal phases and timers for a clean start."""
+        now = self.clock()
+        self.last_tick = now
+        self.start_time = now
+        self.stem_last: Optional[float] = None
+        self.stem_next = now
+        self._lobes = None
+        self._load([], 120)
+        logger.info("VectorLobeEngine: Engine Reset")
+
+    def _load(self, lobes: List, tempo: int):
+        """
+        Refreshes lobe parameters and pending deadlines. Compiled plans reuse
+        the immutable LobePlan of every lobe an edit didn't touch, so when the
+        layout is unchanged only rows whose plan object changed are rewritten;
+        align() passes the same plan every beat and rewrites none.
+        """
+        previous = self._lobes
+        if previous is not None and len(previous) == len(lobes):
+            rows = () if lobes is previous else [i for i, (a, b) in enumerate(zip(previous, lobes)) if a is not b]
+            if all(lobes[i].id == previous[i].id for i in rows):
+                for i in rows:
+                    self._set_row(i, lobes[i])
+            else:
+                self._rebuild(lobes)
+        else:
+            self._rebuild(lobes)
+        self._lobes = lobes
+        self.interval = (60.0 / tempo) / np.maximum(0.1, self.division)
+        self.next_beat = self.last_beat + self.interval
+
+    def _rebuild(self, lobes: List):
+        old = dict(zip(self.ids.tolist(), self.last_beat.tolist())) if hasattr(self, "ids") else {}
+        n = len(lobes)
+        self.ids = np.fromiter((l.id for l in lobes), dtype=np.int64, count=n)
+        self.active = np.fromiter((l.active for l in lobes), dtype=bool, count=n)
+        self.division = np.fromiter((l.division for l in lobes), dtype=np.float64, count=n)
+        self.probability = np.fromiter((l.probability for l in lobes), dtype=np.float64, count=n)
+        self.transpose = np.fromiter((l.transpose for l in lobes), dtype=np.int64, count=n)
+        self.velocity = np.clip(np.fromiter((l.velocity for l in lobes), dtype=np.int64, count=n), 0, 127)
+        self.register = np.fromiter((REGISTERS.get(l.register, 0) for l in lobes), dtype=np.int64, count=n)
+        self.channel = np.fromiter((l.instrument_channel for l in lobes), dtype=np.int64, count=n)
+        # Port names; None routes to the selected port
+        self.port = np.array([l.output_port for l in lobes], dtype=object)
+        self.last_beat = np.fromiter((old.get(l.id, self.start_time) for l in lobes), dtype=np.float64, count=n)
+
+    def _set_row(self, i: int, lobe):
+        self.active[i] = lobe.active
+        self.division[i] = lobe.division
+        self.probability[i] = lobe.probability
+        self.transpose[i] = lobe.transpose
+        self.velocity[i] = max(0, min(127, lobe.velocity))
+        self.register[i] = REGISTERS.get(lobe.register, 0)
+        self.channel[i] = lobe.instrument_channel
+        self.port[i] = lobe.output_port
+
+    def reschedule(self, tempo: int, lobes: List):
+        """Reloads lobe parameters and recomputes every pending deadline."""
+        self._load(lobes, tempo)
+        if self.stem_last is not None:
+            self.stem_next = self.stem_last + 60.0 / tempo
+
+    def align(self, anchor: float, tempo: float, lobes: List):
+        """Snaps pending deadlines to an external beat grid; see FractalLogic.align."""
+        self._load(lobes, tempo)
+        snapped = anchor + np.round((self.next_beat - anchor) / self.interval) * self.interval
+        repeat = snapped <= self.last_beat + self.interval * 0.5
+        self.next_beat = np.where(repeat, snapped + self.interval, snapped)
+        beat = 60.0 / tempo
+        stem = anchor + round((self.stem_next - anchor) / beat) * beat
+        if self.stem_last is not None and stem <= self.stem_last + beat * 0.5:
+            stem += beat
+        self.stem_next = stem
+
+    def next_deadline(self) -> Optional[float]:
+        if self.active.any():
+            return min(self.stem_next, float(self.next_beat[self.active].min()))
+        return self.stem_next
+
+    def _pools(self, scale: List[int]):
+        # Register-filtered scales as a padded (3, max_len) table, rebuilt only when the scale changes
+        key = tuple(scale)
+        if key != self._scale_key:
+            groups = [list(scale), [n for n in scale if n < 72], [n for n in scale if n >= 72]]
+            width = max(1, max(len(g) for g in groups))
+            self._pool = np.zeros((3, width), dtype=np.int64)
+            for i, g in enumerate(groups):
+                self._pool[i, :len(g)] = g
+            self._pool_len = np.array([len(g) for g in groups], dtype=np.int64)
+            self._scale_key = key
+        return self._pool, self._pool_len
+
+    def tick_arrays(self, tempo: int, global_scale: List[int], now: float):
+        """Fires due lobes and returns (stem_deadline, lobe_ids, channels, ports, notes, velocities, durations, times)."""
+        stem = None
+        if self.stem_next <= now:
+            stem = self.stem_next
+            self.stem_last = stem
+            interval = 60.0 / tempo
+            nxt = stem + interval
+            if nxt <= now:
+                nxt += math.floor((now - nxt) / interval + 1) * interval
+            self.stem_next = nxt
+
+        due = np.flatnonzero(self.active & (self.next_beat <= now))
+        if due.size == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return stem, empty, empty, empty, empty, empty, np.empty(0), np.empty(0)
+
+        deadlines = self.next_beat[due]
+        interval = self.interval[due]
+        self.last_beat[due] = deadlines
+        nxt = deadlines + interval
+        late = nxt <= now
+        if late.any():
+            nxt[late] += np.floor((now - nxt[late]) / interval[late] + 1) * interval[late]
+        self.next_beat[due] = nxt
+
+        pool, pool_len = self._pools(global_scale if global_scale is not None else [])
+        reg = self.register[due]
+        lens = pool_len[reg]
+        draws = self.rng.random(due.size)
+        fire = (lens > 0) & (draws < self.probability[due])
+
+        idx = due[fire]
+        picks = (self.rng.random(idx.size) * lens[fire]).astype(np.int64)
+        notes = np.clip(pool[reg[fire], picks] + self.transpose[idx], 0, 127)
+        times = deadlines[fire]
+        order = np.argsort(times, kind="stable")
+        idx = idx[order]
+        return (stem, self.ids[idx], self.channel[idx], self.port[idx], notes[order], self.velocity[idx],
+                interval[fire][order] * 0.8, times[order])
+
+    def refill(self):
+        pass
+
+    def tick(self, tempo: int, lobes: List, global_scale: List[int], now: Optional[float] = None):
+        if now is None:
+            now = self.clock()
+        self.last_tick = now
+        stem, ids, channels, ports, notes, velocities, durations, times = self.tick_arrays(tempo, global_scale, now)
+
+        events = []
+        if stem is not None:
+            events.append({"type": "stem_pulse", "timestamp": time.time(), "time": stem})
+        events.extend(
+            {"type": "note", "lobe_id": i, "channel": c, "port": p, "note": n, "velocity": v,
+             "duration": d, "time": t}
+            for i, c, p, n, v, d, t in zip(ids.tolist(), channels.tolist(), ports.tolist(), notes.tolist(),
+                                           velocities.tolist(), durations.tolist(), times.tolist())
+        )
+        return events
+
+
+def benchmark(lobe_counts=(5, 500, 50000), tempo: int = 120, seconds: float = 10.0) -> dict:
+    """Simulated-time throughput of FractalLogic vs VectorLobeEngine at several lobe counts."""
+    import random
+    from fractal_logic import FractalLogic
+    from render import VirtualClock
+    from state_manager import LobeState
+
+    scale = [60, 62, 65, 67, 72, 74, 76, 79]
+    results = {}
+    for count in lobe_counts:
+        rnd = random.Random(count)
+        lobes = [
+            LobeState(i, f"Lobe {i}", probability=rnd.random(), division=rnd.choice([0.5, 1.0, 2.0, 4.0]),
+                      register=rnd.choice(["all", "low", "high"]), instrument_channel=i % 16)
+            for i in range(count)
+        ]
+        row = {}
+        for name, engine_cls in (("python", FractalLogic), ("vector", VectorLobeEngine)):
+            clock = VirtualClock()
+            engine = engine_cls(clock=clock)
+            engine.reschedule(tempo, lobes)
+            notes = ticks = 0
+            start = time.perf_counter()
+            while True:
+                deadline = engine.next_deadline()
+                if deadline is None or deadline >= seconds:
+                    break
+                clock.now = deadline
+                notes += sum(1 for e in engine.tick(tempo, lobes, scale, now=deadline) if e["type"] == "note")
+                ticks += 1
+            elapsed = time.perf_counter() - start
+            row[name] = {"ticks": ticks, "notes": notes, "seconds": elapsed,
+                         "realtime_factor": seconds / elapsed if elapsed else float("inf")}
+        results[count] = row
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    logging.basicConfig(level=logging.WARNING)
+    print(json.dumps(benchmark(), indent=4))
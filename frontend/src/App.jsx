@@ -3,6 +3,10 @@ import MapleLeaf from './components/MapleLeaf';
 import LobeControls from './components/LobeControls';
 import ScaleSelector from './components/ScaleSelector';
 import GlobalControls from './components/GlobalControls';
+import { decodePulseFrame } from './pulseFrame';
+
+// Pulses arrive as one packed binary frame per display frame
+const PULSE_FPS = 60;
 
 function App() {
   const [pulseQueue, setPulseQueue] = useState([]);
@@ -14,6 +18,8 @@ function App() {
   const [selectedLobeId, setSelectedLobeId] = useState(null);
   const [isUIHidden, setIsUIHidden] = useState(false);
   const ws = useRef(null);
+  const stateVersion = useRef(0);
+  const resyncPending = useRef(false);
   const idleTimer = useRef(null);
 
   useEffect(() => {
@@ -55,27 +61,62 @@ function App() {
 
   useEffect(() => {
     const connect = () => {
-      ws.current = new WebSocket('ws://localhost:8000/ws');
+      // ?session=<id> joins an independent session instead of the main performance
+      const session = new URLSearchParams(window.location.search).get('session');
+      ws.current = new WebSocket(session ? `ws://localhost:8000/ws/${encodeURIComponent(session)}` : 'ws://localhost:8000/ws');
+      ws.current.binaryType = 'arraybuffer';
 
       ws.current.onopen = () => {
         console.log('Connected to Maple Backend');
         setConnected(true);
+        ws.current.send(JSON.stringify({ type: 'subscribe_pulses', fps: PULSE_FPS }));
       };
 
       ws.current.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+          const frame = decodePulseFrame(event.data);
+          if (frame.pulses.length > 0) {
+            const now = Date.now();
+            setPulseQueue(prev => [...prev, ...frame.pulses.map((p, i) => ({ ...p, id: now + i + Math.random() }))]);
+          }
+          if (frame.stemPulses > 0) {
+            setStemPulse(prev => prev + frame.stemPulses);
+          }
+          return;
+        }
+
         const data = JSON.parse(event.data);
         if (data.type === 'pulse') {
           setPulseQueue(prev => [...prev, { ...data, id: Date.now() + Math.random() }]);
         } else if (data.type === 'stem_pulse') {
           setStemPulse(prev => prev + 1);
         } else if (data.type === 'init') {
+          stateVersion.current = data.version;
+          resyncPending.current = false;
           setLobes(data.state.lobes);
           setGlobalState(data.state);
           setPorts(data.ports);
-        } else if (data.type === 'state_update') {
-          setLobes(prev => prev.map(l => l.id === data.lobe.id ? { ...l, ...data.lobe } : l));
-        } else if (data.type === 'global_update') {
-          setGlobalState(prev => ({ ...prev, ...data.updates }));
+        } else if (data.type === 'ports_changed') {
+          setPorts(data.ports);
+        } else if (data.type === 'delta') {
+          if (data.version <= stateVersion.current) return;
+          if (data.version !== stateVersion.current + 1) {
+            // Missed a version: ask the server to replay or resend everything
+            if (!resyncPending.current) {
+              resyncPending.current = true;
+              ws.current.send(JSON.stringify({ type: 'resync', version: stateVersion.current }));
+            }
+            return;
+          }
+          stateVersion.current = data.version;
+          resyncPending.current = false;
+          if (data.lobes.length > 0) {
+            const changes = Object.fromEntries(data.lobes.map(l => [l.id, l]));
+            setLobes(prev => prev.map(l => changes[l.id] ? { ...l, ...changes[l.id] } : l));
+          }
+          if (Object.keys(data.global).length > 0) {
+            setGlobalState(prev => ({ ...prev, ...data.global }));
+          }
         }
       };
 
@@ -91,6 +132,11 @@ function App() {
   }, []);
 
   const handleLobeUpdate = (updatedLobe) => {
+    // Only the keys that changed: the server applies the newest value per key,
+    // so resending untouched ones could undo another client's edit
+    const current = lobes.find(l => l.id === updatedLobe.id) || {};
+    const changes = Object.fromEntries(Object.entries(updatedLobe).filter(([k, v]) => current[k] !== v));
+
     // Optimistic update
     setLobes(prev => prev.map(l => l.id === updatedLobe.id ? updatedLobe : l));
 
@@ -98,7 +144,7 @@ function App() {
     if (ws.current && ws.current.readyState === WebSocket.OPEN) {
       ws.current.send(JSON.stringify({
         type: 'update_lobe',
-        lobe: updatedLobe
+        lobe: { ...changes, id: updatedLobe.id }
       }));
     }
   };
@@ -210,6 +256,7 @@ function App() {
         {selectedLobeId !== null && (
           <LobeControls
             lobe={lobes.find(l => l.id === selectedLobeId)}
+            ports={ports}
             onUpdate={handleLobeUpdate}
             onClose={() => setSelectedLobeId(null)}
           />
@@ -1,6 +1,6 @@
 import React from 'react';
 
-const LobeControls = ({ lobe, onUpdate, onClose }) => {
+const LobeControls = ({ lobe, ports = [], onUpdate, onClose }) => {
     if (!lobe) return null;
 
     const handleChange = (field, value) => {
@@ -137,6 +137,22 @@ const LobeControls = ({ lobe, onUpdate, onClose }) => {
                                     </select>
                                 </div>
                             </div>
+                            <div className="p-4 bg-white/5 rounded-xl border border-white/10">
+                                <div className="text-xs font-bold opacity-70 mb-1">Port</div>
+                                <select
+                                    value={lobe.output_port ?? ''}
+                                    onChange={(e) => handleChange('output_port', e.target.value === '' ? null : e.target.value)}
+                                    className="w-full bg-black/40 border border-white/10 rounded-md p-1 text-[10px] focus:border-maple-leaf/50 outline-none appearance-none"
+                                >
+                                    <option value="">Global Output</option>
+                                    {ports.map((port) => (
+                                        <option key={port} value={port}>{port}</option>
+                                    ))}
+                                    {lobe.output_port != null && !ports.includes(lobe.output_port) && (
+                                        <option value={lobe.output_port}>{lobe.output_port} (disconnected)</option>
+                                    )}
+                                </select>
+                            </div>
                         </div>
                     </div>
                 </div>
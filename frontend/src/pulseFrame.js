@@ -0,0 +1,29 @@
+// Decoder for the binary pulse frames sent by backend/pulse_stream.py.
+// header: version u8, stem pulse count u8, record count u16, frame time f64
+// record: lobe_id u16, note u8, velocity u8, offset from frame time f32
+export const PULSE_FRAME_VERSION = 1;
+const HEADER_SIZE = 12;
+const RECORD_SIZE = 8;
+
+export const decodePulseFrame = (buffer) => {
+  const view = new DataView(buffer);
+  const version = view.getUint8(0);
+  if (version !== PULSE_FRAME_VERSION) {
+    throw new Error(`Unsupported pulse frame version ${version}`);
+  }
+  const stemPulses = view.getUint8(1);
+  const count = view.getUint16(2, true);
+  const frameTime = view.getFloat64(4, true);
+
+  const pulses = new Array(count);
+  for (let i = 0; i < count; i++) {
+    const offset = HEADER_SIZE + i * RECORD_SIZE;
+    pulses[i] = {
+      lobe_id: view.getUint16(offset, true),
+      note: view.getUint8(offset + 2),
+      velocity: view.getUint8(offset + 3),
+      time: frameTime + view.getFloat32(offset + 4, true),
+    };
+  }
+  return { frameTime, stemPulses, pulses };
+};